@@ -0,0 +1,179 @@
+"""Weight trend analytics for the Progress tab.
+
+Everything is computed with whole-array NumPy operations over the weight
+series. ``WeightTrend`` keeps its arrays between reruns and, when the series
+it is given only has new entries appended, computes just the new points.
+"""
+import copy
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# Smoothing factor of the exponentially smoothed trend (10% of each new weigh-in).
+TREND_ALPHA = 0.1
+# Weekly change (lbs) below which the trend counts as flat...
+PLATEAU_RATE = 0.2
+# ...and how many days it must stay flat to be called a plateau.
+PLATEAU_DAYS = 14
+# Days of history the goal projection is fitted on, and the slowest weekly
+# change still worth projecting from.
+PROJECTION_DAYS = 30
+MIN_PROJECTION_RATE = 0.05
+
+# EWMA is evaluated in blocks so (1 - alpha) ** -k never overflows.
+_BLOCK = 256
+
+Summary = namedtuple(
+    "Summary",
+    "trend avg7 avg30 weekly_rate plateau_days slope_per_day",
+)
+
+
+def _ewma(values, alpha, initial):
+    """Exponential smoothing ``s[t] = s[t-1] + alpha * (x[t] - s[t-1])``, vectorized.
+
+    Uses the closed form ``s[t] = d^(t+1) * s[-1] + alpha * d^t * sum(d^-k * x[k])``
+    with ``d = 1 - alpha``, block by block so the powers stay finite.
+    """
+    out = np.empty(len(values))
+    decay = 1.0 - alpha
+    state = initial
+    for start in range(0, len(values), _BLOCK):
+        block = values[start:start + _BLOCK]
+        k = np.arange(len(block))
+        grow = decay ** -k
+        shrink = decay ** k
+        out[start:start + len(block)] = state * decay * shrink + alpha * shrink * np.cumsum(block * grow)
+        state = out[start + len(block) - 1]
+    return out
+
+
+def _window_means(days, cumsum, window, lo=0):
+    """Mean of every entry in the trailing ``window`` calendar days, for entries lo.."""
+    idx = np.arange(lo, len(days))
+    first = np.searchsorted(days, days[lo:] - (window - 1), side="left")
+    return (cumsum[idx + 1] - cumsum[first]) / (idx + 1 - first)
+
+
+def _lagged(days, values, lag, lo=0):
+    """``values`` as of ``lag`` days before each entry (first entry if earlier)."""
+    prior = np.searchsorted(days, days[lo:] - lag, side="right") - 1
+    return values[np.maximum(prior, 0)]
+
+
+class WeightTrend:
+    """Trend, rolling averages, weekly rate and plateau state of a weight series."""
+
+    def __init__(self):
+        self.days = np.empty(0, dtype=np.int64)
+        self.weights = np.empty(0)
+        self.trend = np.empty(0)
+        self.avg7 = np.empty(0)
+        self.avg30 = np.empty(0)
+        self.weekly_rate = np.empty(0)
+        self.flat_since = np.empty(0, dtype=np.int64)
+        self._cumsum = np.zeros(1)
+
+    def update(self, days, weights):
+        """Bring the state in line with ``days``/``weights`` (sorted by day).
+
+        If the new series starts with the cached one only the appended tail is
+        computed; anything else (edits, back-dated entries) recomputes.
+        """
+        days = np.asarray(days, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+        n = len(self.days)
+        if len(days) < n or not (np.array_equal(days[:n], self.days) and np.array_equal(weights[:n], self.weights)):
+            self.__init__()
+            n = 0
+        if len(days) == n:
+            return self
+        self._extend(days, weights, n)
+        return self
+
+    def _extend(self, days, weights, lo):
+        new = weights[lo:]
+        new_days = days[lo:]
+        self.days, self.weights = days, weights
+        self._cumsum = np.concatenate((self._cumsum, self._cumsum[-1] + np.cumsum(new)))
+        # A fresh series is seeded with its first weight.
+        trend = _ewma(new, TREND_ALPHA, self.trend[-1] if lo else new[0])
+        self.trend = np.concatenate((self.trend, trend))
+        self.avg7 = np.concatenate((self.avg7, _window_means(days, self._cumsum, 7, lo)))
+        self.avg30 = np.concatenate((self.avg30, _window_means(days, self._cumsum, 30, lo)))
+        rate = trend - _lagged(days, self.trend, 7, lo)
+        self.weekly_rate = np.concatenate((self.weekly_rate, rate))
+
+        # flat_since: day the current run of flat weekly rates began, -1 if
+        # not flat. A run either continues from the cached tail or begins at
+        # an entry whose predecessor was not flat; a running maximum carries
+        # the latest beginning forward.
+        flat = np.abs(rate) < PLATEAU_RATE
+        carried = self.flat_since[lo - 1] if lo else -1
+        begins = flat & np.concatenate(([carried < 0], ~flat[:-1]))
+        latest = np.maximum.accumulate(np.where(begins, np.arange(len(flat)), -1))
+        since = np.where(latest >= 0, new_days[np.maximum(latest, 0)], carried)
+        self.flat_since = np.concatenate((self.flat_since, np.where(flat, since, -1)))
+
+    def summary(self):
+        if not len(self.days):
+            return None
+        plateau_days = 0
+        if self.flat_since[-1] >= 0:
+            plateau_days = int(self.days[-1] - self.flat_since[-1])
+        return Summary(
+            trend=float(self.trend[-1]),
+            avg7=float(self.avg7[-1]),
+            avg30=float(self.avg30[-1]),
+            weekly_rate=float(self.weekly_rate[-1]),
+            plateau_days=plateau_days if plateau_days >= PLATEAU_DAYS else 0,
+            slope_per_day=self.slope_per_day(),
+        )
+
+    def slope_per_day(self, window=PROJECTION_DAYS):
+        """Least-squares slope (lbs/day) of the trend over the last ``window`` days."""
+        first = np.searchsorted(self.days, self.days[-1] - (window - 1), side="left")
+        x = self.days[first:].astype(np.float64)
+        y = self.trend[first:]
+        if len(x) < 2 or np.ptp(x) == 0:
+            return 0.0
+        x = x - x.mean()
+        return float(np.dot(x, y - y.mean()) / np.dot(x, x))
+
+    def days_to_goal(self, goal):
+        """Days until the fitted line reaches ``goal``, or ``None`` if heading away."""
+        if not len(self.days):
+            return None
+        gap = goal - self.trend[-1]
+        slope = self.slope_per_day()
+        if gap == 0:
+            return 0
+        if abs(slope) * 7 < MIN_PROJECTION_RATE or np.sign(slope) != np.sign(gap):
+            return None
+        return int(np.ceil(gap / slope))
+
+
+_trends = OrderedDict()
+_trends_lock = threading.Lock()
+_MAX_TRENDS = 64
+
+
+def weight_trend(dates, weights, key=None):
+    """Return a snapshot of the cached ``WeightTrend`` for ``key`` updated with this series.
+
+    ``dates`` is anything ``numpy.datetime64`` understands (a datetime
+    Series, ISO strings, ...). Callers pass a ``key`` per distinct series
+    (e.g. database and range start) so each keeps its own incremental state.
+    """
+    days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+    # Sessions viewing the same series share (and update) one state.
+    with _trends_lock:
+        trend = _trends.pop(key, None) or WeightTrend()
+        _trends[key] = trend.update(days, weights)
+        while len(_trends) > _MAX_TRENDS:
+            _trends.popitem(last=False)
+        # update() replaces the arrays instead of writing into them, so a
+        # shallow copy taken under the lock keeps summary() and days_to_goal()
+        # consistent while other sessions update the shared state.
+        return copy.copy(trend)
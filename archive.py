@@ -0,0 +1,276 @@
+"""Columnar archive of old history, read through memory maps.
+
+``compact`` moves log entries dated before a horizon out of the SQLite
+tables into one ``.npy`` file per column under ``<database>.archive/``:
+dates as datetime64[D], measures as float64 and labels (activity types,
+routines, meal descriptions) as int32 codes into a list of categories. The
+manifest is the ``archive_manifest`` table of the database itself and is
+updated in the transaction that deletes the moved rows, so a crash during
+compaction leaves either the old archive or the new one in effect, never
+both or neither.
+
+The fetch functions in db.py merge archived rows with live ones, so callers
+don't see the split. Reading archived history copies slices of mapped
+arrays instead of parsing SQLite rows, and the live tables and their
+indexes stay small. daily_summary, daily_routines and food_history are not
+touched: they already count the archived entries.
+"""
+import glob
+import json
+import os
+import re
+import threading
+from collections import namedtuple
+from datetime import date, timedelta
+
+import numpy as np
+
+import db
+from timing import timer
+
+# compact() archives entries older than this many days unless told otherwise.
+HORIZON_DAYS = int(os.getenv("LITEWEIGHT_ARCHIVE_AFTER_DAYS", "365"))
+# Rows are read out of SQLite this many at a time while compacting.
+CHUNK_SIZE = 100_000
+
+# through: every archived row is dated before it. categories: {column: [labels]}.
+Entry = namedtuple("Entry", "generation rows through categories")
+
+_lock = threading.Lock()
+# db path -> {table: (generation, categories, {column: memory-mapped array})},
+# so neither the arrays nor the categories are reloaded until a compaction
+# makes a new generation. db.py drops a database's maps with its pooled
+# connections (see retain).
+_maps = {}
+
+
+def archive_dir(path=None):
+    return f"{path or db.current_database()}.archive"
+
+
+def _file(directory, table, generation, column):
+    return os.path.join(directory, f"{table}.{generation}.{column}.npy")
+
+
+def manifest(conn=None):
+    """``{table: Entry}`` for every table with archived rows."""
+    if conn is None:
+        with db.connection() as conn:
+            return manifest(conn)
+    return {
+        name: Entry(generation, rows, through, json.loads(categories))
+        for name, generation, rows, through, categories in conn.execute(
+            "SELECT name, generation, rows, through, categories FROM archive_manifest"
+        )
+    }
+
+
+def _cached(path, table, generation, categories):
+    # Called with _lock held. categories() is only called for a new generation.
+    tables = _maps.setdefault(path, {})
+    cached = tables.get(table)
+    if cached is None or cached[0] != generation:
+        cached = tables[table] = (generation, categories(), {})
+    return cached
+
+
+def get_entry(conn, table, path=None):
+    """``table``'s manifest ``Entry``, or ``None`` if nothing is archived."""
+    row = conn.execute(
+        "SELECT generation, rows, through, categories FROM archive_manifest WHERE name = ?", (table,)
+    ).fetchone()
+    if row is None:
+        return None
+    with _lock:
+        _, categories, _ = _cached(path or db.current_database(), table, row[0], lambda: json.loads(row[3]))
+    return Entry(*row[:3], categories)
+
+
+def _arrays(table, entry, path=None):
+    path = path or db.current_database()
+    with _lock:
+        _, _, arrays = _cached(path, table, entry.generation, lambda: entry.categories)
+        if not arrays:
+            directory = archive_dir(path)
+            arrays.update(
+                (column, np.load(_file(directory, table, entry.generation, column), mmap_mode="r"))
+                for column in db.COLUMNS[table]
+            )
+    return arrays
+
+
+def retain(paths):
+    """Drop the memory maps (an open file each) of every database not in ``paths``."""
+    with _lock:
+        for path in [path for path in _maps if path not in paths]:
+            del _maps[path]
+
+
+def _bounds(dates, start, end):
+    lo = 0 if start is None else int(np.searchsorted(dates, np.datetime64(db._iso(start), "D"), "left"))
+    hi = len(dates) if end is None else int(np.searchsorted(dates, np.datetime64(db._iso(end), "D"), "right"))
+    return lo, max(lo, hi)
+
+
+def _frame(entry, arrays, columns, lo, hi):
+    import pandas as pd
+
+    data = {}
+    for column in columns:
+        # Copy out of the map so frames outlive the file.
+        values = np.array(arrays[column][lo:hi])
+        if column == "date":
+            data[column] = values.astype(db.DTYPES["date"])
+        elif column in entry.categories:
+            data[column] = pd.Categorical.from_codes(values, entry.categories[column])
+        else:
+            data[column] = values.astype(db.DTYPES.get(column, values.dtype))
+    return pd.DataFrame(data)
+
+
+def read(table, entry, start=None, end=None, columns=None, path=None):
+    """Archived rows of ``table`` dated in [start, end] as a frame with db.DTYPES dtypes."""
+    with timer("archive.read"):
+        arrays = _arrays(table, entry, path)
+        lo, hi = _bounds(arrays["date"], start, end)
+        return _frame(entry, arrays, columns or db.COLUMNS[table], lo, hi)
+
+
+def iter_frames(table, entry, start=None, end=None, columns=None, chunk_size=db.FETCH_CHUNK_SIZE, path=None):
+    arrays = _arrays(table, entry, path)
+    lo, hi = _bounds(arrays["date"], start, end)
+    for i in range(lo, hi, chunk_size):
+        yield _frame(entry, arrays, columns or db.COLUMNS[table], i, min(i + chunk_size, hi))
+
+
+def iter_rows(table, entry, start=None, end=None, chunk_size=10_000, path=None):
+    """Yield lists of row tuples in ``COLUMNS[table]`` order, as SQLite would return them."""
+    arrays = _arrays(table, entry, path)
+    lo, hi = _bounds(arrays["date"], start, end)
+    for i in range(lo, hi, chunk_size):
+        j = min(i + chunk_size, hi)
+        columns = []
+        for column in db.COLUMNS[table]:
+            values = arrays[column][i:j]
+            if column == "date":
+                columns.append(np.datetime_as_string(values).tolist())
+            elif column in entry.categories:
+                labels = entry.categories[column]
+                columns.append([labels[code] if code >= 0 else None for code in values.tolist()])
+            else:
+                columns.append([None if v != v else v for v in values.tolist()])  # NaN was NULL
+        yield list(zip(*columns))
+
+
+def latest(table, entry, column, end=None, path=None):
+    """``(value, iso date)`` of the last archived row dated on or before ``end``, or ``None``."""
+    arrays = _arrays(table, entry, path)
+    i = _bounds(arrays["date"], None, end)[1] - 1
+    if i < 0:
+        return None
+    return arrays[column][i].item(), str(arrays["date"][i])
+
+
+def _encode(values, categories):
+    """int32 codes of ``values`` into ``categories``, extended with any new labels."""
+    import pandas as pd
+
+    known = set(categories)
+    categories = categories + [v for v in pd.unique(values[pd.notna(values)]) if v not in known]
+    return pd.Categorical(values, categories=categories).codes.astype(np.int32), categories
+
+
+def _read_old(conn, table, before, last_id):
+    """Column arrays of ``table``'s rows dated before ``before`` with id <= ``last_id``."""
+    columns = db.COLUMNS[table]
+    cursor = conn.execute(
+        f"SELECT {', '.join(columns)} FROM {table} WHERE date < ? AND id <= ? ORDER BY date, id",
+        (before, last_id),
+    )
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=object))
+    if not chunks:
+        return None
+    rows = np.concatenate(chunks)
+    return {column: rows[:, i] for i, column in enumerate(columns)}
+
+
+def _save(path, array):
+    # The files must be on disk before the manifest that points at them commits.
+    with open(path, "wb") as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _remove_old_files(directory, table, generation):
+    # The previous generation is kept for readers that looked at the manifest
+    # just before this compaction committed.
+    for path in glob.glob(os.path.join(directory, f"{table}.*.npy")):
+        match = re.fullmatch(rf"{re.escape(table)}\.(\d+)\..+\.npy", os.path.basename(path))
+        if match and int(match.group(1)) < generation - 1:
+            os.remove(path)
+
+
+def _compact_table(conn, path, table, before):
+    directory = archive_dir(path)
+    current = get_entry(conn, table, path)
+    last_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+    new = _read_old(conn, table, before, last_id)
+    if new is None:
+        return 0
+    old = _arrays(table, current, path) if current else {}
+    categories = dict(current.categories) if current else {}
+    arrays = {}
+    for column, values in new.items():
+        if column == "date":
+            values = values.astype("datetime64[D]")
+        elif db.DTYPES.get(column) == "category":
+            values, categories[column] = _encode(values, categories.get(column, []))
+        else:
+            values = values.astype(np.float64)  # None becomes NaN
+        arrays[column] = np.concatenate([old[column], values]) if current else values
+    split = len(old["date"]) if current else 0
+    if 0 < split and arrays["date"][split] < arrays["date"][split - 1]:
+        # Backdated entries logged after the last compaction: keep the archive in date order.
+        order = np.argsort(arrays["date"], kind="stable")
+        arrays = {column: values[order] for column, values in arrays.items()}
+
+    generation = current.generation + 1 if current else 1
+    for column, values in arrays.items():
+        _save(_file(directory, table, generation, column), values)
+    through = max(before, current.through) if current else before
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        if get_entry(conn, table, path) != current:
+            raise RuntimeError(f"{table} was compacted concurrently; try again")
+        conn.execute(
+            "INSERT INTO archive_manifest (name, generation, rows, through, categories) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET generation = excluded.generation, rows = excluded.rows, "
+            "through = excluded.through, categories = excluded.categories",
+            (table, generation, len(arrays["date"]), through, json.dumps(categories)),
+        )
+        conn.execute(f"DELETE FROM {table} WHERE date < ? AND id <= ?", (before, last_id))
+    db.invalidate(path, table)
+    _remove_old_files(directory, table, generation)
+    return len(new["date"])
+
+
+def compact(before=None):
+    """Move entries dated before ``before`` (default: HORIZON_DAYS ago) into the archive.
+
+    Returns ``{table: rows moved}``. Safe to run while the apps are up: rows
+    are copied out without holding the write lock, which is only taken to
+    swap the manifest and delete what was copied.
+    """
+    db.init_db()
+    db.flush_writes()
+    before = db._iso(before or date.today() - timedelta(days=HORIZON_DAYS))
+    path = db.current_database()
+    os.makedirs(archive_dir(path), exist_ok=True)
+    with db.connection(path) as conn:
+        return {table: _compact_table(conn, path, table, before) for table in db.TABLES}
@@ -0,0 +1,71 @@
+"""Full-history fetches before and after moving old entries to the archive.
+
+Fills a database with ``--rows`` synthetic entries over three years, times
+an uncached ``fetch_<table>()`` of every table, then archives everything
+older than ``--horizon`` days (archive.py) and times the same fetches, which
+now read most rows from memory-mapped arrays. Also reports the time to
+compact and the size of the live database.
+
+    python -m benchmarks.bench_archive [--rows 1000000] [--horizon 90]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+import archive
+import db
+from benchmarks import datagen
+
+RUNS = 5
+
+
+def _fetch_ms(table):
+    fetch = getattr(db, f"fetch_{table}")
+    times = []
+    for _ in range(RUNS):
+        db.query_cache.clear()
+        start = time.perf_counter()
+        fetch()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[RUNS // 2] * 1000
+
+
+def _live_mb():
+    with db.connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pages = conn.execute("PRAGMA page_count").fetchone()[0] - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return pages * conn.execute("PRAGMA page_size").fetchone()[0] / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--horizon", type=int, default=90, help="archive entries older than this many days")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "bench.db")
+        datagen.generate(args.rows)
+        before = {table: _fetch_ms(table) for table in db.TABLES}
+        live_before = _live_mb()
+
+        start = time.perf_counter()
+        moved = archive.compact(date.today() - timedelta(days=args.horizon))
+        compact_s = time.perf_counter() - start
+        after = {table: _fetch_ms(table) for table in db.TABLES}
+        archive_mb = sum(
+            os.path.getsize(os.path.join(archive.archive_dir(), name)) for name in os.listdir(archive.archive_dir())
+        ) / 1e6
+
+        print(f"Archived {sum(moved.values()):,} of {args.rows:,} rows older than {args.horizon} days "
+              f"in {compact_s:.1f}s")
+        print(f"  live tables {live_before:.1f} MB -> {_live_mb():.1f} MB (plus {archive_mb:.1f} MB of .npy files)")
+        for table in db.TABLES:
+            print(f"  fetch_{table:<11} {before[table]:8.1f} ms -> {after[table]:8.1f} ms  x{before[table] / after[table]:5.1f}")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
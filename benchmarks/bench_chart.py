@@ -0,0 +1,57 @@
+"""Weight chart payload and render time, full series vs. downsampled.
+
+Each case renders ``st.line_chart`` headlessly through Streamlit's AppTest
+and reports the size of the chart message sent to the browser and the
+server-side script time (browser drawing time scales with the payload).
+
+    python -m benchmarks.bench_chart [--sizes 1000 100000 1000000]
+"""
+import argparse
+import time
+
+from streamlit.testing.v1 import AppTest
+
+
+def chart_app(n, downsampled):
+    import numpy as np
+    import pandas as pd
+    import streamlit as st
+
+    from charts import downsample
+
+    rng = np.random.default_rng(0)
+    series = pd.Series(
+        180 - np.linspace(0, 20, n) + rng.normal(0, 1.5, n),
+        index=pd.date_range("2000-01-01", periods=n, freq="h"),
+        name="weight",
+    )
+    if downsampled:
+        series = downsample(series)
+    st.line_chart(series)
+
+
+def render(n, downsampled):
+    at = AppTest.from_function(chart_app, args=(n, downsampled), default_timeout=600)
+    start = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return at.get("vega_lite_chart")[0].proto.ByteSize(), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    render(100, False)  # warm up imports
+    for n in args.sizes:
+        for downsampled in (False, True):
+            size, elapsed = render(n, downsampled)
+            label = "downsampled" if downsampled else "full"
+            print(f"{n:>9,} points  {label:<11}  payload={size / 1e6:8.3f} MB  render={1000 * elapsed:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compare the old connect-per-call data access with the pooled WAL layer.
+
+    python -m benchmarks.bench_db [--rows 2000] [--threads 4]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+import db
+
+
+# The original implementation from main.py, kept here as the baseline.
+def legacy_insert_weight(path, weight, date):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute("INSERT INTO weights (weight, date) VALUES (?, ?)", (weight, date))
+    conn.commit()
+    conn.close()
+
+
+def legacy_fetch_weights(path):
+    conn = sqlite3.connect(path)
+    df = pd.read_sql_query("SELECT weight, date FROM weights ORDER BY date ASC", conn)
+    conn.close()
+    return df
+
+
+def pooled_insert_weight(path, weight, date):
+    db.insert_weight(weight, date)
+
+
+def pooled_fetch_weights(path):
+    db.query_cache.clear()
+    return db.fetch_weights()
+
+
+def cached_fetch_weights(path):
+    return db.fetch_weights()
+
+
+def _run_inserts(insert, path, rows, threads):
+    errors = []
+
+    def worker(n):
+        for i in range(n):
+            try:
+                insert(path, 150.0 + i % 20, f"2024-01-{i % 28 + 1:02d}")
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    per_thread = rows // threads
+    pool = [threading.Thread(target=worker, args=(per_thread,)) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed, len(errors)
+
+
+def _run_fetches(fetch, path, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fetch(path)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench(label, insert, fetch, path, rows, threads, repeat):
+    rate, errors = _run_inserts(insert, path, rows, threads)
+    latency = _run_fetches(fetch, path, repeat)
+    print(f"{label:<8} inserts/sec={rate:10.0f}  lock errors={errors:4d}  fetch_weights={latency:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.executescript(";".join(db.SCHEMA))
+        conn.close()
+        bench("before", legacy_insert_weight, legacy_fetch_weights, legacy_path, args.rows, args.threads, args.repeat)
+
+        db.DB_NAME = os.path.join(tmp, "pooled.db")
+        db.init_db()
+        bench("after", pooled_insert_weight, pooled_fetch_weights, db.DB_NAME, args.rows, args.threads, args.repeat)
+        print(f"{'cached':<8} fetch_weights={_run_fetches(cached_fetch_weights, db.DB_NAME, args.repeat):8.3f} ms")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Load time and peak memory of fetching whole tables into DataFrames.
+
+Fills a database with ``--rows`` synthetic entries (or uses ``--db``), then
+loads each table in a fresh process so peak RSS is not polluted by earlier
+loads. "fetch" is ``fetch_<table>()`` followed by the date parsing the
+Progress tab used to do; "iter_frames" streams the same rows chunk by chunk
+and keeps only a running total.
+
+    python -m benchmarks.bench_frames [--rows 3000000] [--db existing.db]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import db
+from benchmarks import datagen
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TABLES = ("foods", "weights", "activities")
+MEASURE = {"foods": "calories", "weights": "weight", "activities": "duration"}
+
+
+def _rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _child(table, mode):
+    import pandas as pd
+
+    db.init_db()
+    baseline = _rss_mb()
+    start = time.perf_counter()
+    if mode == "fetch":
+        frame = getattr(db, f"fetch_{table}")()
+        if frame["date"].dtype == object or str(frame["date"].dtype) == "str":
+            frame["date"] = pd.to_datetime(frame["date"])
+        rows = len(frame)
+        frame_mb = frame.memory_usage(deep=True).sum() / 1e6
+    else:
+        rows, total = 0, 0.0
+        for chunk in db.iter_frames(table):
+            rows += len(chunk)
+            total += float(chunk[MEASURE[table]].sum())
+        frame_mb = 0.0
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"rows": rows, "seconds": elapsed, "peak_mb": _rss_mb() - baseline, "frame_mb": frame_mb}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--db", help="existing database to read instead of generating one")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return _child(*args.child)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, "bench.db")
+        if not args.db:
+            db.DB_NAME = path
+            start = time.perf_counter()
+            datagen.generate(args.rows)
+            db.close_all()
+            print(f"Generated {args.rows:,} rows in {time.perf_counter() - start:.1f}s")
+        modes = ("fetch", "iter_frames") if hasattr(db, "iter_frames") else ("fetch",)
+        for table in TABLES:
+            for mode in modes:
+                out = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_frames", "--child", table, mode],
+                    cwd=APP_DIR, env=dict(os.environ, LITEWEIGHT_DB=path),
+                    capture_output=True, text=True, check=True,
+                ).stdout
+                r = json.loads(out.strip().splitlines()[-1])
+                print(f"  {table:<10} {mode:<11} {r['rows']:>10,} rows  load={r['seconds']:6.2f}s  "
+                      f"peak RSS +{r['peak_mb']:7.1f} MB  frame={r['frame_mb']:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
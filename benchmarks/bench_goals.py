@@ -0,0 +1,121 @@
+"""Daily goal streaks, hit rates and weekly adherence: Python loop vs. goals.py.
+
+Fills a database with one to a few entries a day for ``--years`` and times,
+per size: a loop over the days of the daily_summary rollup (what per-day
+goal checks cost without the calendar matrix), goals.py computing everything
+from scratch, a rerun with nothing new, and a rerun after logging an entry
+for today (re-reads the last RECENT_DAYS) and for an older day (full reload).
+
+    python -m benchmarks.bench_goals [--years 1 10] [--repeat 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import db
+import goals
+
+TARGETS = {name: default for name, (_, _, default, _) in goals.GOALS.items()}
+
+
+def _fill(days):
+    rng = np.random.default_rng(0)
+    today = date.today()
+    dates = [(today - timedelta(days=i)).isoformat() for i in range(days)]
+    db.insert_many("activities", [("run", float(m), d) for m, d in zip(rng.uniform(0, 60, days), dates)])
+    db.insert_many("foods", [("meal", float(c), d) for c, d in zip(rng.uniform(1200, 2600, days), dates)])
+    db.insert_many("water", [(float(v), d) for v, d in zip(rng.uniform(8, 24, days * 4), dates * 4)])
+    db.insert_many("fastings", [(float(h), d) for h, d in zip(rng.uniform(10, 20, days), dates)])
+    db.insert_many("exercises", [("Cardio", d) for d in dates[::2]])
+
+
+def loop_progress(start, end):
+    """The same numbers as GoalCalendar.progress, one day at a time."""
+    dates, values = db.fetch_daily()
+    rows = {d.item(): dict(zip(db.SUMMARY_COLUMNS, row)) for d, row in zip(dates, values.tolist())}
+    first, today = min(rows), date.today()
+    out = {}
+    for name, (column, _, target, at_least) in goals.GOALS.items():
+        count = goals._COUNTS.get(column, column)
+        run = best = hit = days = 0
+        runs = []
+        day = first
+        while day <= today:
+            row = rows.get(day)
+            met = row is not None and (row[column] >= target if at_least else row[count] > 0 and row[column] <= target)
+            run = run + 1 if met else 0
+            best = max(best, run)
+            runs.append(run)
+            if start <= day <= end:
+                hit += met
+                days += 1
+            day += timedelta(days=1)
+        out[name] = (runs[-1] or (runs[-2] if len(runs) > 1 else 0), best, hit, days)
+    return out
+
+
+def _time(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def _engine(start, end):
+    cal = goals.calendar()
+    return cal.progress(TARGETS, start, end), cal.weekly_adherence(TARGETS, start, end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for years in args.years:
+            db.use_database(os.path.join(tmp, f"goals-{years}.db"))
+            db.init_db()
+            _fill(years * 365)
+            end = date.today()
+            start = end - timedelta(days=90)
+            old = (end - timedelta(days=200)).isoformat()
+
+            expected = loop_progress(start, end)
+            got = {name: tuple(p[:4]) for name, p in _engine(start, end)[0].items()}
+            assert got == expected, (got, expected)
+
+            loop = _time(lambda: loop_progress(start, end), max(1, args.repeat // 100))
+            cal = goals.calendar()
+            values = cal.values
+            checks = goals._checks(TARGETS)
+
+            def full():
+                goals._Streaks(checks).update(values)
+                cal.weekly_adherence(TARGETS, start, end)
+
+            full_ms = _time(full, args.repeat)
+            hot = _time(lambda: _engine(start, end), args.repeat)
+
+            def after_logging(day, repeat):
+                # Times the rerun only, not the insert.
+                total = 0.0
+                for _ in range(repeat):
+                    db.insert_water(8.0, day)
+                    total += _time(lambda: _engine(start, end), 1)
+                return total / repeat
+
+            today = after_logging(end.isoformat(), args.repeat)
+            backdated = after_logging(old, max(1, args.repeat // 10))
+            print(f"{years:>3} years ({len(values):,} days)  loop {loop:8.2f} ms   engine: "
+                  f"compute {full_ms:.3f} ms  rerun {hot:.3f} ms  "
+                  f"after logging today {today:.2f} ms  an older day {backdated:.2f} ms")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Payload size and analysis latency for raw vs preprocessed food photos.
+
+Runs against the local stub server, so no API key or network is needed.
+
+    python -m benchmarks.bench_image [--repeat 3]
+"""
+import argparse
+import base64
+import io
+import time
+
+import numpy as np
+import openai
+from PIL import Image
+
+import food_analysis
+from benchmarks import stub_server
+from image_prep import prepare_image, sniff_mime
+
+
+def synthetic_photo(width=4032, height=3024, quality=92):
+    """A 12 MP JPEG with enough texture to compress like a phone photo."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    noise = rng.integers(0, 48, size=(height, width, 3))
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def run(label, image_bytes, prepare, repeat):
+    timings, payload = [], 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        if prepare:
+            data, mime = prepare_image(image_bytes)
+        else:
+            data, mime = image_bytes, sniff_mime(image_bytes)
+        payload = len(base64.b64encode(data))
+        food_analysis._request_analysis(data, mime)
+        timings.append(time.perf_counter() - start)
+    print(f"{label:<8} payload={payload / 1e6:7.2f} MB  end-to-end={1000 * min(timings):8.1f} ms (best of {repeat})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--ms-per-mb", type=float, default=300)
+    args = parser.parse_args()
+
+    server = stub_server.start(latency_ms=args.latency_ms, ms_per_mb=args.ms_per_mb)
+    openai.api_base = server.api_base
+    openai.api_key = "stub"
+    photo = synthetic_photo()
+    print(f"input    {len(photo) / 1e6:.2f} MB JPEG, 4032x3024")
+    run("raw", photo, False, args.repeat)
+    run("prepared", photo, True, args.repeat)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Cost of one interaction, before and after fragment-scoped rendering.
+
+Seeds a temporary database with ``--days`` of history, then drives the app
+headlessly with Streamlit's AppTest and reports:
+
+- a full script run with the Progress tab open, which is what every click
+  used to cost when all tabs rendered on each rerun;
+- a full script run with Progress closed (first load, date or tab change);
+- the mean time of each fragment, as recorded by ``timing`` inside the app;
+  an interaction inside a fragment (e.g. logging water) reruns only that.
+
+Every run is preceded by a logged weigh-in, so the dashboard can't be served
+entirely from the query cache.
+
+    python -m benchmarks.bench_rerun [--app enhanced_app.py] [--days 1825] [--runs 10]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+from streamlit.testing.v1 import AppTest
+
+import db
+import timing
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(days):
+    today = date.today()
+    dates = [(today - timedelta(days=i)).isoformat() for i in range(days)]
+    db.init_db()
+    db.insert_many("weights", [(180.0 + i % 13 * 0.3, d) for i, d in enumerate(dates)])
+    db.insert_many("water", [(64.0, d) for d in dates])
+    db.insert_many("foods", [("meal", 600.0, d) for d in dates for _ in range(3)])
+    db.insert_many("activities", [("Walk", 30.0, d) for d in dates])
+
+
+def _median_ms(at, runs, tab):
+    times = []
+    for i in range(runs):
+        # Each run follows a logged weigh-in, as a click on "Log Weight" would,
+        # so the cached queries it touches have to be reloaded.
+        db.insert_weight(180.0 + i * 0.1, date.today().isoformat())
+        at.session_state["active_tab"] = tab
+        start = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="enhanced_app.py", choices=["main.py", "enhanced_app.py"])
+    parser.add_argument("--days", type=int, default=5 * 365)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "bench.db")
+        seed(args.days)
+        at = AppTest.from_file(os.path.join(APP_DIR, args.app), default_timeout=120)
+        at.run()  # warm up imports and caches
+        timing.reset()
+
+        progress_open = _median_ms(at, args.runs, "Progress")
+        progress_closed = _median_ms(at, args.runs, None)
+        fragments = timing.summary()
+        db.close_all()
+
+    print(f"{args.app}, {args.days:,} days of history (median of {args.runs} runs)")
+    print(f"  full run, Progress open    {progress_open:8.1f} ms   (previous cost of every click)")
+    print(f"  full run, Progress closed  {progress_closed:8.1f} ms")
+    for name, stats in sorted(fragments.items()):
+        if name != "script_run":
+            print(f"  fragment {name:<18} {stats['mean_ms']:8.1f} ms   ({stats['count']} runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""How many simultaneous sessions the app handles before reruns queue up.
+
+Starts ``streamlit run <app>`` on a seeded database, with photo analysis
+pointed at the local stub server, and connects ``--sessions`` simulated
+browsers over Streamlit's websocket protocol (AppTest runs one script at a
+time per process, so it can't load a server). Each session repeats a click
+mix for ``--seconds``: log weight, log water, analyze a photo, open
+Progress, switching tabs as a user would. Like a browser, a session waits
+for each rerun to finish before its next click, and clicks inside a fragment
+rerun only that fragment.
+
+For each number of sessions, on a freshly started server, reports actions
+and reruns per second, rerun latency percentiles, errors shown by the app
+("database is locked" ones are also counted in the server log), and the
+growth of the server's resident memory per connected session.
+
+    python -m benchmarks.bench_sessions [--app main.py] [--sessions 1 2 4 8 16 32] [--seconds 20] [--per-user]
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from collections import Counter, defaultdict
+
+import numpy as np
+import websockets
+from PIL import Image
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+import db
+from benchmarks import stub_server
+from benchmarks.bench_image import synthetic_photo
+from benchmarks.bench_rerun import seed
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tab and widget labels of each action, per app.
+APPS = {
+    "main.py": {
+        "weight": ("Weight Entry", "Weight (lbs)", "Add Weight Entry"),
+        "water": ("Food & Water", "Water intake (fl oz)", "Add Water Entry"),
+        "photo": ("Food & Water", "Upload food photos", "Analyze Photo"),
+    },
+    "enhanced_app.py": {
+        "weight": ("Activity", "Weight (lbs)", "Log Weight"),
+        "water": ("Consumption", "Water intake (fl oz)", "Log Water"),
+        "photo": ("Consumption", "Upload food photos", "Analyze Photo"),
+    },
+}
+MIX = {"weight": 3, "water": 3, "photo": 1, "progress": 2}
+
+
+class Session:
+    """One simulated browser tab, driving the app through its websocket."""
+
+    def __init__(self, ws, base_url, query_string, timeout):
+        self.ws = ws
+        self.base_url = base_url
+        self.query_string = query_string
+        self.timeout = timeout
+        self.session_id = None
+        self.widgets = {}  # label -> (widget id, fragment id)
+        self.tabs_id = None
+        self.tab = None
+        self.state = {}  # widget id -> WidgetState, sent with every rerun
+        self.errors = []
+
+    async def _receive(self, until):
+        while True:
+            msg = ForwardMsg()
+            msg.ParseFromString(await self.ws.recv())
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                self.session_id = msg.new_session.initialize.session_id
+            elif kind == "delta":
+                self._delta(msg.delta)
+            if kind == until:
+                return msg
+
+    def _delta(self, delta):
+        kind = delta.WhichOneof("type")
+        if kind == "add_block" and delta.add_block.WhichOneof("type") == "tab_container":
+            self.tabs_id = delta.add_block.id
+        if kind != "new_element":
+            return
+        element = delta.new_element
+        name = element.WhichOneof("type")
+        if name == "exception":
+            self.errors.append(f"{element.exception.type}: {element.exception.message}")
+        elif name == "alert" and element.alert.format == element.alert.ERROR:
+            self.errors.append(element.alert.body)
+        else:
+            proto = getattr(element, name)
+            if getattr(proto, "id", "") and getattr(proto, "label", ""):
+                self.widgets[proto.label] = (proto.id, delta.fragment_id)
+
+    async def rerun(self, triggers=(), fragment_id=""):
+        """Send a rerun like the browser does; returns its latency in seconds."""
+        msg = BackMsg()
+        msg.rerun_script.query_string = self.query_string
+        msg.rerun_script.fragment_id = fragment_id
+        msg.rerun_script.widget_states.widgets.extend([*self.state.values(), *triggers])
+        start = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        await asyncio.wait_for(self._receive("script_finished"), self.timeout)
+        return time.perf_counter() - start
+
+    def set_number(self, label, value):
+        widget_id, _ = self.widgets[label]
+        self.state[widget_id] = WidgetState(id=widget_id, double_value=value)
+
+    async def click(self, label):
+        widget_id, fragment_id = self.widgets[label]
+        return await self.rerun([WidgetState(id=widget_id, trigger_value=True)], fragment_id)
+
+    async def open_tab(self, label):
+        self.tab = label
+        self.state[self.tabs_id] = WidgetState(id=self.tabs_id, string_value=label)
+        return await self.rerun()
+
+    async def upload(self, label, name, data):
+        """Upload ``data`` through the file uploader ``label``, as a single file."""
+        widget_id, fragment_id = self.widgets[label]
+        msg = BackMsg()
+        msg.file_urls_request.request_id = uuid.uuid4().hex
+        msg.file_urls_request.session_id = self.session_id
+        msg.file_urls_request.file_names.append(name)
+        await self.ws.send(msg.SerializeToString())
+        urls = (await asyncio.wait_for(self._receive("file_urls_response"), self.timeout)).file_urls_response.file_urls[0]
+        await asyncio.to_thread(_put_file, self.base_url + urls.upload_url, name, data)
+        state = WidgetState(id=widget_id)
+        info = state.file_uploader_state_value.uploaded_file_info.add(file_id=urls.file_id, name=name, size=len(data))
+        info.file_urls.CopyFrom(urls)
+        self.state[widget_id] = state
+        return await self.rerun(fragment_id=fragment_id)
+
+
+def _new_photo(pixels):
+    # The analysis cache keys on the prepared image, so each upload needs
+    # different pixels, not just different bytes, to reach the vision stub.
+    pixels = pixels.copy()
+    pixels[:32, :32] = list(os.urandom(3))
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def _put_file(url, name, data):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+        f"Content-Type: image/jpeg\r\n\r\n".encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    )
+    request = urllib.request.Request(
+        url, data=body, method="PUT", headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    )
+    urllib.request.urlopen(request, timeout=30).close()
+
+
+async def _action(session, name, labels, photo, rng, latencies):
+    tab = "Progress" if name == "progress" else labels[name][0]
+    if session.tab != tab or name == "progress":
+        latencies[name if name == "progress" else "tab switch"].append(await session.open_tab(tab))
+    if name == "progress":
+        return
+    _, field, button = labels[name]
+    if name == "photo":
+        data = await asyncio.to_thread(_new_photo, photo)
+        latencies["photo upload"].append(await session.upload(field, "meal.jpg", data))
+    else:
+        session.set_number(field, round(rng.uniform(150, 200), 1) if name == "weight" else 8.0)
+    latencies[name].append(await session.click(button))
+
+
+def _clicks(rng, deadline):
+    if deadline is None:
+        yield from MIX
+        return
+    while time.perf_counter() < deadline:
+        yield rng.choices(list(MIX), weights=list(MIX.values()))[0]
+
+
+async def _session(i, args, port, photo, deadline, barrier, measured):
+    """Click until ``deadline``; with no deadline, do each action once."""
+    rng = random.Random(i)
+    latencies = defaultdict(list)
+    actions = 0
+    query = f"user=session{i}" if args.per_user else ""
+    async with websockets.connect(f"ws://127.0.0.1:{port}/_stcore/stream", max_size=None) as ws:
+        session = Session(ws, f"http://127.0.0.1:{port}", query, args.timeout)
+        try:
+            latencies["first load"].append(await session.rerun())
+            for name in _clicks(rng, deadline):
+                await _action(session, name, APPS[args.app], photo, rng, latencies)
+                actions += 1
+                if args.think_s:
+                    await asyncio.sleep(rng.expovariate(1 / args.think_s))
+        except asyncio.TimeoutError:
+            session.errors.append(f"rerun took over {args.timeout:.0f}s")
+        except websockets.ConnectionClosed as e:
+            session.errors.append(f"connection closed: {e}")
+        finally:
+            # Stay connected until the server's memory has been measured.
+            await barrier.wait()
+            await measured.wait()
+    return actions, latencies, session.errors
+
+
+def _rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(args, env, log, cwd):
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", os.path.join(APP_DIR, args.app),
+         "--server.headless", "true", "--server.port", str(port), "--server.address", "127.0.0.1",
+         "--server.enableXsrfProtection", "false", "--browser.gatherUsageStats", "false"],
+        env=env, stdout=log, stderr=subprocess.STDOUT, cwd=cwd,
+    )
+    for _ in range(300):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, port
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("streamlit server did not start; see its log")
+
+
+async def _run_sessions(args, sessions, port, pid, photo, seconds):
+    """Run ``sessions`` sessions (each doing every action once if ``seconds`` is None);
+    returns their results and the server's RSS while all were connected.
+    """
+    barrier = asyncio.Barrier(sessions + 1)
+    measured = asyncio.Event()
+    deadline = time.perf_counter() + seconds if seconds is not None else None
+    tasks = [
+        asyncio.create_task(_session(i, args, port, photo, deadline, barrier, measured))
+        for i in range(sessions)
+    ]
+    await barrier.wait()
+    rss = _rss_mb(pid)
+    measured.set()
+    return await asyncio.gather(*tasks), rss
+
+
+async def _level(args, sessions, port, pid, photo):
+    # A first session loads the app's imports, so they aren't counted per session.
+    await _run_sessions(args, 1, port, pid, photo, None)
+    base_mb = _rss_mb(pid)
+    start = time.perf_counter()
+    results, peak_mb = await _run_sessions(args, sessions, port, pid, photo, args.seconds)
+    return results, time.perf_counter() - start, base_mb, peak_mb
+
+
+def _report(sessions, results, elapsed, base_mb, peak_mb, locked_in_log):
+    latencies = defaultdict(list)
+    errors = Counter()
+    actions = 0
+    for n, by_kind, session_errors in results:
+        actions += n
+        for kind, values in by_kind.items():
+            latencies[kind].extend(values)
+        for error in session_errors:
+            errors["lock" if "locked" in error else "refused" if "photo analysis is" in error else "other"] += 1
+    reruns = np.array([v for kind, values in latencies.items() if kind != "first load" for v in values]) * 1000
+    p50, p95, p99 = np.percentile(reruns, [50, 95, 99]) if len(reruns) else (float("nan"),) * 3
+    memory = f"{(peak_mb - base_mb) / sessions:6.1f}" if base_mb is not None else "   n/a"
+    print(f"  {sessions:>4}  {actions / elapsed:9.1f}  {len(reruns) / elapsed:8.1f}  "
+          f"{p50:7.0f}  {p95:7.0f}  {p99:7.0f}  {errors['lock'] + locked_in_log:6}  "
+          f"{errors['refused']:7}  {errors['other']:5}  {memory}")
+    by_kind = ", ".join(
+        f"{kind} {np.percentile(values, 95) * 1000:.0f}" for kind, values in sorted(latencies.items()) if values
+    )
+    print(f"        p95 ms by rerun: {by_kind}")
+    examples = sorted({error for _, _, session_errors in results for error in session_errors})[:3]
+    for error in examples:
+        print(f"        error: {error[:120]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="main.py", choices=list(APPS))
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seconds", type=float, default=20.0, help="how long each level runs")
+    parser.add_argument("--think-s", type=float, default=0.0, help="mean pause between a session's clicks")
+    parser.add_argument("--days", type=int, default=365, help="history seeded per database")
+    parser.add_argument("--per-user", action="store_true", help="one database per session (LITEWEIGHT_DATA_DIR)")
+    parser.add_argument("--photo-ms", type=float, default=800, help="stub vision latency")
+    parser.add_argument("--timeout", type=float, default=120, help="longest wait for one rerun")
+    args = parser.parse_args()
+
+    vision = stub_server.start(latency_ms=args.photo_ms, token_ms=5)
+    photo = np.asarray(Image.open(io.BytesIO(synthetic_photo(1600, 1200))))
+    print(f"{args.app}: {args.seconds:.0f}s per level, {args.days} days of history, "
+          f"{'one database per session' if args.per_user else 'one shared database'}, "
+          f"think time {args.think_s}s")
+    print("  sess  actions/s  reruns/s  p50 ms  p95 ms  p99 ms  locked  refused  other  MB/sess")
+    for sessions in args.sessions:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                LITEWEIGHT_ANALYSIS_CACHE=os.path.join(tmp, "analysis_cache.db"),
+                LITEWEIGHT_VISION_BACKEND="openai",
+                OPENAI_API_BASE=vision.api_base,
+                OPENAI_API_KEY="stub",
+            )
+            if args.per_user:
+                db.DATA_DIR = env["LITEWEIGHT_DATA_DIR"] = os.path.join(tmp, "users")
+                # Sessions pick their database with ?user=.
+                env["LITEWEIGHT_URL_USER"] = "1"
+                for i in range(sessions):
+                    db.use_database(db.user_database(f"session{i}"))
+                    seed(args.days)
+                db.use_database(None)
+            db.DB_NAME = env["LITEWEIGHT_DB"] = os.path.join(tmp, "liteweight.db")
+            seed(args.days)
+            db.close_all()
+
+            log_path = os.path.join(tmp, "server.log")
+            with open(log_path, "w") as log:
+                server, port = _start_server(args, env, log, tmp)
+                try:
+                    results, elapsed, base_mb, peak_mb = asyncio.run(_level(args, sessions, port, server.pid, photo))
+                finally:
+                    server.terminate()
+                    server.wait(timeout=30)
+            with open(log_path) as log:
+                locked_in_log = sum("database is locked" in line for line in log)
+            _report(sessions, results, elapsed, base_mb, peak_mb, locked_in_log)
+    vision.shutdown()
+
+
+if __name__ == "__main__":
+    main()
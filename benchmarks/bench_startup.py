@@ -0,0 +1,90 @@
+"""Cold-start and per-rerun overhead of the apps.
+
+Cold start is measured in a fresh interpreter per app: the first script run
+through Streamlit's AppTest, which includes importing everything the app
+imports, plus migrating a new database. The heavy modules loaded by then are
+listed; the OpenAI client, Pillow and the pandas/NumPy analytics stack should
+only appear once a photo is analysed or the Progress tab is opened.
+
+Per rerun, ``init_db`` now costs a set lookup; the previous version re-ran
+every CREATE ... IF NOT EXISTS statement, timed here as "schema statements".
+
+    python -m benchmarks.bench_startup [--runs 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_MODULES = ("openai", "PIL", "pandas", "numpy")
+APPS = ("main.py", "enhanced_app.py")
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _child(app, runs):
+    import streamlit  # noqa: F401  (same for every app; not what is being measured)
+    from streamlit.testing.v1 import AppTest
+
+    import db
+
+    at = AppTest.from_file(os.path.join(APP_DIR, app), default_timeout=120)
+    start = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - start
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+
+    reruns = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        at.run()
+        reruns.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        db.init_db()
+    init_db = (time.perf_counter() - start) / runs
+    start = time.perf_counter()
+    with db.connection() as conn:
+        for _ in range(runs):
+            with conn:
+                for statement in db.SCHEMA + db.SUMMARY_SCHEMA + db.INDEXES:
+                    conn.execute(statement)
+    statements = (time.perf_counter() - start) / runs
+    print(json.dumps({
+        "first_run": first, "loaded": loaded, "rerun": statistics.median(reruns),
+        "init_db": init_db, "statements": statements,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return _child(args.child, args.runs)
+
+    for app in APPS:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, LITEWEIGHT_DB=os.path.join(tmp, "bench.db"))
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_startup", "--child", app, "--runs", str(args.runs)],
+                cwd=APP_DIR, env=env, capture_output=True, text=True, check=True,
+            ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        print(f"{app}")
+        print(f"  cold start (first run)  {result['first_run'] * 1000:8.1f} ms  heavy modules loaded: "
+              f"{', '.join(result['loaded']) or 'none'}")
+        print(f"  rerun (median)          {result['rerun'] * 1000:8.1f} ms")
+        print(f"  init_db per rerun       {result['init_db'] * 1e6:8.1f} us  "
+              f"(schema statements: {result['statements'] * 1e6:.1f} us)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Time to first token and total latency, streaming vs. blocking analysis.
+
+Runs against the local stub server's streaming endpoint.
+
+    python -m benchmarks.bench_stream [--repeat 3]
+"""
+import argparse
+import time
+
+import openai
+
+import food_analysis
+from benchmarks import stub_server
+from image_prep import prepare_image
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--token-ms", type=float, default=30)
+    args = parser.parse_args()
+
+    server = stub_server.start(latency_ms=args.latency_ms, token_ms=args.token_ms)
+    openai.api_base = server.api_base
+    openai.api_key = "stub"
+    # Distinct bytes per run so the analysis cache never answers.
+    images = [f"photo-{time.time()}-{i}".encode() for i in range(2 * args.repeat)]
+
+    blocking = []
+    for image in images[:args.repeat]:
+        start = time.perf_counter()
+        food_analysis._request_analysis(*prepare_image(image))
+        blocking.append(time.perf_counter() - start)
+
+    first, calories, total = [], [], []
+    for image in images[args.repeat:]:
+        stream = food_analysis.AnalysisStream(image)
+        start = time.perf_counter()
+        calories_at = None
+        for _ in stream:
+            if calories_at is None and stream.calories is not None:
+                calories_at = time.perf_counter() - start
+        first.append(stream.first_token_latency)
+        calories.append(calories_at if calories_at is not None else stream.latency)
+        total.append(stream.latency)
+
+    def ms(values):
+        return f"{1000 * sum(values) / len(values):8.1f} ms"
+
+    print(f"blocking   first result={ms(blocking)}  total={ms(blocking)}")
+    print(f"streaming  first token ={ms(first)}  calories={ms(calories)}  total={ms(total)}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Write throughput of concurrent sessions: one shared database vs. one per user.
+
+Every session is a thread logging entries as fast as it can for
+``--seconds``, one session per user. "shared" puts every user in one file,
+as before LITEWEIGHT_DATA_DIR; "per-user" gives each user their own file
+under a data directory (db.user_database). Also reports how many
+connections and file descriptors the process holds at the end, which the
+connection cache bounds by LITEWEIGHT_MAX_CONNECTIONS however many users there are.
+
+    python -m benchmarks.bench_users [--users 1 2 4 8 16 32] [--seconds 3]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+import db
+
+
+def _session(path, deadline, latencies):
+    db.use_database(path)
+    today = date.today().isoformat()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        db.insert_weight(180.0, today)
+        latencies.append(time.perf_counter() - start)
+
+
+def _run(paths, seconds):
+    for path in set(paths):
+        db.use_database(path)
+        db.init_db()
+    per_session = [[] for _ in paths]
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=_session, args=(path, deadline, latencies))
+               for path, latencies in zip(paths, per_session)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies = np.concatenate([np.array(s) for s in per_session]) * 1000
+    return len(latencies) / seconds, np.percentile(latencies, 99)
+
+
+def _open_fds():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DATA_DIR = os.path.join(tmp, "users")
+        for users in args.users:
+            shared = [os.path.join(tmp, f"shared-{users}.db")] * users
+            per_user = [db.user_database(f"user{users}-{i}@example.com") for i in range(users)]
+            line = []
+            for name, paths in (("shared", shared), ("per-user", per_user)):
+                rate, p99 = _run(paths, args.seconds)
+                line.append(f"{name} {rate:8,.0f} writes/s p99 {p99:6.1f} ms")
+            print(f"  {users:>3} users  " + "   ".join(line))
+        stats = db.connection_stats()
+        print(f"Connections held at the end: {stats['open']} (cap {db.MAX_CONNECTIONS}) "
+              f"over {stats['databases']} databases; open file descriptors: {_open_fds()}")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
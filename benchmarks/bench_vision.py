@@ -0,0 +1,86 @@
+"""What a slow or failing vision upstream costs the server, with and without guards.
+
+``--sessions`` callers ask for a photo analysis at once, against the local
+stub server in three states: healthy, stalled (answers take ``--stall-s``)
+and failing (every request gets a 500). Each state is run "unguarded"
+(no concurrency limit, no circuit breaker, a 600 s read timeout: the old
+behaviour) and "guarded" (vision.py's defaults, with ``--read-timeout``).
+The last column is the worker-thread time tied up by the analysis calls.
+
+    python -m benchmarks.bench_vision [--sessions 32] [--stall-s 10] [--read-timeout 2]
+"""
+import argparse
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import openai
+
+import food_analysis
+import vision
+from benchmarks import stub_server
+
+STATES = {
+    "healthy": {"latency_ms": 300},
+    "stalled": {"latency_ms": None},  # --stall-s
+    "failing": {"latency_ms": 50, "error_rate": 1.0},
+}
+
+
+def _call(image):
+    start = time.perf_counter()
+    try:
+        food_analysis._request_analysis(image)
+        outcome = "ok"
+    except vision.Overloaded:
+        outcome = "overloaded"
+    except vision.CircuitOpen:
+        outcome = "circuit open"
+    except openai.error.Timeout:
+        outcome = "timeout"
+    except openai.error.OpenAIError:
+        outcome = "error"
+    return outcome, time.perf_counter() - start
+
+
+def _run(sessions, guarded, read_timeout):
+    if guarded:
+        vision.limiter = vision.Limiter()
+        vision.breaker = vision.CircuitBreaker()
+        vision.register_backend("bench", lambda: vision.OpenAIBackend(read_timeout=read_timeout))
+    else:
+        vision.limiter = vision.Limiter(max_concurrent=10_000, queue_timeout=None)
+        vision.breaker = vision.CircuitBreaker(failure_threshold=float("inf"))
+        vision.register_backend("bench", lambda: vision.OpenAIBackend(read_timeout=600))
+    images = [f"photo-{time.time()}-{i}".encode() for i in range(sessions)]
+    with ThreadPoolExecutor(sessions) as pool:
+        results = list(pool.map(_call, images))
+    seconds = np.array([s for _, s in results])
+    return Counter(outcome for outcome, _ in results), seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--stall-s", type=float, default=10.0)
+    parser.add_argument("--read-timeout", type=float, default=2.0)
+    args = parser.parse_args()
+
+    openai.api_key = "stub"
+    vision.BACKEND = "bench"
+    for state, options in STATES.items():
+        latency_ms = options["latency_ms"] if options["latency_ms"] is not None else args.stall_s * 1000
+        server = stub_server.start(latency_ms=latency_ms, token_ms=1, error_rate=options.get("error_rate", 0.0))
+        openai.api_base = server.api_base
+        for guarded in (False, True):
+            outcomes, seconds = _run(args.sessions, guarded, args.read_timeout)
+            summary = ", ".join(f"{n} {outcome}" for outcome, n in sorted(outcomes.items()))
+            print(f"  {state:<8} {'guarded' if guarded else 'unguarded':<10} "
+                  f"p50={np.median(seconds):6.2f}s  max={seconds.max():6.2f}s  "
+                  f"thread-seconds={seconds.sum():7.1f}  ({summary})")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Sustained insert throughput and ack latency, direct commits vs. write-behind.
+
+Each of ``--threads`` workers (standing in for concurrent sessions) logs
+entries back to back for ``--seconds`` and waits for every insert to be
+acknowledged: the call returning for direct commits, the future resolving in
+write-behind mode.
+
+    python -m benchmarks.bench_writes [--threads 16] [--seconds 5] [--delay-ms 0]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import db
+import writer
+
+
+def _stress(threads, seconds):
+    latencies = [[] for _ in range(threads)]
+    errors = []
+    stop = time.perf_counter() + seconds
+
+    def worker(out):
+        i = 0
+        while time.perf_counter() < stop:
+            start = time.perf_counter()
+            try:
+                pending = db.insert_water(8.0, f"2024-01-{i % 28 + 1:02d}")
+                if pending is not None:
+                    pending.result()
+            except Exception as e:
+                errors.append(e)
+            out.append(time.perf_counter() - start)
+            i += 1
+
+    pool = [threading.Thread(target=worker, args=(out,)) for out in latencies]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return np.concatenate([np.asarray(out) for out in latencies]), elapsed, errors
+
+
+def run(write_behind, threads, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "bench.db")
+        db.WRITE_BEHIND = write_behind
+        db.init_db()
+        latencies, elapsed, errors = _stress(threads, seconds)
+        with db.connection() as conn:
+            committed = conn.execute("SELECT COUNT(*) FROM water").fetchone()[0]
+        db.close_all()
+    return committed / elapsed, np.percentile(latencies, [50, 99]) * 1000, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--delay-ms", type=float, default=writer.MAX_DELAY_MS, help="write-behind batching delay")
+    args = parser.parse_args()
+    writer.MAX_DELAY_MS = args.delay_ms
+
+    print(f"{args.threads} threads, {args.seconds:g}s each")
+    for write_behind in (False, True):
+        rate, (p50, p99), errors = run(write_behind, args.threads, args.seconds)
+        label = "write-behind" if write_behind else "direct"
+        print(f"  {label:<12}  {rate:9,.0f} writes/sec  ack p50={p50:7.2f} ms  p99={p99:7.2f} ms  errors={errors}")
+
+
+if __name__ == "__main__":
+    main()
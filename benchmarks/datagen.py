@@ -0,0 +1,100 @@
+"""Synthetic LiteWeight history for benchmarks.
+
+Fills a database with ``rows`` entries spread over the ``days`` ending today,
+split across the six log tables in roughly the proportions a real user
+produces them (lots of food and water, fewer weigh-ins). Values are drawn
+from a seeded generator, so the same arguments always give the same data.
+
+    python -m benchmarks.datagen --rows 1000000 [--days 1095] [--db liteweight.db]
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import db
+
+# Share of the rows each table receives.
+MIX = {
+    "foods": 0.35,
+    "water": 0.25,
+    "weights": 0.10,
+    "activities": 0.12,
+    "fastings": 0.08,
+    "exercises": 0.10,
+}
+MEALS = (
+    "Oatmeal with berries", "Greek yogurt", "Chicken salad", "Turkey sandwich", "Salmon and rice",
+    "Pasta bolognese", "Veggie stir fry", "Protein shake", "Apple", "Cheeseburger and fries",
+)
+ROUTINES = ("Upper Body", "Lower Body", "Full Body", "Cardio")
+WATER_SERVINGS = np.array([8.0, 12.0, 16.0, 20.0, 24.0])
+CHUNK_SIZE = 100_000
+
+
+def _rows(table, rng, days, n, chunk):
+    """Rows ``chunk`` (a range of positions out of ``n``) of ``table``."""
+    k = len(chunk)
+    # Entries are spread evenly over the days, so every chunk is in date order.
+    day = (np.asarray(chunk) * days) // n
+    if table == "weights":
+        # A slow loss of 15 lbs over the whole period with day-to-day noise.
+        values = [np.round(195 - 15 * day / days + rng.normal(0, 1.2, k), 1)]
+    elif table == "activities":
+        values = [
+            np.where(rng.random(k) < 0.7, "Walk", "Run"),
+            np.round(rng.lognormal(np.log(30), 0.4, k)),
+        ]
+    elif table == "foods":
+        calories = np.clip(np.round(rng.normal(550, 200, k)), 50, None)
+        values = [
+            np.asarray(MEALS)[rng.integers(0, len(MEALS), k)],
+            # Some entries are logged without a calorie estimate.
+            np.where(rng.random(k) < 0.05, None, calories),
+        ]
+    elif table == "water":
+        values = [WATER_SERVINGS[rng.integers(0, len(WATER_SERVINGS), k)]]
+    elif table == "fastings":
+        values = [rng.integers(12, 21, k).astype(np.float64)]
+    else:
+        values = [np.asarray(ROUTINES)[rng.integers(0, len(ROUTINES), k)]]
+    first = date.today() - timedelta(days=days - 1)
+    dates = np.datetime_as_string(np.datetime64(first) + day.astype("timedelta64[D]"))
+    return list(zip(*(v.tolist() for v in values), dates.tolist()))
+
+
+def generate(rows, days=3 * 365, seed=0, chunk_size=CHUNK_SIZE):
+    """Insert ``rows`` synthetic entries into ``db.DB_NAME``; returns ``{table: count}``."""
+    db.init_db()
+    rng = np.random.default_rng(seed)
+    counts = {}
+    for table, share in MIX.items():
+        n = max(int(rows * share), 1)
+        for start in range(0, n, chunk_size):
+            db.insert_many(table, _rows(table, rng, days, n, range(start, min(start + chunk_size, n))))
+        counts[table] = n
+    db.flush_writes()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=3 * 365)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", default=db.DB_NAME, help="database file (default: %(default)s)")
+    args = parser.parse_args()
+
+    db.DB_NAME = args.db
+    start = time.perf_counter()
+    counts = generate(args.rows, args.days, args.seed)
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    print(f"Generated {total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/sec) into {db.DB_NAME}")
+    for table, n in counts.items():
+        print(f"  {table:<11} {n:>12,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Local stand-in for the OpenAI chat completions endpoint.
+
+Answers ``POST /v1/chat/completions`` with a deterministic food analysis
+after a delay of ``latency_ms`` plus ``ms_per_mb`` for every megabyte of
+request body, roughly modelling how vision latency grows with image size.
+Generating each four-character token takes ``token_ms``; requests with
+``"stream": true`` receive them as server-sent event chunks as they are made.
+An ``error_rate`` share of requests, evenly spread, gets a 500 instead.
+
+    python -m benchmarks.stub_server --port 8765
+
+Point the app at it with ``OPENAI_API_BASE=http://127.0.0.1:8765/v1``.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from vision import stub_reply
+
+
+def _tokens(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            self._reply()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out and hung up
+
+    def _failing(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            n = server.requests
+        return int(n * server.error_rate) != int((n - 1) * server.error_rate)
+
+    def _reply(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep((self.server.latency_ms + self.server.ms_per_mb * len(body) / 1e6) / 1000)
+        if self._failing():
+            self.send_error(500, "stub failure")
+            return
+        content = stub_reply(body)
+        if json.loads(body or b"{}").get("stream"):
+            self._stream(content)
+            return
+        # A blocking reply still takes as long as generating every token.
+        time.sleep(len(_tokens(content)) * self.server.token_ms / 1000)
+        payload = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "stub",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        deltas = [{"role": "assistant"}] + [{"content": t} for t in _tokens(content)] + [{}]
+        for i, delta in enumerate(deltas):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "stub",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if delta else "stop"}],
+            }
+            self.wfile.write(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+            self.wfile.flush()
+            if i and delta:
+                time.sleep(self.server.token_ms / 1000)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=0, latency_ms=800, ms_per_mb=300, token_ms=20, error_rate=0.0):
+    """Serve in a daemon thread; returns the server (``server.api_base`` is its URL)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency_ms = latency_ms
+    server.ms_per_mb = ms_per_mb
+    server.token_ms = token_ms
+    server.error_rate = error_rate
+    server.requests = 0
+    server.lock = threading.Lock()
+    server.api_base = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI chat completions stub")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--ms-per-mb", type=float, default=300)
+    parser.add_argument("--token-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = start(args.port, args.latency_ms, args.ms_per_mb, args.token_ms, args.error_rate)
+    print(f"Serving on {server.api_base}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Benchmark suite: data access and Progress rendering as the history grows.
+
+For every ``--rows`` size a fresh database is filled by ``benchmarks.datagen``
+and the suite times every ``insert_*`` and ``fetch_*`` function (fetches
+with the query cache cleared, i.e. right after a write, plus a cached
+``fetch_weights``) and a headless render of the Progress tab through
+Streamlit's AppTest. Results are written as JSON; pass an earlier file as
+``--baseline`` to see what got slower or faster.
+
+    python -m benchmarks.suite --rows 1000 100000 1000000 --out bench.json
+    python -m benchmarks.suite --rows 1000 100000 --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import db
+from benchmarks import datagen
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# A run is repeated up to --runs times but stops early after this many seconds.
+TIME_BUDGET = 2.0
+# Changes smaller than this ratio are reported as noise.
+THRESHOLD = 1.2
+
+
+def _measure(func, runs, setup=None):
+    times = []
+    deadline = time.perf_counter() + TIME_BUDGET
+    while len(times) < runs and (len(times) < 3 or time.perf_counter() < deadline):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000
+    return {"median_ms": float(np.median(times)), "p95_ms": float(np.percentile(times, 95)), "runs": len(times)}
+
+
+def _cases():
+    today = date.today().isoformat()
+    recent = date.today() - timedelta(days=90)
+    inserts = {
+        "insert_weight": lambda: db.insert_weight(182.4, today),
+        "insert_activity": lambda: db.insert_activity("Walk", 30.0, today),
+        "insert_food": lambda: db.insert_food("Chicken salad", 450.0, today),
+        "insert_water": lambda: db.insert_water(16.0, today),
+        "insert_fasting": lambda: db.insert_fasting(16.0, today),
+        "insert_exercise": lambda: db.insert_exercise("Full Body", today),
+    }
+    fetches = {"fetch_latest_weight": lambda: db.fetch_latest_weight(today)}
+    for table in db.TABLES:
+        fetch = getattr(db, f"fetch_{table}")
+        fetches[f"fetch_{table}"] = fetch
+        fetches[f"fetch_{table}[90d]"] = lambda fetch=fetch: fetch(recent)
+    fetches["fetch_summary[90d]"] = lambda: db.fetch_summary(recent)
+    fetches["fetch_routine_counts[90d]"] = lambda: db.fetch_routine_counts(recent)
+    return inserts, fetches
+
+
+def _insert_and_wait(insert):
+    pending = insert()
+    if pending is not None:
+        pending.result()
+
+
+def _progress_render(app, runs):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(APP_DIR, app), default_timeout=600)
+
+    def render():
+        at.session_state["active_tab"] = "Progress"
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+    render()  # first run imports the app's modules
+    return _measure(render, runs, setup=db.query_cache.clear)
+
+
+def run_size(rows, days, runs, app):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "bench.db")
+        start = time.perf_counter()
+        datagen.generate(rows, days)
+        results["datagen"] = {"median_ms": (time.perf_counter() - start) * 1000, "p95_ms": None, "runs": 1}
+        inserts, fetches = _cases()
+        for name, insert in inserts.items():
+            results[name] = _measure(lambda: _insert_and_wait(insert), runs)
+        for name, fetch in fetches.items():
+            results[name] = _measure(fetch, runs, setup=db.query_cache.clear)
+        results["fetch_weights[cached]"] = _measure(db.fetch_weights, runs)
+        results[f"progress_render[{app}]"] = _progress_render(app, runs)
+        db.close_all()
+    return results
+
+
+def _meta():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import streamlit
+
+    return {
+        "commit": commit,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "streamlit": streamlit.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def compare(baseline, current):
+    """Print every case present in both result sets with its change in median time."""
+    old = {(r["rows"], r["name"]): r for r in baseline["results"]}
+    print(f"\nvs. baseline {baseline['meta'].get('commit')} ({baseline['meta'].get('created')})")
+    for r in current["results"]:
+        before = old.get((r["rows"], r["name"]))
+        if not before or not before["median_ms"]:
+            continue
+        ratio = r["median_ms"] / before["median_ms"]
+        flag = "slower" if ratio > THRESHOLD else "faster" if ratio < 1 / THRESHOLD else ""
+        print(f"  {r['rows']:>10,}  {r['name']:<34} {before['median_ms']:10.2f} -> {r['median_ms']:10.2f} ms"
+              f"  x{ratio:5.2f} {flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--days", type=int, default=3 * 365)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--app", default="enhanced_app.py", choices=["main.py", "enhanced_app.py"])
+    parser.add_argument("--out", default="bench.json", help="where to write the results (default: %(default)s)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    report = {"meta": _meta(), "results": []}
+    for rows in args.rows:
+        print(f"{rows:,} rows")
+        for name, result in run_size(rows, args.days, args.runs, args.app).items():
+            report["results"].append({"rows": rows, "name": name, **result})
+            print(f"  {name:<34} median={result['median_ms']:10.2f} ms  ({result['runs']} runs)")
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
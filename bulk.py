@@ -0,0 +1,218 @@
+"""Bulk import and export of LiteWeight history.
+
+Files are streamed in chunks in both directions, so memory use is bounded by
+``chunk_size`` rather than the size of the history. Columns are named as in
+the database (see ``db.COLUMNS``), e.g. ``weight,date`` for weights.
+
+    python bulk.py import weights history.csv
+    python bulk.py export foods foods.parquet --start 2024-01-01
+
+CSV, JSON lines (``.jsonl``/``.ndjson``) and Parquet are supported; Parquet
+needs ``pyarrow``.
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import time
+from collections import namedtuple
+from datetime import date
+
+import db
+import maintenance
+
+CHUNK_SIZE = 50_000
+
+
+def _number(value):
+    number = float(value)
+    # NaN and infinities would pass here and then fail (or poison sums) in SQLite.
+    if not math.isfinite(number):
+        raise ValueError(f"not a finite number: {value!r}")
+    return number
+
+
+# Column -> (converter, nullable). Anything not listed is text.
+FIELDS = {
+    "weight": (_number, False),
+    "duration": (_number, False),
+    "volume": (_number, False),
+    "calories": (_number, True),
+    "description": (str, True),
+    "type": (str, False),
+    "routine": (str, False),
+}
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet"}
+
+# errors holds (record number, message) for the first MAX_ERRORS rejected records.
+Report = namedtuple("Report", "table rows rejected errors seconds")
+
+MAX_ERRORS = 20
+
+
+def _format(path, fmt):
+    fmt = fmt or FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt not in ("csv", "jsonl", "parquet"):
+        raise ValueError(f"Cannot tell the format of {path}; pass fmt='csv', 'jsonl' or 'parquet'")
+    return fmt
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet support needs pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def _read_records(path, fmt, chunk_size):
+    """Yield lists of records, ``chunk_size`` at a time.
+
+    JSON lines are yielded unparsed, so that ``_convert`` rejects a malformed
+    line like any other invalid record.
+    """
+    if fmt == "parquet":
+        parquet = _pyarrow().parquet
+        for batch in parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+        return
+    with open(path, newline="", encoding="utf-8") as f:
+        records = csv.DictReader(f) if fmt == "csv" else (line for line in f if line.strip())
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def _convert(table, record):
+    if isinstance(record, str):
+        record = json.loads(record)
+    if not isinstance(record, dict):
+        raise ValueError(f"not an object: {record!r:.40}")
+    row = []
+    for column in db.COLUMNS[table]:
+        value = record.get(column)
+        if value == "" or value is None:
+            if column == "date" or not FIELDS.get(column, (str, False))[1]:
+                raise ValueError(f"missing {column}")
+            row.append(None)
+        elif column == "date":
+            # Accept full timestamps, store the calendar day like the app does.
+            row.append(date.fromisoformat(str(value)[:10]).isoformat())
+        else:
+            row.append(FIELDS.get(column, (str, False))[0](value))
+    return tuple(row)
+
+
+def import_file(table, path, fmt=None, chunk_size=CHUNK_SIZE):
+    """Validate and insert every record of ``path`` into ``table``.
+
+    Each chunk is written with ``executemany`` in one transaction. Invalid
+    records are skipped and reported rather than aborting the import.
+    """
+    if table not in db.COLUMNS:
+        raise ValueError(f"Unknown table {table!r}")
+    fmt = _format(path, fmt)
+    start = time.perf_counter()
+    rows = rejected = line = 0
+    errors = []
+    for records in _read_records(path, fmt, chunk_size):
+        valid = []
+        for record in records:
+            line += 1
+            try:
+                valid.append(_convert(table, record))
+            except (ValueError, TypeError) as e:
+                rejected += 1
+                if len(errors) < MAX_ERRORS:
+                    errors.append((line, str(e)))
+        db.insert_many(table, valid)
+        rows += len(valid)
+    # In write-behind mode the last chunks may still be queued.
+    db.flush_writes()
+    if rows >= maintenance.ANALYZE_AFTER_ROWS:
+        # The query planner's statistics may no longer match the tables.
+        maintenance.analyze()
+    return Report(table, rows, rejected, errors, time.perf_counter() - start)
+
+
+def export_file(table, path, fmt=None, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """Write ``table`` rows for dates in [start, end] to ``path``, chunk by chunk."""
+    if table not in db.COLUMNS:
+        raise ValueError(f"Unknown table {table!r}")
+    fmt = _format(path, fmt)
+    columns = db.COLUMNS[table]
+    began = time.perf_counter()
+    rows = 0
+    if fmt == "parquet":
+        pa = _pyarrow()
+        schema = pa.schema([
+            (c, pa.float64() if FIELDS.get(c, (str,))[0] is _number else pa.string()) for c in columns
+        ])
+        with pa.parquet.ParquetWriter(path, schema) as writer:
+            for chunk in db.iter_rows(table, start, end, chunk_size):
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)],
+                    schema=schema,
+                ))
+                rows += len(chunk)
+    else:
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f) if fmt == "csv" else None
+            if writer:
+                writer.writerow(columns)
+            for chunk in db.iter_rows(table, start, end, chunk_size):
+                if writer:
+                    writer.writerows(chunk)
+                else:
+                    f.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in chunk)
+                rows += len(chunk)
+    return Report(table, rows, 0, [], time.perf_counter() - began)
+
+
+def _print_report(action, report):
+    rate = report.rows / report.seconds if report.seconds else 0.0
+    print(f"{action} {report.rows} {report.table} rows in {report.seconds:.2f}s ({rate:,.0f} rows/sec)")
+    if report.rejected:
+        print(f"Rejected {report.rejected} invalid rows:", file=sys.stderr)
+        for line, message in report.errors:
+            print(f"  record {line}: {message}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of LiteWeight history")
+    parser.add_argument("--db", default=db.DB_NAME, help="database file (default: %(default)s)")
+    parser.add_argument("--user", help="use this user's database under LITEWEIGHT_DATA_DIR instead of --db")
+    parser.add_argument("--format", choices=["csv", "jsonl", "parquet"], help="default: from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="load a file into a table")
+    exp = sub.add_parser("export", help="write a table to a file")
+    for p in (imp, exp):
+        p.add_argument("table", choices=db.TABLES)
+        p.add_argument("path")
+    exp.add_argument("--start", help="first date to export (YYYY-MM-DD)")
+    exp.add_argument("--end", help="last date to export (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    if args.user and not db.DATA_DIR:
+        parser.error("--user needs LITEWEIGHT_DATA_DIR")
+    db.DB_NAME = db.user_database(args.user) if args.user else args.db
+    db.init_db()
+    if args.command == "import":
+        _print_report("Imported", import_file(args.table, args.path, args.format, args.chunk_size))
+    else:
+        report = export_file(args.table, args.path, args.format, args.start, args.end, args.chunk_size)
+        _print_report("Exported", report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Process-wide LRU cache for query results, invalidated by table writes.
+
+Every table has a generation counter. A cached result remembers the
+generations of the tables it was read from and is only served while they are
+unchanged; writers call ``invalidate`` after committing, which bumps the
+counters and drops dependent entries.
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+
+def _sizeof(value):
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if hasattr(value, "memory_usage"):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    return sys.getsizeof(value)
+
+
+def _copy(value):
+    # Callers freely mutate returned frames (e.g. converting the date column),
+    # so never hand out the cached object itself.
+    return value.copy() if hasattr(value, "copy") else value
+
+
+class QueryCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, tables, generations)
+        self._generations = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _current(self, tables):
+        return tuple(self._generations.get(t, 0) for t in tables)
+
+    def get_or_load(self, key, tables, loader):
+        """Return the cached result for ``key`` or call ``loader`` and cache it.
+
+        ``tables`` lists every table the result depends on.
+        """
+        with self._lock:
+            generations = self._current(tables)
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] == generations:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry[0])
+            self.misses += 1
+
+        # Generations were captured before reading, so a write that lands while
+        # the query runs leaves this result already stale and it is not served.
+        value = loader()
+        size = _sizeof(value)
+        with self._lock:
+            if size <= self.max_bytes and self._current(tables) == generations:
+                self._discard(key)
+                self._entries[key] = (value, size, tuple(tables), generations)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    self._discard(next(iter(self._entries)))
+                    self.evictions += 1
+        return _copy(value)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def invalidate(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [k for k, e in self._entries.items() if set(e[2]) & set(tables)]
+            for key in stale:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,45 @@
+"""Chart helpers for the Progress tab.
+
+Sending every point of a years-long series to the browser is slow to
+serialize and to draw, and a chart a few hundred pixels wide can't show it
+anyway. ``downsample`` keeps the minimum and maximum of each bucket, which
+preserves spikes, dips and the overall envelope of the line.
+"""
+import numpy as np
+
+# Roughly the pixel width of a centered-layout chart.
+CHART_POINTS = 1000
+
+
+def minmax_indices(values, max_points):
+    """Positions of the points to keep so at most ``max_points`` (at least 4) remain.
+
+    ``values`` is split into ``(max_points - 2) // 2`` equal-count buckets and
+    the position of each bucket's min and max is kept, plus the first and
+    last point. Everything is done with whole-array operations.
+    """
+    if max_points < 4:
+        raise ValueError(f"max_points must be at least 4, not {max_points}")
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    buckets = (max_points - 2) // 2
+    size = -(-n // buckets)  # ceil(n / buckets)
+    # Pad with the last value so the series reshapes into equal buckets; any
+    # position picked from the padding is clamped back onto the last point.
+    padded = np.empty(buckets * size)
+    padded[:n] = values
+    padded[n:] = values[-1]
+    grid = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    lows = np.minimum(offsets + grid.argmin(axis=1), n - 1)
+    highs = np.minimum(offsets + grid.argmax(axis=1), n - 1)
+    return np.unique(np.concatenate(([0, n - 1], lows, highs)))
+
+
+def downsample(series, max_points=CHART_POINTS):
+    """Return ``series`` reduced to at most ``max_points`` points, in order."""
+    if len(series) <= max_points:
+        return series
+    return series.iloc[minmax_indices(series.to_numpy(), max_points)]
@@ -0,0 +1,1211 @@
+"""SQLite data access shared by the LiteWeight Streamlit apps.
+
+Connections are long-lived: ``connection()`` lends one from a pool per
+database and takes it back at the end of the ``with`` block, so Streamlit
+reruns, each on a new script thread, reuse the same few connections (and
+their statement caches) for as long as the process runs. They are opened in
+WAL mode so readers never block the single writer.
+"""
+import argparse
+import atexit
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from cache import QueryCache
+from timing import increment, record, register_gauges, timed, timer
+
+DB_NAME = os.getenv("LITEWEIGHT_DB", "liteweight.db")
+# With this set every user gets their own database file under it (see
+# user_database and users.py); otherwise every session shares DB_NAME.
+DATA_DIR = os.getenv("LITEWEIGHT_DATA_DIR")
+
+# How long a writer waits on a locked database before raising.
+BUSY_TIMEOUT_MS = 5000
+# Per-connection prepared statement cache (sqlite3 default is 128).
+STATEMENT_CACHE_SIZE = 256
+# NORMAL is durable across application crashes in WAL mode and avoids an
+# fsync on every commit; FULL also survives power loss.
+SYNCHRONOUS = os.getenv("LITEWEIGHT_SYNCHRONOUS", "NORMAL")
+# Open connections kept across all databases; beyond this the least recently
+# returned idle ones are closed, and any left idle for IDLE_SECONDS.
+MAX_CONNECTIONS = int(os.getenv("LITEWEIGHT_MAX_CONNECTIONS", "64"))
+IDLE_SECONDS = float(os.getenv("LITEWEIGHT_IDLE_SECONDS", "300"))
+# Memory budget for cached fetch results shared by all sessions.
+QUERY_CACHE_BYTES = int(os.getenv("LITEWEIGHT_QUERY_CACHE_MB", "64")) * 1024 * 1024
+# Reads and write transactions slower than this are logged to "liteweight.slow_queries".
+SLOW_QUERY_MS = float(os.getenv("LITEWEIGHT_SLOW_QUERY_MS", "100"))
+# Hand inserts to a background writer that commits them in groups (writer.py).
+WRITE_BEHIND = os.getenv("LITEWEIGHT_WRITE_BEHIND", "0") == "1"
+# How long wait_for_write waits for a queued insert to commit.
+WRITE_TIMEOUT = float(os.getenv("LITEWEIGHT_WRITE_TIMEOUT", "10"))
+
+TABLES = ("weights", "activities", "foods", "water", "fastings", "exercises")
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS weights(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        weight REAL NOT NULL,
+        date TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS activities(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type TEXT NOT NULL,
+        duration REAL NOT NULL,
+        date TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS foods(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        description TEXT,
+        calories REAL,
+        date TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS water(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        volume REAL NOT NULL,
+        date TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fastings(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        duration REAL NOT NULL,
+        date TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS exercises(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        routine TEXT NOT NULL,
+        date TEXT NOT NULL
+    )
+    """,
+)
+
+# Per-day rollups maintained by the insert_* functions so dashboards can
+# aggregate over days instead of raw entries.
+SUMMARY_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS daily_summary(
+        date TEXT PRIMARY KEY,
+        weight_count INTEGER NOT NULL DEFAULT 0,
+        weight_sum REAL NOT NULL DEFAULT 0,
+        activity_count INTEGER NOT NULL DEFAULT 0,
+        activity_minutes REAL NOT NULL DEFAULT 0,
+        food_count INTEGER NOT NULL DEFAULT 0,
+        food_calories REAL NOT NULL DEFAULT 0,
+        water_count INTEGER NOT NULL DEFAULT 0,
+        water_volume REAL NOT NULL DEFAULT 0,
+        fasting_count INTEGER NOT NULL DEFAULT 0,
+        fasting_hours REAL NOT NULL DEFAULT 0,
+        exercise_count INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS daily_routines(
+        date TEXT NOT NULL,
+        routine TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, routine)
+    ) WITHOUT ROWID
+    """,
+)
+
+# table -> (count column, sum column, summed source column) in daily_summary
+ROLLUPS = {
+    "weights": ("weight_count", "weight_sum", "weight"),
+    "activities": ("activity_count", "activity_minutes", "duration"),
+    "foods": ("food_count", "food_calories", "calories"),
+    "water": ("water_count", "water_volume", "volume"),
+    "fastings": ("fasting_count", "fasting_hours", "duration"),
+    "exercises": ("exercise_count", None, None),
+}
+SUMMARY_COLUMNS = [c for cols in ROLLUPS.values() for c in cols[:2] if c]
+
+# Covering indexes: every fetch filters or sorts on date and reads only the
+# small numeric/label columns, so those queries never touch the table itself.
+# foods.description is left out to keep its index narrow.
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_weights_date ON weights(date, weight)",
+    "CREATE INDEX IF NOT EXISTS idx_activities_date ON activities(date, type, duration)",
+    "CREATE INDEX IF NOT EXISTS idx_foods_date ON foods(date, calories)",
+    "CREATE INDEX IF NOT EXISTS idx_water_date ON water(date, volume)",
+    "CREATE INDEX IF NOT EXISTS idx_fastings_date ON fastings(date, duration)",
+    "CREATE INDEX IF NOT EXISTS idx_exercises_date ON exercises(date, routine)",
+)
+
+# Compact dtypes of fetched columns: dates are parsed once when loaded,
+# repeated labels become categoricals (meals are logged over and over, so
+# descriptions too) and measures float32. Anything else is left to pandas.
+DTYPES = {
+    "date": "datetime64[s]",
+    "type": "category",
+    "routine": "category",
+    "description": "category",
+    "weight": "float32",
+    "duration": "float32",
+    "volume": "float32",
+    "calories": "float32",
+}
+# Reads are converted this many rows at a time, so a large fetch never holds
+# more than one chunk as Python tuples.
+FETCH_CHUNK_SIZE = 100_000
+
+# Distinct food descriptions with how often and when they were last logged,
+# maintained on insert like the daily rollups, and an FTS5 index over them
+# for the description autocomplete. Matching distinct meals rather than raw
+# foods rows keeps searches fast however often a meal is repeated. New meals
+# are indexed by _upsert_food_history itself; per-row triggers made bulk
+# imports several times slower.
+FOOD_SEARCH_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS food_history(
+        description TEXT NOT NULL UNIQUE COLLATE NOCASE,
+        uses INTEGER NOT NULL,
+        last_date TEXT NOT NULL,
+        last_calories REAL
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS food_search USING fts5(
+        description, content='food_history', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+)
+
+# Suggestions are ranked by uses, discounted by days since last logged: a meal
+# last eaten RECENCY_DAYS ago counts half as much as one eaten today.
+RECENCY_DAYS = 30
+
+# One row per table with entries moved to the columnar archive (archive.py).
+ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS archive_manifest(
+        name TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        through TEXT NOT NULL,
+        categories TEXT NOT NULL
+    )
+"""
+
+FoodMatch = namedtuple("FoodMatch", "description calories uses last_date")
+
+# Columns each fetch_* may select, in default order.
+COLUMNS = {
+    "weights": ("weight", "date"),
+    "activities": ("type", "duration", "date"),
+    "foods": ("description", "calories", "date"),
+    "water": ("volume", "date"),
+    "fastings": ("duration", "date"),
+    "exercises": ("routine", "date"),
+}
+
+_lock = threading.Lock()
+_idle = {}  # db path -> [[sqlite3.Connection, time returned], ...], last returned last
+_lent = {}  # db path -> number of connections lent out
+_held = threading.local()  # .conns: {db path: [connection, nesting depth]} lent to this thread
+_writers = {}  # db path -> writer.GroupCommitWriter
+_observers = {}  # db path -> _Observer
+_last_sweep = 0.0
+_current = threading.local()
+_resolver = None
+_migrated = set()  # db paths whose schema is current
+_migrate_lock = threading.Lock()
+
+query_cache = QueryCache(QUERY_CACHE_BYTES)
+register_gauges("query_cache", query_cache.stats)
+
+slow_log = logging.getLogger("liteweight.slow_queries")
+
+
+class _Observer:
+    """Tells commits by other processes from this process's own, for one database.
+
+    ``PRAGMA data_version`` changes when any connection but the one asking
+    commits, so it is asked on a connection of its own that never writes.
+    This process's inserts commit through ``commit``, which takes them into
+    account; any other change is someone else's.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.version = None  # unknown until read: counts as a change
+
+    def _read(self):
+        if self.conn is None:
+            # Not _open: its pragmas would wait for the write lock commit() is called with.
+            self.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def changed(self):
+        """Whether another process committed since the last check."""
+        with self.lock:
+            version = self._read()
+            changed, self.version = version != self.version, version
+        return changed
+
+    def commit(self, conn):
+        """Commit ``conn``'s write transaction; returns whether another process committed before it."""
+        with self.lock:
+            # conn holds the write lock, so nobody else commits in between.
+            changed = self._read() != self.version
+            conn.commit()
+            self.version = self._read()
+        return changed
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+            self.conn = self.version = None
+
+
+def _open(path):
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    # Only takes effect on a new database, before its first table; older ones
+    # are converted by maintenance.run (one full VACUUM). Setting it again
+    # rewrites the header, which other connections see as a commit.
+    if not conn.execute("PRAGMA page_count").fetchone()[0]:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def user_database(user_id):
+    """Path of ``user_id``'s database under DATA_DIR.
+
+    Files are spread over 256 subdirectories by a hash of the id, which also
+    keeps ids that differ only in punctuation or case apart.
+    """
+    digest = hashlib.sha256(user_id.encode()).hexdigest()
+    slug = re.sub(r"[^a-z0-9._-]+", "-", user_id.lower()).strip(".-")[:40] or "user"
+    directory = os.path.join(DATA_DIR, digest[:2])
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{slug}-{digest[:12]}.db")
+
+
+def use_database(path):
+    """Point the calling thread's db calls at ``path``; ``None`` restores the default."""
+    _current.path = path
+
+
+def set_database_resolver(func):
+    """Use ``func()`` (a path or ``None``) for threads that haven't called ``use_database``."""
+    global _resolver
+    _resolver = func
+
+
+def current_database():
+    """The database db calls on this thread use: see ``use_database``, else DB_NAME."""
+    path = getattr(_current, "path", None)
+    if path is None and _resolver is not None:
+        path = _resolver()
+    return path or DB_NAME
+
+
+def _evict(now):
+    # Called with _lock held; returns the idle connections and writers for
+    # the caller to close, and the databases still connected to if any
+    # database may have lost its last connection.
+    global _last_sweep
+    _last_sweep = now
+    closing = []
+    for path, pool in _idle.items():
+        # Oldest first: a pool only keeps as many connections as it has lately needed.
+        while pool and now - pool[0][1] > IDLE_SECONDS:
+            closing.append(pool.pop(0)[0])
+    excess = sum(map(len, _idle.values())) + sum(_lent.values()) + len(_observers) - MAX_CONNECTIONS
+    if excess > 0:
+        entries = sorted((entry for pool in _idle.values() for entry in pool), key=lambda entry: entry[1])
+        for entry in entries[:excess]:
+            for pool in _idle.values():
+                if entry in pool:
+                    pool.remove(entry)
+                    break
+            closing.append(entry[0])
+    emptied = [path for path, pool in _idle.items() if not pool]
+    for path in emptied:
+        del _idle[path]
+    idle = [path for path, writer in _writers.items() if now - writer.last_used > IDLE_SECONDS]
+    connected = set(_idle) | set(_lent) if closing or emptied else None
+    return closing, [_writers.pop(path) for path in idle], connected
+
+
+def _close(evicted):
+    closing, writers, connected = evicted
+    for conn in closing:
+        conn.close()
+    for writer in writers:
+        writer.close()
+    if connected is not None:
+        _release(connected)
+
+
+def _release(connected):
+    # A database's observer and archive memory maps go with its last pooled
+    # connection. archive.py is only loaded once some database has archived rows.
+    with _lock:
+        observers = [_observers.pop(path) for path in list(_observers) if path not in connected]
+    for observer in observers:
+        observer.close()
+    archive = sys.modules.get("archive")
+    if archive is not None:
+        archive.retain(connected)
+
+
+def _observer(path):
+    with _lock:
+        observer = _observers.get(path)
+        if observer is None:
+            observer = _observers[path] = _Observer(path)
+    return observer
+
+
+@contextmanager
+def _own_transaction(conn, path):
+    """A write transaction on ``conn`` that ``_cached`` knows this process made."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        if _observer(path).commit(conn):
+            invalidate(path, "*")
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def _checkout(path):
+    now = time.monotonic()
+    with _lock:
+        pool = _idle.get(path)
+        conn = pool.pop()[0] if pool else None
+        _lent[path] = _lent.get(path, 0) + 1
+    if now - _last_sweep > IDLE_SECONDS / 4:
+        with _lock:
+            evicted = _evict(now)
+        _close(evicted)
+    if conn is None:
+        try:
+            conn = _open(path)
+        except BaseException:
+            _checkin(path, None)
+            raise
+    return conn
+
+
+def _checkin(path, conn):
+    if conn is not None and conn.in_transaction:
+        # Left open by a block that raised mid-transaction.
+        conn.rollback()
+    now = time.monotonic()
+    with _lock:
+        _lent[path] -= 1
+        if not _lent[path]:
+            del _lent[path]
+        if conn is not None:
+            _idle.setdefault(path, []).append([conn, now])
+        evicted = _evict(now)
+    _close(evicted)
+
+
+@contextmanager
+def connection(path=None):
+    """Lend a pooled connection to ``path`` (default ``current_database()``) for the ``with`` block.
+
+    The most recently returned connection is lent first, whichever thread
+    returned it. Nested blocks on one thread get the same connection, so
+    they share its transaction.
+    """
+    path = path or current_database()
+    held = _held.__dict__.setdefault("conns", {})
+    entry = held.get(path)
+    if entry is None:
+        entry = held[path] = [_checkout(path), 0]
+    entry[1] += 1
+    try:
+        yield entry[0]
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del held[path]
+            _checkin(path, entry[0])
+
+
+def connection_stats():
+    with _lock:
+        idle = sum(map(len, _idle.values()))
+        lent = sum(_lent.values())
+        return {
+            "open": idle + lent + len(_observers),
+            "idle": idle,
+            "lent": lent,
+            "databases": len(set(_idle) | set(_lent)),
+            "writers": len(_writers),
+            "observers": len(_observers),
+        }
+
+
+register_gauges("connections", connection_stats)
+
+
+def _writer(path):
+    # Called with _lock held.
+    from writer import GroupCommitWriter
+
+    writer = _writers.get(path)
+    if writer is None:
+        writer = _writers[path] = GroupCommitWriter(path)
+    return writer
+
+
+def get_writer(path=None):
+    """Return the group-commit writer for ``path`` (default ``current_database()``), starting it if needed."""
+    with _lock:
+        return _writer(path or current_database())
+
+
+def flush_writes(timeout=None):
+    """Wait until every queued write-behind insert is committed."""
+    for writer in list(_writers.values()):
+        writer.flush(timeout)
+
+
+def wait_for_write(result, timeout=None):
+    """Block until the insert that returned ``result`` is committed.
+
+    A synchronous insert has already committed (``result`` is None). A
+    write-behind one re-raises the writer's error here, or ``TimeoutError``
+    if it is still queued after ``timeout`` (default ``WRITE_TIMEOUT``) seconds.
+    """
+    if result is not None:
+        result.result(WRITE_TIMEOUT if timeout is None else timeout)
+
+
+def close_writers():
+    with _lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+# Queued inserts are committed, not dropped, when the process exits cleanly.
+atexit.register(close_writers)
+
+
+def close_all():
+    """Close every writer and idle connection (connections lent out stay open).
+
+    Archive memory maps of databases with no connection left are dropped too.
+    """
+    close_writers()
+    _migrated.clear()
+    with _lock:
+        pools = list(_idle.values())
+        _idle.clear()
+        connected = set(_lent)
+    for pool in pools:
+        for conn, _ in pool:
+            conn.close()
+    _release(connected)
+
+
+def _create_tables(conn):
+    has_summary = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_summary'"
+    ).fetchone()
+    for statement in SCHEMA + SUMMARY_SCHEMA:
+        conn.execute(statement)
+    if not has_summary:
+        # Databases created before the rollup existed need a backfill.
+        _rebuild_summary(conn)
+
+
+def _create_indexes(conn):
+    for statement in INDEXES:
+        conn.execute(statement)
+
+
+def _create_food_search(conn):
+    for statement in FOOD_SEARCH_SCHEMA:
+        conn.execute(statement)
+    _rebuild_food_history(conn)
+
+
+def _create_archive_manifest(conn):
+    conn.execute(ARCHIVE_SCHEMA)
+
+
+# Schema migrations, applied in order. A database's PRAGMA user_version is the
+# number already applied, so new indexes or columns (ALTER TABLE ... ADD
+# COLUMN) go in a new function appended here; never edit a shipped one.
+# Databases from before versioning report 0, hence IF NOT EXISTS above.
+MIGRATIONS = (
+    _create_tables,
+    _create_indexes,
+    _create_food_search,
+    _create_archive_manifest,
+)
+
+
+def _migrate(conn):
+    """Apply pending MIGRATIONS in one transaction and return the schema version."""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return len(MIGRATIONS)
+    # Take the write lock before re-reading the version so two processes
+    # starting together don't both migrate.
+    conn.execute("BEGIN IMMEDIATE")
+    with conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version, migration in enumerate(MIGRATIONS[version:], version + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+    return version
+
+
+def init_db():
+    """Bring the current database's schema up to date; only the first call per process per database does any work."""
+    path = current_database()
+    if path in _migrated:
+        return
+    with _migrate_lock:
+        if path not in _migrated:
+            with connection(path) as conn:
+                _migrate(conn)
+            _migrated.add(path)
+
+
+def _rebuild_summary(conn, since="", until=None):
+    # Only days in [since, until) are recomputed; earlier ones are left alone
+    # (their raw rows may be archived).
+    where = "date >= ?" + (" AND date < ?" if until else "")
+    params = (since, until) if until else (since,)
+    conn.execute(f"DELETE FROM daily_summary WHERE {where}", params)
+    conn.execute(f"DELETE FROM daily_routines WHERE {where}", params)
+    for table, (count_col, sum_col, source_col) in ROLLUPS.items():
+        if sum_col is None:
+            conn.execute(
+                f"INSERT INTO daily_summary (date, {count_col}) "
+                f"SELECT date, COUNT(*) FROM {table} WHERE {where} GROUP BY date "
+                f"ON CONFLICT(date) DO UPDATE SET {count_col} = excluded.{count_col}",
+                params,
+            )
+        else:
+            conn.execute(
+                f"INSERT INTO daily_summary (date, {count_col}, {sum_col}) "
+                f"SELECT date, COUNT(*), TOTAL({source_col}) FROM {table} WHERE {where} GROUP BY date "
+                f"ON CONFLICT(date) DO UPDATE SET {count_col} = excluded.{count_col}, {sum_col} = excluded.{sum_col}",
+                params,
+            )
+    conn.execute(
+        "INSERT INTO daily_routines (date, routine, count) "
+        f"SELECT date, routine, COUNT(*) FROM exercises WHERE {where} GROUP BY date, routine",
+        params,
+    )
+
+
+def _rebuild_food_history(conn, chunk_size=50_000, archived=None):
+    conn.execute("DELETE FROM food_history")
+    conn.execute("INSERT INTO food_search (food_search) VALUES ('delete-all')")
+    if archived:
+        import archive
+
+        for rows in archive.iter_rows("foods", archived, chunk_size=chunk_size):
+            _upsert_food_history(conn, rows)
+    cursor = conn.execute("SELECT description, calories, date FROM foods ORDER BY date, id")
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        _upsert_food_history(conn, rows)
+
+
+def rebuild_daily_summary():
+    """Recompute daily_summary, daily_routines and food_history from the raw log tables.
+
+    Days before the newest archive horizon keep their rollups; food_history
+    also counts archived meals.
+    """
+    path = current_database()
+    with connection(path) as conn, conn:
+        since = conn.execute("SELECT COALESCE(MAX(through), '') FROM archive_manifest").fetchone()[0]
+        _rebuild_summary(conn, since)
+        _rebuild_food_history(conn, archived=_archived(conn, "foods"))
+    invalidate(path, "daily_summary", "daily_routines")
+
+
+def _rollup_sql(table):
+    """Upsert adding entries to ``table``'s daily_summary row.
+
+    Parameters are ``(date, count)`` for count-only tables, else
+    ``(date, count, amount)``.
+    """
+    count_col, sum_col, _ = ROLLUPS[table]
+    if sum_col is None:
+        return (
+            f"INSERT INTO daily_summary (date, {count_col}) VALUES (?, ?) "
+            f"ON CONFLICT(date) DO UPDATE SET {count_col} = {count_col} + excluded.{count_col}"
+        )
+    return (
+        f"INSERT INTO daily_summary (date, {count_col}, {sum_col}) VALUES (?, ?, COALESCE(?, 0)) "
+        f"ON CONFLICT(date) DO UPDATE SET {count_col} = {count_col} + excluded.{count_col}, "
+        f"{sum_col} = {sum_col} + excluded.{sum_col}"
+    )
+
+
+def _upsert_food_history(conn, rows):
+    """Add ``(description, calories, date)`` rows to food_history."""
+    meals = {}  # lowercased description -> [description, uses, last_date, last_calories, calories_date]
+    for description, calories, day in rows:
+        description = (description or "").strip()
+        if not description:
+            continue
+        meal = meals.setdefault(description.lower(), [description, 0, day, None, ""])
+        meal[1] += 1
+        meal[2] = max(meal[2], day)
+        if calories is not None and day >= meal[4]:
+            meal[3], meal[4] = calories, day
+    # Rowids only grow, so everything past the current maximum is a new meal to index.
+    newest = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM food_history").fetchone()[0]
+    conn.executemany(
+        "INSERT INTO food_history (description, uses, last_date, last_calories) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(description) DO UPDATE SET uses = uses + excluded.uses, "
+        "last_calories = CASE WHEN excluded.last_calories IS NOT NULL AND excluded.last_date >= last_date "
+        "THEN excluded.last_calories ELSE last_calories END, "
+        "last_date = MAX(last_date, excluded.last_date)",
+        [meal[:4] for meal in meals.values()],
+    )
+    conn.execute(
+        "INSERT INTO food_search (rowid, description) SELECT rowid, description FROM food_history WHERE rowid > ?",
+        (newest,),
+    )
+
+
+def _insert_rows(conn, table, rows):
+    """Insert ``rows`` (tuples in COLUMNS[table] order) and roll them up.
+
+    Runs inside the caller's transaction. Rollups are aggregated per day
+    first, so a large batch costs one upsert per distinct date.
+    """
+    columns = COLUMNS[table]
+    conn.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows
+    )
+    source_col = ROLLUPS[table][2]
+    amount_index = columns.index(source_col) if source_col else None
+    days = {}
+    for row in rows:
+        day = days.setdefault(row[-1], [0, 0.0])
+        day[0] += 1
+        if amount_index is not None and row[amount_index] is not None:
+            day[1] += row[amount_index]
+    if amount_index is None:
+        conn.executemany(_rollup_sql(table), [(date, n) for date, (n, _) in days.items()])
+    else:
+        conn.executemany(_rollup_sql(table), [(date, n, total) for date, (n, total) in days.items()])
+    if table == "exercises":
+        routines = {}
+        for routine, date in rows:
+            routines[date, routine] = routines.get((date, routine), 0) + 1
+        conn.executemany(
+            "INSERT INTO daily_routines (date, routine, count) VALUES (?, ?, ?) "
+            "ON CONFLICT(date, routine) DO UPDATE SET count = count + excluded.count",
+            [(date, routine, n) for (date, routine), n in routines.items()],
+        )
+    elif table == "foods":
+        _upsert_food_history(conn, rows)
+
+
+def invalidate(path, *tables):
+    """Drop cached results read from ``tables`` of the database at ``path``."""
+    query_cache.invalidate(*((path, table) for table in tables))
+
+
+def _cached(sql, params, tables, loader):
+    path = current_database()
+    # Another process committed (bulk.py, db.py archive/maintain, a second
+    # server). Which tables it wrote isn't known, so everything cached from
+    # this database is dropped ("*"); this process's inserts only drop the
+    # tables they touch.
+    if _observer(path).changed():
+        invalidate(path, "*")
+    return query_cache.get_or_load(
+        (path, sql, *params), [(path, table) for table in (*tables, "*")], loader
+    )
+
+
+def _tables_touched(table):
+    return (table, "daily_summary", "daily_routines") if table == "exercises" else (table, "daily_summary")
+
+
+def insert_many(table, rows):
+    """Insert ``rows`` into ``table`` in a single transaction.
+
+    Each row is a tuple in ``COLUMNS[table]`` order (date last). The raw rows
+    and their rollups commit, or roll back, together.
+
+    With ``WRITE_BEHIND`` the rows are queued instead and a ``Future`` is
+    returned that resolves once they are committed.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    path = current_database()
+    if WRITE_BEHIND:
+        # Under _lock so an idle sweep can't close the writer in between.
+        with _lock:
+            return _writer(path).submit(table, rows)
+    start = time.perf_counter()
+    with connection(path) as conn, _own_transaction(conn, path):
+        _insert_rows(conn, table, rows)
+    _log_query("sqlite.write", f"insert {len(rows)} row(s) into {table}", (), time.perf_counter() - start)
+    invalidate(path, *_tables_touched(table))
+
+
+def _log_query(name, sql, params, seconds):
+    record(name, seconds)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        increment("slow_queries")
+        slow_log.warning("%.1f ms: %s%s", seconds * 1000, " ".join(sql.split()), f" {list(params)}" if params else "")
+
+
+def _query(sql, params=()):
+    """Run a read, returning ``(rows, column names)``; timed as "sqlite.read"."""
+    start = time.perf_counter()
+    with connection() as conn:
+        cursor = conn.execute(sql, params)
+        rows = cursor.fetchall()
+    _log_query("sqlite.read", sql, params, time.perf_counter() - start)
+    return rows, [d[0] for d in cursor.description]
+
+
+def _typed_frame(rows, columns):
+    import numpy as np
+    import pandas as pd
+
+    # One object array, sliced per column, is much cheaper than zip(*rows).
+    table = np.array(rows, dtype=object) if rows else np.empty((0, len(columns)), dtype=object)
+    data = {}
+    for i, column in enumerate(columns):
+        values = table[:, i]
+        dtype = DTYPES.get(column)
+        if column == "date":
+            # NumPy parses ISO dates directly, much faster than pd.to_datetime.
+            data[column] = values.astype("datetime64[D]").astype(dtype)
+        elif dtype == "category":
+            data[column] = pd.Categorical(values)
+        elif dtype:
+            data[column] = values.astype(dtype)  # None becomes NaN
+        else:
+            data[column] = pd.Series(values.tolist(), dtype=None if len(values) else object)
+    return pd.DataFrame(data)
+
+
+def _frames(sql, params=(), chunk_size=FETCH_CHUNK_SIZE):
+    """Yield the rows of ``sql`` as DataFrames (see DTYPES) of up to ``chunk_size`` rows.
+
+    SQLite time is recorded once the result is exhausted, as "sqlite.read";
+    building each frame is recorded as "pandas.frame".
+    """
+    with connection() as conn:
+        start = time.perf_counter()
+        cursor = conn.execute(sql, params)
+        columns = [d[0] for d in cursor.description]
+        fetching = time.perf_counter() - start
+        first = True
+        while True:
+            start = time.perf_counter()
+            rows = cursor.fetchmany(chunk_size)
+            fetching += time.perf_counter() - start
+            if not rows and not first:
+                break
+            with timer("pandas.frame"):
+                frame = _typed_frame(rows, columns)
+            yield frame
+            first = False
+            if len(rows) < chunk_size:
+                break
+    _log_query("sqlite.read", sql, params, fetching)
+
+
+def _concat(frames):
+    # pandas is imported on first read so logging an entry doesn't pay for it.
+    import pandas as pd
+
+    # An empty frame's labels have no dtype to unite with the others'.
+    frames = [f for f in frames if len(f)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+    with timer("pandas.frame"):
+        # Chunks see different labels; concat only keeps categoricals whose categories match.
+        for column in frames[0].columns:
+            if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+                categories = pd.api.types.union_categoricals([f[column] for f in frames]).categories
+                for f in frames:
+                    f[column] = f[column].cat.set_categories(categories)
+        return pd.concat(frames, ignore_index=True)
+
+
+def _read(sql, params=()):
+    return _concat(list(_frames(sql, params)))
+
+
+def _archived(conn, table):
+    """``table``'s archive manifest entry (see archive.py), or ``None``."""
+    if conn.execute("SELECT 1 FROM archive_manifest WHERE name = ?", (table,)).fetchone() is None:
+        return None
+    import archive
+
+    return archive.get_entry(conn, table)
+
+
+# Insert functions
+@timed("db.insert_weight")
+def insert_weight(weight: float, date: str):
+    return insert_many("weights", [(weight, date)])
+
+
+@timed("db.insert_activity")
+def insert_activity(activity_type: str, duration: float, date: str):
+    return insert_many("activities", [(activity_type, duration, date)])
+
+
+@timed("db.insert_food")
+def insert_food(description: str, calories: float, date: str):
+    return insert_many("foods", [(description, calories, date)])
+
+
+@timed("db.insert_foods")
+def insert_foods(rows):
+    """Insert many ``(description, calories, date)`` rows in one transaction."""
+    return insert_many("foods", rows)
+
+
+@timed("db.insert_water")
+def insert_water(volume: float, date: str):
+    return insert_many("water", [(volume, date)])
+
+
+@timed("db.insert_fasting")
+def insert_fasting(duration: float, date: str):
+    return insert_many("fastings", [(duration, date)])
+
+
+@timed("db.insert_exercise")
+def insert_exercise(routine: str, date: str):
+    return insert_many("exercises", [(routine, date)])
+
+
+def _iso(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def _range_clause(start, end):
+    where, params = [], []
+    if start is not None:
+        where.append("date >= ?")
+        params.append(_iso(start))
+    if end is not None:
+        where.append("date <= ?")
+        params.append(_iso(end))
+    return (" WHERE " + " AND ".join(where) if where else ""), params
+
+
+def _select(table, start, end, columns):
+    allowed = COLUMNS[table]
+    columns = allowed if columns is None else tuple(columns)
+    unknown = set(columns) - set(allowed)
+    if unknown:
+        raise ValueError(f"Unknown {table} column(s): {', '.join(sorted(unknown))}")
+    where, params = _range_clause(start, end)
+    return f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY date ASC", params
+
+
+def _fetch(table, start=None, end=None, columns=None):
+    """Read ``columns`` of ``table`` for dates in [start, end], oldest first.
+
+    Bounds are inclusive ISO dates (``str`` or ``datetime.date``); ``None``
+    leaves that side open. Columns have the compact dtypes in ``DTYPES``.
+    """
+    sql, params = _select(table, start, end, columns)
+
+    def load():
+        # One read transaction, so a compaction can't move rows between
+        # reading the manifest and reading the live table.
+        with connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                archived = _archived(conn, table)
+                live = _read(sql, params)
+            finally:
+                conn.commit()
+        if archived is None:
+            return live
+        import archive
+
+        frame = _concat([archive.read(table, archived, start, end, columns), live])
+        if "date" in frame and not frame["date"].is_monotonic_increasing:
+            # Entries backdated past the archive horizon are still in the live table.
+            frame = frame.sort_values("date", kind="stable", ignore_index=True)
+        return frame
+
+    return _cached(sql, params, (table,), load)
+
+
+# Fetch functions
+@timed("db.fetch_weights")
+def fetch_weights(start=None, end=None, columns=None):
+    return _fetch("weights", start, end, columns)
+
+
+@timed("db.fetch_activities")
+def fetch_activities(start=None, end=None, columns=None):
+    return _fetch("activities", start, end, columns)
+
+
+@timed("db.fetch_foods")
+def fetch_foods(start=None, end=None, columns=None):
+    return _fetch("foods", start, end, columns)
+
+
+@timed("db.fetch_water")
+def fetch_water(start=None, end=None, columns=None):
+    return _fetch("water", start, end, columns)
+
+
+@timed("db.fetch_fastings")
+def fetch_fastings(start=None, end=None, columns=None):
+    return _fetch("fastings", start, end, columns)
+
+
+@timed("db.fetch_exercises")
+def fetch_exercises(start=None, end=None, columns=None):
+    return _fetch("exercises", start, end, columns)
+
+
+def iter_rows(table, start=None, end=None, chunk_size=10_000):
+    """Yield lists of raw row tuples (``COLUMNS[table]`` order) for dates in [start, end].
+
+    Unlike the fetch_* functions this never holds more than ``chunk_size``
+    rows in memory, and it bypasses the query cache. Archived rows come first.
+    """
+    columns = COLUMNS[table]
+    where, params = _range_clause(start, end)
+    with connection() as conn:
+        # One read transaction, as in _fetch, so a compaction can't move rows
+        # between reading the manifest and reading the live table.
+        conn.execute("BEGIN")
+        try:
+            archived = _archived(conn, table)
+            if archived:
+                import archive
+
+                yield from archive.iter_rows(table, archived, start, end, chunk_size)
+            cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY date ASC, id ASC", params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            conn.commit()
+
+
+def iter_frames(table, start=None, end=None, columns=None, chunk_size=FETCH_CHUNK_SIZE):
+    """Like ``fetch_<table>`` but yields DataFrames of up to ``chunk_size`` rows.
+
+    For scans too large to hold at once; bypasses the query cache. Categorical
+    columns only list the labels present in each chunk. Archived rows come first.
+    """
+    sql, params = _select(table, start, end, columns)
+    with connection() as conn:
+        # _frames reads on this connection too, inside the same read transaction.
+        conn.execute("BEGIN")
+        try:
+            archived = _archived(conn, table)
+            if archived:
+                import archive
+
+                yield from archive.iter_frames(table, archived, start, end, columns, chunk_size)
+            yield from _frames(sql, params, chunk_size)
+        finally:
+            conn.commit()
+
+
+@timed("db.fetch_latest_weight")
+def fetch_latest_weight(end=None):
+    """Most recent weight logged on or before ``end``, or ``None``."""
+    sql = "SELECT weight, date FROM weights"
+    params = ()
+    if end is not None:
+        sql += " WHERE date <= ?"
+        params = (_iso(end),)
+    sql += " ORDER BY date DESC LIMIT 1"
+
+    def load():
+        with connection() as conn:
+            rows, _ = _query(sql, params)
+            archived = _archived(conn, "weights")
+        if archived:
+            import archive
+
+            last = archive.latest("weights", archived, "weight", end)
+            if last and (not rows or last[1] > rows[0][1]):
+                return last[0]
+        return rows[0][0] if rows else None
+
+    return _cached(sql, params, ("weights",), load)
+
+
+SEARCH_SQL = (
+    "SELECT h.description, h.last_calories, h.uses, h.last_date "
+    "FROM food_search JOIN food_history h ON h.rowid = food_search.rowid "
+    "WHERE food_search MATCH ? "
+    "ORDER BY h.uses / (1.0 + (julianday('now', 'localtime') - julianday(h.last_date)) / ?) DESC, "
+    "h.last_date DESC "
+    "LIMIT ?"
+)
+
+
+@timed("db.search_foods")
+def search_foods(text, limit=8):
+    """Past meals whose description has words starting with each word of ``text``.
+
+    Returns up to ``limit`` ``FoodMatch`` tuples, most used and most recently
+    logged first; ``calories`` is from the latest entry that had any.
+    """
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        return []
+    # Each word is quoted so FTS5 operators in the input are taken literally.
+    match = " ".join(f'"{word}"*' for word in words)
+    rows, _ = _query(SEARCH_SQL, (match, RECENCY_DAYS, limit))
+    return [FoodMatch(*row) for row in rows]
+
+
+def _summary_select(columns, start, end):
+    where, params = _range_clause(start, end)
+    return f"SELECT {', '.join(f'TOTAL({c})' for c in columns)} FROM daily_summary{where}", params
+
+
+def _routines_select(start, end):
+    where, params = _range_clause(start, end)
+    return f"SELECT routine, SUM(count) AS count FROM daily_routines{where} GROUP BY routine ORDER BY count DESC", params
+
+
+@timed("db.fetch_summary")
+def fetch_summary(start=None, end=None):
+    """Totals of every daily_summary column for dates in [start, end]."""
+    sql, params = _summary_select(SUMMARY_COLUMNS, start, end)
+
+    def load():
+        row = _query(sql, params)[0][0]
+        return {c: (int(v) if c.endswith("_count") else v) for c, v in zip(SUMMARY_COLUMNS, row)}
+
+    return _cached(sql, params, ("daily_summary",), load)
+
+
+@timed("db.fetch_daily")
+def fetch_daily(start=None, end=None):
+    """daily_summary rows for dates in [start, end], oldest first, as NumPy arrays.
+
+    Returns ``(dates, values)``: ``datetime64[D]`` dates and a float64 matrix
+    with a column per SUMMARY_COLUMNS. Days without entries have no row;
+    archived days keep theirs. No DataFrame, so reading a few days back after
+    every write stays cheap. The arrays are shared through the query cache
+    and read-only.
+    """
+    where, params = _range_clause(start, end)
+    sql = f"SELECT date, {', '.join(SUMMARY_COLUMNS)} FROM daily_summary{where} ORDER BY date"
+
+    def load():
+        import numpy as np
+
+        rows, _ = _query(sql, params)
+        dates = np.array([row[0] for row in rows], dtype="datetime64[D]")
+        values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), len(SUMMARY_COLUMNS))
+        dates.flags.writeable = values.flags.writeable = False
+        return dates, values
+
+    return _cached(sql, params, ("daily_summary",), load)
+
+
+@timed("db.fetch_routine_counts")
+def fetch_routine_counts(start=None, end=None):
+    """Exercise sessions per routine for dates in [start, end], most frequent first."""
+    sql, params = _routines_select(start, end)
+
+    def load():
+        return _read(sql, params).set_index("routine")["count"]
+
+    return _cached(sql, params, ("daily_routines",), load)
+
+
+def main(argv=None):
+    global DB_NAME
+    parser = argparse.ArgumentParser(description="LiteWeight database utilities")
+    parser.add_argument("--db", default=DB_NAME, help="database file (default: %(default)s)")
+    parser.add_argument("--user", help="use this user's database under LITEWEIGHT_DATA_DIR instead of --db")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild-summary", help="recompute the daily rollup tables from raw logs")
+    compact = sub.add_parser("archive", help="move old entries to the columnar archive (archive.py)")
+    compact.add_argument("--before", help="archive entries dated before this ISO date "
+                         "(default: LITEWEIGHT_ARCHIVE_AFTER_DAYS, 365, days ago)")
+    maintain = sub.add_parser("maintain", help="apply retention, vacuum, ANALYZE and checkpoint (maintenance.py)")
+    maintain.add_argument("--retention", help="policies as table=policy:days,... (default: LITEWEIGHT_RETENTION)")
+    args = parser.parse_args(argv)
+
+    if args.user and not DATA_DIR:
+        parser.error("--user needs LITEWEIGHT_DATA_DIR")
+    DB_NAME = user_database(args.user) if args.user else args.db
+    init_db()
+    if args.command == "rebuild-summary":
+        rebuild_daily_summary()
+        with connection() as conn:
+            days = conn.execute("SELECT COUNT(*) FROM daily_summary").fetchone()[0]
+        print(f"Rebuilt daily summary for {days} day(s) in {DB_NAME}")
+    elif args.command == "archive":
+        import archive
+
+        moved = archive.compact(args.before)
+        for table, entry in sorted(archive.manifest().items()):
+            print(f"  {table:<11} {moved.get(table, 0):>10,} moved  {entry.rows:>12,} archived before {entry.through}")
+    elif args.command == "maintain":
+        import maintenance
+
+        try:
+            policies = None if args.retention is None else maintenance.parse_retention(args.retention)
+        except ValueError as e:
+            parser.error(str(e))
+        maintenance.print_report(maintenance.run(policies))
+
+
+if __name__ == "__main__":
+    # archive.py and maintenance.py import db, which isn't this __main__
+    # module: run the imported module's main so they see the chosen database.
+    import db
+
+    db.main()
@@ -0,0 +1,53 @@
+"""Sidebar performance panel shared by the LiteWeight apps.
+
+Turned on with the "Performance" toggle in the sidebar. It shows where the
+last full script run spent its time (SQLite, pandas, archive reads, the
+vision API call and image preparation; the rest is Streamlit and app code)
+and the process-wide latency of every timed section.
+"""
+import streamlit as st
+
+import timing
+
+# Sections that don't contain other timed sections, by the part of the stack they measure.
+LAYERS = {
+    "SQLite": ("sqlite.",),
+    "pandas": ("pandas.",),
+    "Vision API": ("vision.request", "vision.stream", "vision.queue_wait"),
+    "Archive": ("archive.read",),
+    "Image prep": ("analysis.prepare_image",),
+}
+
+
+def _totals(breakdown):
+    totals = {}
+    for name, seconds in breakdown:
+        calls, total = totals.get(name, (0, 0.0))
+        totals[name] = (calls + 1, total + seconds)
+    return totals
+
+
+def debug_panel():
+    """Render the panel if enabled; call it last so the whole run is included."""
+    if not st.sidebar.toggle("Performance", key="perf_panel"):
+        return
+    totals = _totals(timing.run_breakdown())
+    run_ms = totals.get("script_run", (0, 0.0))[1] * 1000
+    sidebar = st.sidebar
+    sidebar.subheader(f"Last run: {run_ms:.0f} ms")
+    accounted = 0.0
+    for layer, prefixes in LAYERS.items():
+        ms = sum(total for name, (_, total) in totals.items() if name.startswith(prefixes)) * 1000
+        accounted += ms
+        sidebar.caption(f"{layer}: {ms:.1f} ms")
+    sidebar.caption(f"Streamlit and app code: {max(run_ms - accounted, 0.0):.1f} ms")
+    sidebar.table([
+        {"section": name, "calls": calls, "ms": round(total * 1000, 2)}
+        for name, (calls, total) in sorted(totals.items(), key=lambda item: -item[1][1])
+    ])
+    with sidebar.expander("Since startup"):
+        st.table([
+            {"section": name, "count": s["count"], "mean ms": round(s["mean_ms"], 2), "p95 ms": round(s["p95_ms"], 2)}
+            for name, s in sorted(timing.summary().items())
+        ])
+        st.download_button("Metrics (text)", timing.metrics_text(), file_name="liteweight_metrics.txt")
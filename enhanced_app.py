@@ -1,297 +1,324 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import openai
-import os
-import base64
-import sqlite3
-from datetime import datetime, date
+import time
+from datetime import datetime, date, timedelta
 
-# Initialize OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-DB_NAME = "liteweight.db"
-
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS weights(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            weight REAL NOT NULL,
-            date TEXT NOT NULL
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS activities(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT NOT NULL,
-            duration REAL NOT NULL,
-            date TEXT NOT NULL
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS foods(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            description TEXT,
-            calories REAL,
-            date TEXT NOT NULL
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS water(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            volume REAL NOT NULL,
-            date TEXT NOT NULL
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS fastings(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            duration REAL NOT NULL,
-            date TEXT NOT NULL
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS exercises(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            routine TEXT NOT NULL,
-            date TEXT NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
+from db import (
+    current_database, init_db, insert_weight, insert_activity, insert_food, insert_foods, insert_water, insert_fasting,
+    insert_exercise, fetch_weights, fetch_latest_weight, fetch_summary, fetch_routine_counts, search_foods,
+    wait_for_write,
+)
+from debug_panel import debug_panel
+import maintenance
+from timing import begin_run, record, start_exporter, timed, timer
+from users import select_database
 
+_run_started = time.perf_counter()
+begin_run()
+start_exporter()
+select_database()
+# Migrates the schema on the first run per database in this process; free afterwards.
 init_db()
-
-# Insert functions
-def insert_weight(weight, date_str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO weights (weight, date) VALUES (?, ?)", (weight, date_str))
-    conn.commit()
-    conn.close()
-
-def insert_activity(activity_type, duration, date_str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO activities (type, duration, date) VALUES (?, ?, ?)", (activity_type, duration, date_str))
-    conn.commit()
-    conn.close()
-
-def insert_food(desc, calories, date_str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO foods (description, calories, date) VALUES (?, ?, ?)", (desc, calories, date_str))
-    conn.commit()
-    conn.close()
-
-def insert_water(volume, date_str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO water (volume, date) VALUES (?, ?)", (volume, date_str))
-    conn.commit()
-    conn.close()
-
-def insert_fasting(duration, date_str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO fastings (duration, date) VALUES (?, ?)", (duration, date_str))
-    conn.commit()
-    conn.close()
-
-def insert_exercise(routine, date_str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO exercises (routine, date) VALUES (?, ?)", (routine, date_str))
-    conn.commit()
-    conn.close()
-
-# Fetch functions
-def fetch_weights():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT weight, date FROM weights ORDER BY date ASC", conn)
-    conn.close()
-    return df
-
-def fetch_activities():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT type, duration, date FROM activities", conn)
-    conn.close()
-    return df
-
-def fetch_foods():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT description, calories, date FROM foods", conn)
-    conn.close()
-    return df
-
-def fetch_water():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT volume, date FROM water", conn)
-    conn.close()
-    return df
-
-def fetch_fastings():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT duration, date FROM fastings", conn)
-    conn.close()
-    return df
-
-def fetch_exercises():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT routine, date FROM exercises", conn)
-    conn.close()
-    return df
-
-# Helper function for AI food analysis
-def analyze_food_image(image_bytes):
-    base64_image = base64.b64encode(image_bytes).decode("utf-8")
-    system_prompt = ("You are a nutritionist AI analyzing photos of food for a fitness tracking app. "
-                     "Given an image of food, provide a JSON object with the fields: "
-                     "'description': a short description of the food, "
-                     "'calories': your best guess of total calories as a number, "
-                     "and 'confidence': a value between 0 and 1 indicating confidence in the calorie estimate. "
-                     "If the image does not contain food, respond with description '', calories 0, and confidence 0.")
-    response = openai.ChatCompletion.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": [ {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"} } ] }
-        ],
-        max_tokens=400,
-    )
-    return response["choices"][0]["message"]["content"]
+# Vacuum, ANALYZE and retention, in the background once a day per database.
+maintenance.schedule()
 
 # UI configuration
 st.set_page_config(page_title="LiteWeight", page_icon="🏋️", layout="centered")
 
-tabs = st.tabs(["Activity", "Consumption", "Progress"])
-today = date.today()
-selected_date = st.date_input("Select Date", value=today, key="selected_date")
+# Saving entries
+def save_entry(message, insert, *args):
+    """Run ``insert(*args)`` and show ``message`` once it is committed, or the error."""
+    try:
+        # In write-behind mode the insert only queues the rows.
+        wait_for_write(insert(*args))
+    except Exception as e:
+        st.error(f"Could not save the entry: {e or type(e).__name__}")
+        return False
+    st.success(message)
+    return True
 
-# Activity Tab
-with tabs[0]:
-    st.header(selected_date.strftime("%A, %B %d"))
-    # Weight Section
+# Weight Section
+@st.fragment
+@timed("weight_section")
+def weight_section(selected_date):
     st.subheader("Weight")
-    weight_df = fetch_weights()
-    last_weight = weight_df["weight"].iloc[-1] if not weight_df.empty else None
+    last_weight = fetch_latest_weight(selected_date)
     st.text_input("Last weight (lbs)", value=str(last_weight) if last_weight else "No previous entry", disabled=True)
     weight_value = st.number_input("Weight (lbs)", min_value=0.0, step=0.1, key="weight_input")
     if st.button("Log Weight"):
-        insert_weight(weight_value, selected_date.isoformat())
-        st.success(f"Logged weight {weight_value} lbs on {selected_date}")
-    st.divider()
+        save_entry(f"Logged weight {weight_value} lbs on {selected_date}",
+                   insert_weight, weight_value, selected_date.isoformat())
 
-    # Walk/Run Section
+# Walk/Run Section
+@st.fragment
+@timed("activity_section")
+def activity_section(selected_date):
     st.subheader("Walk/Run")
     act_type = st.radio("Type", ["Walk", "Run"], horizontal=True, key="act_type")
     act_duration = st.number_input("Duration (minutes)", min_value=0.0, step=1.0, key="act_duration")
     if st.button("Log Activity"):
-        insert_activity(act_type, act_duration, selected_date.isoformat())
-        st.success(f"Logged {act_type} for {act_duration} minutes on {selected_date}")
-    st.divider()
+        save_entry(f"Logged {act_type} for {act_duration} minutes on {selected_date}",
+                   insert_activity, act_type, act_duration, selected_date.isoformat())
 
-    # Fasting Section
+# Fasting Section
+@st.fragment
+@timed("fasting_section")
+def fasting_section(selected_date):
     st.subheader("Fasting")
     fasting_hours = st.number_input("Hours", min_value=0.0, step=1.0, key="fasting_hours")
     if st.button("Log Fasting"):
-        insert_fasting(fasting_hours, selected_date.isoformat())
-        st.success(f"Logged fasting session of {fasting_hours} hours on {selected_date}")
-    st.divider()
+        save_entry(f"Logged fasting session of {fasting_hours} hours on {selected_date}",
+                   insert_fasting, fasting_hours, selected_date.isoformat())
 
-    # Exercise Section
+# Exercise Section
+@st.fragment
+@timed("exercise_section")
+def exercise_section(selected_date):
     st.subheader("Exercise")
     routines = ["Upper Body", "Lower Body", "Full Body", "Cardio"]
     exercise_routine = st.selectbox("Choose routine", routines, key="exercise_routine")
     if st.button("Log Exercise Done"):
-        insert_exercise(exercise_routine, selected_date.isoformat())
-        st.success(f"Logged exercise routine: {exercise_routine} on {selected_date}")
+        save_entry(f"Logged exercise routine: {exercise_routine} on {selected_date}",
+                   insert_exercise, exercise_routine, selected_date.isoformat())
 
-# Consumption Tab
-with tabs[1]:
-    st.header("Consumption")
-    # Food Section
+# Food Section
+def use_past_meal(description_key, calories_key):
+    """Fill the food inputs from the suggestion just picked."""
+    meal = st.session_state["past_meal"]
+    if meal is not None:
+        st.session_state[description_key] = meal.description
+        if meal.calories is not None:
+            st.session_state[calories_key] = meal.calories
+    st.session_state["past_meal"] = None
+
+
+def meal_label(meal):
+    return meal.description if meal.calories is None else f"{meal.description} ({meal.calories:.0f} kcal)"
+
+
+@st.fragment
+@timed("food_section")
+def food_section(selected_date):
     st.subheader("Food Analysis & Log")
-    food_file = st.file_uploader("Upload food photo", type=["png", "jpg", "jpeg"], key="food_file")
-    manual_desc = st.text_input("Description (optional)", key="manual_desc")
-    manual_cal = st.number_input("Calories (optional)", min_value=0.0, step=1.0, key="manual_cal")
+    food_files = st.file_uploader(
+        "Upload food photos", type=["png", "jpg", "jpeg"], accept_multiple_files=True, key="food_file"
+    )
+    manual_desc = st.text_input("Description (optional)", key="manual_desc", live=True)
+    # Past meals matching what has been typed so far; picking one also fills in its calories.
+    typed = manual_desc.strip()
+    matches = [m for m in search_foods(typed) if m.description.lower() != typed.lower()] if len(typed) >= 2 else []
+    if matches:
+        st.pills(
+            "Past meals", matches, format_func=meal_label, key="past_meal",
+            on_change=use_past_meal, args=("manual_desc", "manual_cal"),
+        )
+    # Filled in below, after a streamed analysis has had a chance to prefill it.
+    calories_slot = st.empty()
     if st.button("Analyze Photo"):
-        if food_file:
+        # Loads the OpenAI client and Pillow, so only once a photo is analysed.
+        from food_analysis import AnalysisStream, analyze_food_images, parse_analysis
+
+        if food_files and len(food_files) == 1:
+            # A single photo is streamed so the reply (and calories) show up as they are generated.
             try:
-                content = analyze_food_image(food_file.read())
+                # Inside the try: decoding the photo (Pillow) can fail as well.
+                stream = AnalysisStream(food_files[0].getvalue())
                 st.write("AI analysis result:")
-                st.code(content)
+                result_box = st.empty()
+                for _ in stream:
+                    result_box.code(stream.content)
+                    if stream.calories is not None and st.session_state.get("manual_cal") != stream.calories:
+                        st.session_state["manual_cal"] = stream.calories
+                        calories_slot.number_input(
+                            "Calories (optional)", value=stream.calories, disabled=True, key="manual_cal_preview"
+                        )
+                if stream.cached:
+                    st.caption(f"Cached result (saved {stream.latency:.1f}s)")
+                elif stream.first_token_latency is None:
+                    # An empty reply has no first token.
+                    st.caption(f"Complete after {stream.latency:.1f}s")
+                else:
+                    st.caption(f"First token after {stream.first_token_latency:.1f}s, complete after {stream.latency:.1f}s")
                 if manual_desc == "":
-                    manual_desc = content
+                    manual_desc = stream.content
+                st.session_state["analyzed_foods"] = [parse_analysis(stream.content)]
             except Exception as e:
                 st.error(f"Failed to analyze image: {e}")
+        elif food_files:
+            analyzed = []
+            # Photos are analysed in parallel; each result is shown as soon as it arrives.
+            for name, analysis, error in analyze_food_images((f.name, f.getvalue()) for f in food_files):
+                if error is not None:
+                    st.error(f"Failed to analyze {name}: {error}")
+                    continue
+                st.write(f"AI analysis result for {name}:")
+                st.code(analysis.content)
+                if analysis.cached:
+                    st.caption(f"Cached result (saved {analysis.latency:.1f}s)")
+                analyzed.append(parse_analysis(analysis.content))
+                if manual_desc == "":
+                    manual_desc = analysis.content
+            st.session_state["analyzed_foods"] = analyzed
         else:
             st.warning("Please upload an image.")
+    manual_cal = calories_slot.number_input("Calories (optional)", min_value=0.0, step=1.0, key="manual_cal")
     if st.button("Log Food"):
-        insert_food(manual_desc, manual_cal, selected_date.isoformat())
-        st.success("Food entry logged.")
-    st.divider()
+        save_entry("Food entry logged.", insert_food, manual_desc, manual_cal, selected_date.isoformat())
+    analyzed_foods = st.session_state.get("analyzed_foods", [])
+    if analyzed_foods and st.button(f"Log {len(analyzed_foods)} analyzed meal(s)", key="log_analyzed"):
+        rows = [(desc, cals, selected_date.isoformat()) for desc, cals in analyzed_foods]
+        if save_entry(f"Logged {len(analyzed_foods)} food entries.", insert_foods, rows):
+            st.session_state["analyzed_foods"] = []
 
-    # Water Section
+# Water Section
+@st.fragment
+@timed("water_section")
+def water_section(selected_date):
     st.subheader("Water")
     water_vol = st.number_input("Water intake (fl oz)", min_value=0.0, step=1.0, key="water_vol_input")
     if st.button("Log Water"):
-        insert_water(water_vol, selected_date.isoformat())
-        st.success(f"Logged water intake of {water_vol} fl oz on {selected_date}")
+        save_entry(f"Logged water intake of {water_vol} fl oz on {selected_date}",
+                   insert_water, water_vol, selected_date.isoformat())
 
 # Progress Tab
-with tabs[2]:
+@st.fragment
+@timed("progress_dashboard")
+def progress_dashboard(today):
+    # The analytics stack is only needed while the Progress tab is open.
+    import pandas as pd
+
+    from analytics import weight_trend
+    from charts import downsample
+    from goals import GOALS, calendar as goal_calendar
+
     st.header("Progress Overview")
+    progress_range = st.date_input("Date range", value=(today - timedelta(days=90), today), key="progress_range")
+    # While the user is picking the range the widget returns only the start date.
+    range_start, range_end = progress_range if len(progress_range) == 2 else (progress_range[0], today)
     # Weight Chart
-    weights_df = fetch_weights()
+    weights_df = fetch_weights(range_start, range_end)
     if not weights_df.empty:
-        weights_df["date"] = pd.to_datetime(weights_df["date"])
         weights_df = weights_df.sort_values("date")
         chart_df = weights_df.rename(columns={"date": "index"}).set_index("index")["weight"]
+        full_resolution = st.toggle("Full resolution", key="chart_full_resolution")
+        if not full_resolution:
+            chart_df = downsample(chart_df)
         st.line_chart(chart_df)
-        start_w = weights_df.iloc[0]["weight"]
-        current_w = weights_df.iloc[-1]["weight"]
-        st.write(f"Start weight: {start_w} lbs")
-        st.write(f"Current weight: {current_w} lbs")
+        if len(chart_df) < len(weights_df):
+            st.caption(f"Showing {len(chart_df):,} of {len(weights_df):,} points")
+        start_w = weights_df["weight"].iloc[0]
+        current_w = weights_df["weight"].iloc[-1]
+        # Weights are float32; :g keeps 180.4 from printing as 180.39999389648438.
+        st.write(f"Start weight: {start_w:g} lbs")
+        st.write(f"Current weight: {current_w:g} lbs")
         st.write(f"Difference: {current_w - start_w:+.2f} lbs")
+        trend = weight_trend(weights_df["date"], weights_df["weight"], key=(current_database(), range_start))
+        stats = trend.summary()
+        st.write(f"Trend weight: {stats.trend:.1f} lbs (7-day avg {stats.avg7:.1f}, 30-day avg {stats.avg30:.1f})")
+        st.write(f"Weekly change: {stats.weekly_rate:+.2f} lbs/week")
+        if stats.plateau_days:
+            st.info(f"Plateau: your trend has been flat for {stats.plateau_days} days.")
+        goal = st.number_input("Goal weight (lbs)", min_value=0.0, step=0.5, key="goal_weight")
+        if goal:
+            days_left = trend.days_to_goal(goal)
+            if days_left is None:
+                st.write("Not currently trending toward your goal.")
+            else:
+                eta = weights_df["date"].iloc[-1] + timedelta(days=days_left)
+                st.write(f"Projected to reach {goal} lbs around {eta:%B %d, %Y}.")
     else:
-        st.info("No weight entries yet.")
+        st.info("No weight entries in this range.")
 
+    summary = fetch_summary(range_start, range_end)
     # Activity Summary
-    acts = fetch_activities()
-    if not acts.empty:
-        total_minutes = acts["duration"].sum()
+    if summary["activity_count"]:
         st.subheader("Activity Summary")
-        st.write(f"Total activities: {len(acts)}")
-        st.write(f"Total minutes: {total_minutes}")
+        st.write(f"Total activities: {summary['activity_count']}")
+        st.write(f"Total minutes: {summary['activity_minutes']}")
 
     # Food Summary
-    foods = fetch_foods()
-    if not foods.empty:
+    if summary["food_count"]:
         st.subheader("Food Summary")
-        st.write(f"Entries: {len(foods)}")
-        st.write(f"Total calories: {foods['calories'].sum()}")
+        st.write(f"Entries: {summary['food_count']}")
+        st.write(f"Total calories: {summary['food_calories']}")
 
     # Water Summary
-    water_df = fetch_water()
-    if not water_df.empty:
+    if summary["water_count"]:
         st.subheader("Water Summary")
-        st.write(f"Entries: {len(water_df)}")
-        st.write(f"Total volume (fl oz): {water_df['volume'].sum()}")
+        st.write(f"Entries: {summary['water_count']}")
+        st.write(f"Total volume (fl oz): {summary['water_volume']}")
 
     # Fasting Summary
-    fasts = fetch_fastings()
-    if not fasts.empty:
+    if summary["fasting_count"]:
         st.subheader("Fasting Summary")
-        st.write(f"Sessions: {len(fasts)}")
-        st.write(f"Total hours fasted: {fasts['duration'].sum()}")
+        st.write(f"Sessions: {summary['fasting_count']}")
+        st.write(f"Total hours fasted: {summary['fasting_hours']}")
 
     # Exercise Summary
-    exs = fetch_exercises()
-    if not exs.empty:
+    if summary["exercise_count"]:
         st.subheader("Exercise Summary")
-        st.write(f"Sessions: {len(exs)}")
+        st.write(f"Sessions: {summary['exercise_count']}")
         st.write("Routines logged:")
-        st.write(exs["routine"].value_counts())
+        st.write(fetch_routine_counts(range_start, range_end))
+
+    # Daily Goals
+    st.subheader("Daily Goals")
+    with st.expander("Targets (0 turns a goal off)"):
+        targets = {
+            name: st.number_input(label, min_value=0.0, value=default, step=1.0, key=f"goal_{name}")
+            for name, (_, label, default, _) in GOALS.items()
+        }
+    calendar = goal_calendar(today)
+    progress = calendar.progress(targets, range_start, range_end)
+    if progress:
+        st.dataframe(
+            [
+                {
+                    "Goal": GOALS[name][1],
+                    "Target": targets[name],
+                    "Current streak": p.current_streak,
+                    "Longest streak": p.longest_streak,
+                    "Days met": f"{p.days_hit} of {p.days}",
+                    "Hit rate": f"{p.hit_rate:.0%}",
+                }
+                for name, p in progress.items()
+            ],
+            hide_index=True,
+        )
+        weeks, rates = calendar.weekly_adherence(targets, range_start, range_end)
+        if len(weeks) > 1:
+            st.caption("Days each goal was met, per week (%)")
+            st.line_chart(pd.DataFrame({GOALS[name][1]: rate * 100 for name, rate in rates.items()}, index=weeks))
+
+
+# Each section and the dashboard is a fragment, so an interaction inside one
+# reruns only that fragment. Switching tabs reruns the script, which lets the
+# Progress dashboard render (and query) only while its tab is open.
+tabs = st.tabs(["Activity", "Consumption", "Progress"], on_change="rerun", key="active_tab")
+today = date.today()
+selected_date = st.date_input("Select Date", value=today, key="selected_date")
+
+# Activity Tab
+with tabs[0], timer("tab.Activity"):
+    st.header(selected_date.strftime("%A, %B %d"))
+    weight_section(selected_date)
+    st.divider()
+    activity_section(selected_date)
+    st.divider()
+    fasting_section(selected_date)
+    st.divider()
+    exercise_section(selected_date)
+
+# Consumption Tab
+with tabs[1], timer("tab.Consumption"):
+    st.header("Consumption")
+    food_section(selected_date)
+    st.divider()
+    water_section(selected_date)
+
+# Progress Tab
+with tabs[2], timer("tab.Progress"):
+    if tabs[2].open:
+        progress_dashboard(today)
+
+record("script_run", time.perf_counter() - _run_started)
+debug_panel()
@@ -0,0 +1,260 @@
+"""AI food photo analysis with a persistent, content-addressed result cache.
+
+Photos are shrunk by ``image_prep`` first, and responses are stored in their
+own SQLite file keyed by a hash of the prepared image bytes, prompt and model,
+so re-analysing the same photo is instant and free. The model itself is
+reached through a ``vision`` backend, under its timeouts, circuit breaker
+and concurrency limit.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import db
+import vision
+from image_prep import prepare_image
+from timing import record, register_gauges, timed, timer
+
+SYSTEM_PROMPT = ("You are a nutritionist AI analyzing photos of food for a fitness tracking app. "
+                 "Given an image of food, provide a JSON object with the fields: "
+                 "'description': a short description of the food, "
+                 "'calories': your best guess of total calories as a number, "
+                 "and 'confidence': a value between 0 and 1 indicating confidence in the calorie estimate. "
+                 "If the image does not contain food, respond with description '', calories 0, and confidence 0.")
+
+# Threads analysing a batch of photos; the upstream limit is vision.MAX_CONCURRENT.
+MAX_WORKERS = int(os.getenv("LITEWEIGHT_ANALYSIS_WORKERS", "4"))
+
+CACHE_DB = os.getenv("LITEWEIGHT_ANALYSIS_CACHE", "analysis_cache.db")
+CACHE_TTL_SECONDS = int(os.getenv("LITEWEIGHT_ANALYSIS_CACHE_TTL_DAYS", "30")) * 24 * 3600
+CACHE_MAX_ENTRIES = int(os.getenv("LITEWEIGHT_ANALYSIS_CACHE_ENTRIES", "2000"))
+
+CACHE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS analysis_cache(
+        key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        content TEXT NOT NULL,
+        latency REAL NOT NULL,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+# content: the model's reply; cached: served from the cache; latency: seconds
+# the upstream call took (on a hit, the time that was saved).
+Analysis = namedtuple("Analysis", "content cached latency")
+
+log = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0}
+_ready = set()
+_executor = ThreadPoolExecutor(MAX_WORKERS, thread_name_prefix="food-analysis")
+
+
+@contextmanager
+def _cache_connection():
+    with db.connection(CACHE_DB) as conn:
+        if CACHE_DB not in _ready:
+            with conn:
+                conn.execute(CACHE_SCHEMA)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_used ON analysis_cache(last_used_at)")
+            _ready.add(CACHE_DB)
+        yield conn
+
+
+def cache_key(image_bytes, prompt=SYSTEM_PROMPT, model=None):
+    model = model or vision.backend().model
+    digest = hashlib.sha256()
+    for part in (model.encode(), prompt.encode(), image_bytes):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def _cache_get(key):
+    now = time.time()
+    with _cache_connection() as conn:
+        row = conn.execute(
+            "SELECT content, latency FROM analysis_cache WHERE key = ? AND created_at >= ?",
+            (key, now - CACHE_TTL_SECONDS),
+        ).fetchone()
+        if row is not None:
+            with conn:
+                conn.execute("UPDATE analysis_cache SET hits = hits + 1, last_used_at = ? WHERE key = ?", (now, key))
+    return row
+
+
+def _cache_put(key, model, content, latency):
+    now = time.time()
+    with _cache_connection() as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO analysis_cache (key, model, content, latency, created_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, content, latency, now, now),
+        )
+        conn.execute("DELETE FROM analysis_cache WHERE created_at < ?", (now - CACHE_TTL_SECONDS,))
+        conn.execute(
+            "DELETE FROM analysis_cache WHERE key IN "
+            "(SELECT key FROM analysis_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+            (CACHE_MAX_ENTRIES,),
+        )
+
+
+def _record(hit, latency):
+    with _stats_lock:
+        _stats["hits" if hit else "misses"] += 1
+        if hit:
+            _stats["saved_seconds"] += latency
+        lookups = _stats["hits"] + _stats["misses"]
+        log.info(
+            "analysis cache %s (hit rate %.0f%% over %d lookups, %.1fs saved)",
+            "hit" if hit else "miss",
+            100 * _stats["hits"] / lookups,
+            lookups,
+            _stats["saved_seconds"],
+        )
+
+
+def cache_stats():
+    with _stats_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return dict(_stats, hit_rate=_stats["hits"] / lookups if lookups else 0.0)
+
+
+register_gauges("analysis_cache", cache_stats)
+
+
+def _request_analysis(image_bytes, mime="image/jpeg"):
+    backend = vision.backend()
+    with timer("vision.request"):
+        return vision.complete(backend, SYSTEM_PROMPT, image_bytes, mime)
+
+
+@timed("analysis.analyze_food_image")
+def analyze_food_image(image_bytes):
+    """Analyse a food photo, returning an ``Analysis``; repeated photos hit the cache."""
+    image_bytes, mime = prepare_image(image_bytes)
+    key = cache_key(image_bytes)
+    row = _cache_get(key)
+    if row is not None:
+        _record(True, row[1])
+        return Analysis(row[0], True, row[1])
+
+    start = time.perf_counter()
+    content = _request_analysis(image_bytes, mime)
+    latency = time.perf_counter() - start
+    _cache_put(key, vision.backend().model, content, latency)
+    _record(False, latency)
+    return Analysis(content, False, latency)
+
+
+def analyze_food_images(images):
+    """Analyse ``(name, image_bytes)`` pairs concurrently on the shared pool.
+
+    Yields ``(name, analysis, error)`` in completion order, so callers can
+    show each result as soon as it is ready; exactly one of ``analysis`` and
+    ``error`` is set.
+    """
+    futures = {_executor.submit(analyze_food_image, data): name for name, data in images}
+    for future in as_completed(futures):
+        try:
+            yield futures[future], future.result(), None
+        except Exception as e:
+            yield futures[future], None, e
+
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+
+def parse_analysis(content):
+    """Return ``(description, calories)`` from a model reply, best effort.
+
+    Replies are usually a JSON object, sometimes wrapped in a Markdown code
+    fence; anything unparseable is returned as the description with 0 calories.
+    """
+    match = _JSON_OBJECT.search(content or "")
+    try:
+        data = json.loads(match.group(0)) if match else {}
+        return str(data.get("description") or content), float(data.get("calories") or 0)
+    except (ValueError, TypeError, AttributeError):
+        return content, 0.0
+
+
+def _number_field(name):
+    # Only match once the number is terminated, so a half-streamed "41" of
+    # "412" is never reported.
+    return re.compile(r'"%s"\s*:\s*"?(-?\d+(?:\.\d+)?)"?\s*[,}\n]' % name)
+
+
+_CALORIES = _number_field("calories")
+_CONFIDENCE = _number_field("confidence")
+
+
+class AnalysisStream:
+    """Iterate over a food analysis reply as it is generated.
+
+    Iterating yields text deltas. ``content`` holds the text so far, and
+    ``calories``/``confidence`` are filled in as soon as they appear in the
+    partial JSON. After iteration, ``first_token_latency`` and ``latency``
+    hold the time to the first delta and to the full reply. Cached replies
+    arrive as a single delta.
+    """
+
+    def __init__(self, image_bytes):
+        self._image_bytes, self._mime = prepare_image(image_bytes)
+        self.content = ""
+        self.cached = False
+        self.calories = None
+        self.confidence = None
+        self.first_token_latency = None
+        self.latency = None
+
+    def _feed(self, delta):
+        self.content += delta
+        if self.calories is None:
+            match = _CALORIES.search(self.content)
+            self.calories = float(match.group(1)) if match else None
+        if self.confidence is None:
+            match = _CONFIDENCE.search(self.content)
+            self.confidence = float(match.group(1)) if match else None
+
+    def _finish(self):
+        # A reply ending in a bare number has no terminator for the field regex.
+        self._feed("\n")
+        self.content = self.content[:-1]
+
+    def __iter__(self):
+        backend = vision.backend()
+        key = cache_key(self._image_bytes, model=backend.model)
+        row = _cache_get(key)
+        if row is not None:
+            self.cached = True
+            self.first_token_latency = self.latency = row[1]
+            _record(True, row[1])
+            self._feed(row[0])
+            self._finish()
+            yield row[0]
+            return
+
+        start = time.perf_counter()
+        for delta in vision.stream(backend, SYSTEM_PROMPT, self._image_bytes, self._mime):
+            if self.first_token_latency is None:
+                self.first_token_latency = time.perf_counter() - start
+                record("vision.first_token", self.first_token_latency)
+            self._feed(delta)
+            yield delta
+        self.latency = time.perf_counter() - start
+        record("vision.stream", self.latency)
+        self._finish()
+        log.info("streamed analysis: first token %.2fs, complete %.2fs", self.first_token_latency or 0, self.latency)
+        _cache_put(key, backend.model, self.content, self.latency)
+        _record(False, self.latency)
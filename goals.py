@@ -0,0 +1,244 @@
+"""Daily goals for the Progress tab: streaks, hit rates and weekly adherence.
+
+Every calendar day from the first entry to today is a row of a dense matrix
+built from the daily_summary rollup, with a column per rollup column (active
+minutes, water, calories, fasting hours, routines done and the entry
+counts). Checking a goal is one comparison over a column; streaks, hit rates
+and weekly adherence then come from running maxima and cumulative sums of
+the hits, kept per set of goals and extended from the first changed day.
+
+``calendar`` keeps each database's matrix between reruns. After a write it
+re-reads only the last RECENT_DAYS (entries are normally logged for today
+or the day before), and reloads in full if the matrix then doesn't add up to
+the rollup's totals, e.g. after an entry for an older day.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date
+
+import numpy as np
+
+import db
+
+# Days a write re-reads, counting back from today.
+RECENT_DAYS = 31
+
+# goal -> (daily_summary column, label, default daily target, whether the
+# target is a minimum). A maximum only counts on days with entries, so a day
+# nothing was logged doesn't meet a calorie limit.
+GOALS = {
+    "activity": ("activity_minutes", "Active minutes", 30.0, True),
+    "water": ("water_volume", "Water (fl oz)", 64.0, True),
+    "calories": ("food_calories", "Calories (at most)", 2000.0, False),
+    "fasting": ("fasting_hours", "Fasting hours", 16.0, True),
+    "routines": ("exercise_count", "Routines done", 1.0, True),
+}
+
+# Streaks run through the calendar's last day (today), which only adds to
+# the current streak once it's hit; it doesn't break it before then.
+Progress = namedtuple("Progress", "current_streak longest_streak days_hit days hit_rate")
+
+# Sets of targets whose streaks each calendar keeps (sessions with different targets).
+_MAX_GOAL_SETS = 8
+
+_COLUMNS = {column: i for i, column in enumerate(db.SUMMARY_COLUMNS)}
+# daily_summary sum column -> its entry count column
+_COUNTS = {sum_col: count_col for count_col, sum_col, _ in db.ROLLUPS.values()}
+
+
+def _day(value):
+    """Days since 1970-01-01 of a ``date``, ISO string or ``datetime64``."""
+    return int(np.datetime64(value, "D").astype(np.int64))
+
+
+def _checks(targets):
+    """The goals of ``targets`` ({goal: target}) with a target set, in GOALS order."""
+    checks = []
+    for name, (column, _, _, at_least) in GOALS.items():
+        target = targets.get(name)
+        if not target:
+            continue
+        count = _COLUMNS[_COUNTS.get(column, column)]
+        checks.append((name, _COLUMNS[column], float(target), at_least, count))
+    return tuple(checks)
+
+
+def _hits(values, checks):
+    """``(goals, days)`` booleans: whether each goal was met on each row of ``values``."""
+    hits = np.empty((len(checks), len(values)), dtype=bool)
+    for i, (_, column, target, at_least, count) in enumerate(checks):
+        if at_least:
+            np.greater_equal(values[:, column], target, out=hits[i])
+        else:
+            np.logical_and(values[:, column] <= target, values[:, count] > 0, out=hits[i])
+    return hits
+
+
+def _runs(hits, carried):
+    """Length of the run of hits ending on each day, continuing ``carried`` runs into the first."""
+    day = np.arange(1, hits.shape[1] + 1)
+    # 1-based day of the latest miss so far, 0 while there's been none.
+    miss = np.maximum.accumulate(day * ~hits, axis=1)
+    run = day - miss
+    if np.any(carried):
+        run += carried[:, None] * (miss == 0)
+    return run
+
+
+class _Streaks:
+    """Runs, longest runs and cumulative hits of one set of goals, as ``(goals, days)`` arrays."""
+
+    def __init__(self, checks):
+        self.checks = checks
+        width = len(checks)
+        self.run = np.empty((width, 0), dtype=np.int64)
+        self.best = np.empty((width, 0), dtype=np.int64)
+        self.cum = np.zeros((width, 1), dtype=np.int64)  # cum[:, i]: hits on days before i
+        self.valid = 0  # days before this one are up to date
+
+    def update(self, values):
+        lo = self.valid
+        if lo == len(values):
+            return self
+        hits = _hits(values[lo:], self.checks)
+        if not lo:
+            self.run = _runs(hits, 0)
+            self.best = np.maximum.accumulate(self.run, axis=1)
+            self.cum = np.concatenate((self.cum[:, :1], np.cumsum(hits, axis=1)), axis=1)
+        else:
+            run = _runs(hits, self.run[:, lo - 1])
+            best = np.maximum(np.maximum.accumulate(run, axis=1), self.best[:, lo - 1:lo])
+            self.run = np.concatenate((self.run[:, :lo], run), axis=1)
+            self.best = np.concatenate((self.best[:, :lo], best), axis=1)
+            cum = self.cum[:, lo:lo + 1] + np.cumsum(hits, axis=1)
+            self.cum = np.concatenate((self.cum[:, :lo + 1], cum), axis=1)
+        self.valid = len(values)
+        return self
+
+
+class GoalCalendar:
+    """Every daily_summary column per calendar day, and the goal streaks over them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.first = 0  # day number of row 0
+        self.last = -1  # day number of the last daily_summary row read
+        self.values = np.zeros((0, len(db.SUMMARY_COLUMNS)))
+        self.totals = None  # fetch_summary() totals the matrix was last checked against
+        self._streaks = OrderedDict()  # checks -> _Streaks
+
+    def load(self, days, values, today):
+        """Replace everything with ``values`` for ``days`` (ascending day numbers)."""
+        self.first = int(days[0]) if len(days) else today
+        self.values = np.zeros((0, self.values.shape[1]))
+        self._streaks.clear()
+        self.merge(days, values, self.first, today)
+
+    def merge(self, days, values, since, today):
+        """Replace the rows from day ``since`` on with ``values`` for ``days``."""
+        if since < self.first:
+            return self.load(days, values, today)
+        end = max(today, int(days[-1]) if len(days) else today)
+        rows = end - self.first + 1
+        if rows > len(self.values):
+            self.values = np.concatenate((self.values, np.zeros((rows - len(self.values), self.values.shape[1]))))
+        lo = since - self.first
+        self.values[lo:] = 0
+        self.values[days - self.first] = values
+        self.last = int(days[-1]) if len(days) else min(self.last, since - 1)
+        for streaks in self._streaks.values():
+            streaks.valid = min(streaks.valid, lo)
+
+    def _get(self, targets):
+        checks = _checks(targets)
+        streaks = self._streaks.pop(checks, None) or _Streaks(checks)
+        self._streaks[checks] = streaks.update(self.values)
+        while len(self._streaks) > _MAX_GOAL_SETS:
+            self._streaks.popitem(last=False)
+        return streaks
+
+    def _bounds(self, start, end):
+        """Rows of [start, end] within the calendar, as a half-open ``(lo, hi)``."""
+        lo = min(max(_day(start), self.first) - self.first, len(self.values))
+        hi = min(_day(end), self.first + len(self.values) - 1) - self.first + 1
+        return lo, max(lo, hi)
+
+    def progress(self, targets, start, end):
+        """``{goal: Progress}`` of the goals with a target in ``targets``.
+
+        Hit rates are over the days of [start, end] from the first entry on.
+        """
+        with self.lock:
+            if not len(self.values):
+                return {}
+            streaks = self._get(targets)
+            run = streaks.run
+            current = run[:, -1] if run.shape[1] == 1 else np.where(run[:, -1] > 0, run[:, -1], run[:, -2])
+            lo, hi = self._bounds(start, end)
+            hit = streaks.cum[:, hi] - streaks.cum[:, lo]
+            return {
+                name: Progress(int(current[i]), int(streaks.best[i, -1]), int(hit[i]), hi - lo,
+                               float(hit[i] / (hi - lo)) if hi > lo else 0.0)
+                for i, (name, *_) in enumerate(streaks.checks)
+            }
+
+    def weekly_adherence(self, targets, start, end):
+        """``(weeks, {goal: share of days hit})`` per Monday-to-Sunday week of [start, end].
+
+        ``weeks`` are the Mondays, as ``datetime64[D]``; partial weeks at
+        either end count only their days within the range.
+        """
+        with self.lock:
+            streaks = self._get(targets)
+            lo, hi = self._bounds(start, end)
+            if hi == lo:
+                return np.empty(0, dtype="datetime64[D]"), {name: np.empty(0) for name, *_ in streaks.checks}
+            first = self.first + lo
+            # 1970-01-01 was a Thursday.
+            mondays = np.arange(first - (first + 3) % 7, self.first + hi, 7)
+            bounds = np.clip(np.append(mondays - self.first, hi), lo, hi)
+            rates = np.diff(streaks.cum[:, bounds], axis=1) / np.diff(bounds)
+            weeks = mondays.astype("datetime64[D]")
+            return weeks, {name: rates[i] for i, (name, *_) in enumerate(streaks.checks)}
+
+
+def _rows(daily):
+    dates, values = daily
+    return dates.astype(np.int64), values
+
+
+def _sync(calendar, today):
+    totals = db.fetch_summary()
+    totals = np.array([totals[column] for column in db.SUMMARY_COLUMNS], dtype=np.float64)
+    if calendar.totals is not None and np.array_equal(totals, calendar.totals):
+        end = calendar.first + len(calendar.values) - 1
+        if today > end:  # a new day: append it, empty
+            calendar.merge(np.empty(0, dtype=np.int64), np.empty((0, len(totals))), end + 1, today)
+        return
+    if calendar.last >= 0:
+        since = max(calendar.first, min(calendar.last, today - RECENT_DAYS + 1))
+        calendar.merge(*_rows(db.fetch_daily(np.datetime64(since, "D").item())), since, today)
+        # Only summation order differs; a missed entry is never within 1e-9.
+        if np.allclose(calendar.values.sum(axis=0), totals, rtol=1e-9, atol=1e-6):
+            calendar.totals = totals
+            return
+    calendar.load(*_rows(db.fetch_daily()), today)
+    calendar.totals = totals
+
+
+_calendars = OrderedDict()
+_calendars_lock = threading.Lock()
+_MAX_CALENDARS = 64
+
+
+def calendar(today=None):
+    """The current database's ``GoalCalendar``, brought up to date through ``today``."""
+    path = db.current_database()
+    with _calendars_lock:
+        cal = _calendars.pop(path, None) or GoalCalendar()
+        _calendars[path] = cal
+        while len(_calendars) > _MAX_CALENDARS:
+            _calendars.popitem(last=False)
+    with cal.lock:
+        _sync(cal, _day(today or date.today()))
+    return cal
@@ -0,0 +1,61 @@
+"""Shrink uploaded food photos before they are sent to the vision model.
+
+Phone photos are often several megabytes; the model does not need more than
+about a thousand pixels on the long edge, so we orient, downscale and
+re-encode them as JPEG first.
+"""
+import io
+import os
+
+from PIL import Image, ImageOps
+
+from timing import timed
+
+MAX_EDGE = int(os.getenv("LITEWEIGHT_IMAGE_MAX_EDGE", "1024"))
+JPEG_QUALITY = int(os.getenv("LITEWEIGHT_IMAGE_QUALITY", "85"))
+
+_MAGIC = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+)
+
+
+def sniff_mime(image_bytes):
+    head = bytes(image_bytes[:8])
+    for magic, mime in _MAGIC:
+        if head.startswith(magic):
+            return mime
+    return "image/jpeg"
+
+
+@timed("analysis.prepare_image")
+def prepare_image(image_bytes, max_edge=MAX_EDGE, quality=JPEG_QUALITY):
+    """Return ``(data, mime)`` ready for a ``data:`` URL.
+
+    ``data`` is a bytes-like object (a view over the encoder's buffer, so the
+    JPEG is not copied again). Images Pillow cannot read are passed through
+    unchanged with their sniffed MIME type.
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        orientation = img.getexif().get(0x0112, 1)
+        if img.format == "JPEG" and orientation == 1 and max(img.size) <= max_edge:
+            # Already small and upright: re-encoding would only lose quality.
+            return image_bytes, "image/jpeg"
+        # JPEG can decode straight to a reduced scale, far cheaper than a full
+        # decode followed by a resize.
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if img.mode != "RGB":
+            # Flatten transparency onto white; JPEG has no alpha channel.
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", img.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+        return out.getbuffer(), "image/jpeg"
+    except (OSError, ValueError):
+        return image_bytes, sniff_mime(image_bytes)
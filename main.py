@@ -1,110 +1,24 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import openai
-import os
-import base64
-import sqlite3
-from datetime import datetime
-
-# Initialize OpenAI API key from environment variable
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-# Database initialization
-DB_NAME = "liteweight.db"
-
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS weights(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            weight REAL NOT NULL,
-            date TEXT NOT NULL
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS activities(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT NOT NULL,
-            duration REAL NOT NULL,
-            date TEXT NOT NULL
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS foods(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            description TEXT,
-            calories REAL,
-            date TEXT NOT NULL
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS water(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            volume REAL NOT NULL,
-            date TEXT NOT NULL
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-# call init_db
+import time
+from datetime import datetime, timedelta
+
+from db import (
+    current_database, init_db, insert_weight, insert_activity, insert_food, insert_foods, insert_water, fetch_weights,
+    fetch_summary, search_foods, wait_for_write,
+)
+from debug_panel import debug_panel
+import maintenance
+from timing import begin_run, record, start_exporter, timed, timer
+from users import select_database
+
+_run_started = time.perf_counter()
+begin_run()
+start_exporter()
+select_database()
+# Migrates the schema on the first run per database in this process; free afterwards.
 init_db()
-
-# Insert functions
-def insert_weight(weight: float, date: str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO weights (weight, date) VALUES (?, ?)", (weight, date))
-    conn.commit()
-    conn.close()
-
-def insert_activity(activity_type: str, duration: float, date: str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO activities (type, duration, date) VALUES (?, ?, ?)", (activity_type, duration, date))
-    conn.commit()
-    conn.close()
-
-def insert_food(description: str, calories: float, date: str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO foods (description, calories, date) VALUES (?, ?, ?)", (description, calories, date))
-    conn.commit()
-    conn.close()
-
-def insert_water(volume: float, date: str):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("INSERT INTO water (volume, date) VALUES (?, ?)", (volume, date))
-    conn.commit()
-    conn.close()
-
-# Fetch functions
-def fetch_weights():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT weight, date FROM weights ORDER BY date ASC", conn)
-    conn.close()
-    return df
-
-def fetch_activities():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT type, duration, date FROM activities", conn)
-    conn.close()
-    return df
-
-def fetch_foods():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT description, calories, date FROM foods", conn)
-    conn.close()
-    return df
-
-def fetch_water():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT volume, date FROM water", conn)
-    conn.close()
-    return df
+# Vacuum, ANALYZE and retention, in the background once a day per database.
+maintenance.schedule()
 
 # Streamlit UI
 st.set_page_config(page_title="LiteWeight Streamlit", page_icon="🏋️", layout="centered")
@@ -112,109 +26,217 @@ st.set_page_config(page_title="LiteWeight Streamlit", page_icon="🏋️", layou
 st.title("LiteWeight – Streamlit Edition")
 st.markdown("Log your health metrics and monitor your progress over time.")
 
-tabs = st.tabs(["Weight Entry", "Activity Entry", "Food & Water", "Progress"])
+# Saving entries
+def save_entry(message, insert, *args):
+    """Run ``insert(*args)`` and show ``message`` once it is committed, or the error."""
+    try:
+        # In write-behind mode the insert only queues the rows.
+        wait_for_write(insert(*args))
+    except Exception as e:
+        st.error(f"Could not save the entry: {e or type(e).__name__}")
+        return False
+    st.success(message)
+    return True
 
 # Weight Entry
-with tabs[0]:
+@st.fragment
+@timed("weight_form")
+def weight_form():
     st.header("Log Weight")
     weight = st.number_input("Weight (lbs)", min_value=0.0, step=0.1)
     weight_date = st.date_input("Date", value=datetime.today())
     if st.button("Add Weight Entry"):
-        insert_weight(weight, weight_date.isoformat())
-        st.success(f"Logged {weight} lbs on {weight_date}.")
+        save_entry(f"Logged {weight} lbs on {weight_date}.", insert_weight, weight, weight_date.isoformat())
 
 # Activity Entry
-with tabs[1]:
+@st.fragment
+@timed("activity_form")
+def activity_form():
     st.header("Log Activity")
     activity_type = st.selectbox("Activity Type", ["Walk", "Run", "Bike", "Swim", "Workout"])
     duration = st.number_input("Duration (minutes)", min_value=0.0, step=1.0)
     activity_date = st.date_input("Date", value=datetime.today(), key="activity")
     if st.button("Add Activity Entry"):
-        insert_activity(activity_type, duration, activity_date.isoformat())
-        st.success(f"Logged {activity_type} for {duration} minutes on {activity_date}.")
+        save_entry(f"Logged {activity_type} for {duration} minutes on {activity_date}.",
+                   insert_activity, activity_type, duration, activity_date.isoformat())
+
+# Food Entry
+def use_past_meal(description_key, calories_key):
+    """Fill the food inputs from the suggestion just picked."""
+    meal = st.session_state["past_meal"]
+    if meal is not None:
+        st.session_state[description_key] = meal.description
+        if meal.calories is not None:
+            st.session_state[calories_key] = meal.calories
+    st.session_state["past_meal"] = None
 
-# Food & Water
-with tabs[2]:
+
+def meal_label(meal):
+    return meal.description if meal.calories is None else f"{meal.description} ({meal.calories:.0f} kcal)"
+
+
+@st.fragment
+@timed("food_form")
+def food_form():
     st.header("Food Analysis & Log")
-    uploaded_file = st.file_uploader("Upload food photo", type=["png", "jpg", "jpeg"])
-    manual_description = st.text_input("Food description (optional)")
-    manual_calories = st.number_input("Calories (optional)", min_value=0.0, step=1.0)
+    uploaded_files = st.file_uploader("Upload food photos", type=["png", "jpg", "jpeg"], accept_multiple_files=True)
+    manual_description = st.text_input("Food description (optional)", key="manual_description", live=True)
+    # Past meals matching what has been typed so far; picking one also fills in its calories.
+    typed = manual_description.strip()
+    matches = [m for m in search_foods(typed) if m.description.lower() != typed.lower()] if len(typed) >= 2 else []
+    if matches:
+        st.pills(
+            "Past meals", matches, format_func=meal_label, key="past_meal",
+            on_change=use_past_meal, args=("manual_description", "manual_calories"),
+        )
+    # Filled in below, after a streamed analysis has had a chance to prefill it.
+    calories_slot = st.empty()
     food_date = st.date_input("Date", value=datetime.today(), key="fooddate")
     if st.button("Analyze Photo"):
-        if uploaded_file:
-            image_bytes = uploaded_file.read()
-            base64_image = base64.b64encode(image_bytes).decode("utf-8")
-            system_prompt = ("You are a nutritionist AI analyzing photos of food for a fitness tracking app. "
-                             "Given an image of food, provide a JSON object with the fields: "
-                             "'description': a short description of the food, "
-                             "'calories': your best guess of total calories as a number, "
-                             "and 'confidence': a value between 0 and 1 indicating confidence in the calorie estimate. "
-                             "If the image does not contain food, respond with description '', calories 0, and confidence 0.")
+        # Loads the OpenAI client and Pillow, so only once a photo is analysed.
+        from food_analysis import AnalysisStream, analyze_food_images, parse_analysis
+
+        if uploaded_files and len(uploaded_files) == 1:
+            # A single photo is streamed so the reply (and calories) show up as they are generated.
             try:
-                response = openai.ChatCompletion.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": [ {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"} } ] }
-                    ],
-                    max_tokens=400,
-                )
-                content = response["choices"][0]["message"]["content"]
+                # Inside the try: decoding the photo (Pillow) can fail as well.
+                stream = AnalysisStream(uploaded_files[0].getvalue())
                 st.write("AI analysis result:")
-                st.code(content)
-                manual_description = manual_description or content
+                result_box = st.empty()
+                for _ in stream:
+                    result_box.code(stream.content)
+                    if stream.calories is not None and st.session_state.get("manual_calories") != stream.calories:
+                        st.session_state["manual_calories"] = stream.calories
+                        calories_slot.number_input(
+                            "Calories (optional)", value=stream.calories, disabled=True, key="manual_calories_preview"
+                        )
+                if stream.cached:
+                    st.caption(f"Cached result (saved {stream.latency:.1f}s)")
+                elif stream.first_token_latency is None:
+                    # An empty reply has no first token.
+                    st.caption(f"Complete after {stream.latency:.1f}s")
+                else:
+                    st.caption(f"First token after {stream.first_token_latency:.1f}s, complete after {stream.latency:.1f}s")
+                manual_description = manual_description or stream.content
+                st.session_state["analyzed_foods"] = [parse_analysis(stream.content)]
             except Exception as e:
                 st.error(f"Failed to analyze image: {e}")
+        elif uploaded_files:
+            analyzed = []
+            # Photos are analysed in parallel; each result is shown as soon as it arrives.
+            for name, analysis, error in analyze_food_images((f.name, f.getvalue()) for f in uploaded_files):
+                if error is not None:
+                    st.error(f"Failed to analyze {name}: {error}")
+                    continue
+                st.write(f"AI analysis result for {name}:")
+                st.code(analysis.content)
+                if analysis.cached:
+                    st.caption(f"Cached result (saved {analysis.latency:.1f}s)")
+                analyzed.append(parse_analysis(analysis.content))
+                manual_description = manual_description or analysis.content
+            st.session_state["analyzed_foods"] = analyzed
         else:
             st.warning("Please upload an image for analysis.")
+    manual_calories = calories_slot.number_input("Calories (optional)", min_value=0.0, step=1.0, key="manual_calories")
     if st.button("Log Food"):
         desc = manual_description
         cals = manual_calories
-        insert_food(desc, cals, food_date.isoformat())
-        st.success("Food entry logged.")
-
+        save_entry("Food entry logged.", insert_food, desc, cals, food_date.isoformat())
+    analyzed_foods = st.session_state.get("analyzed_foods", [])
+    if analyzed_foods and st.button(f"Log {len(analyzed_foods)} analyzed meal(s)", key="log_analyzed"):
+        rows = [(desc, cals, food_date.isoformat()) for desc, cals in analyzed_foods]
+        if save_entry(f"Logged {len(analyzed_foods)} food entries.", insert_foods, rows):
+            st.session_state["analyzed_foods"] = []
+
+# Water Entry
+@st.fragment
+@timed("water_form")
+def water_form():
     st.header("Log Water")
     water_volume = st.number_input("Water intake (fl oz)", min_value=0.0, step=1.0)
     water_date = st.date_input("Date", value=datetime.today(), key="waterdate")
     if st.button("Add Water Entry"):
-        insert_water(water_volume, water_date.isoformat())
-        st.success(f"Logged {water_volume} fl oz on {water_date}.")
+        save_entry(f"Logged {water_volume} fl oz on {water_date}.", insert_water, water_volume, water_date.isoformat())
 
 # Progress Tab
-with tabs[3]:
+@st.fragment
+@timed("progress_dashboard")
+def progress_dashboard():
+    # The analytics stack is only needed while the Progress tab is open.
+    from analytics import weight_trend
+    from charts import downsample
+
     st.header("Progress")
-    weights_df = fetch_weights()
+    today = datetime.today().date()
+    progress_range = st.date_input("Date range", value=(today - timedelta(days=90), today), key="progress_range")
+    # While the user is picking the range the widget returns only the start date.
+    range_start, range_end = progress_range if len(progress_range) == 2 else (progress_range[0], today)
+    weights_df = fetch_weights(range_start, range_end)
     if not weights_df.empty:
-        weights_df["date"] = pd.to_datetime(weights_df["date"])
         weights_df = weights_df.sort_values("date")
         # For line chart, set date as index
         chart_df = weights_df.rename(columns={"date": "index"}).set_index("index")["weight"]
+        full_resolution = st.toggle("Full resolution", key="chart_full_resolution")
+        if not full_resolution:
+            chart_df = downsample(chart_df)
         st.line_chart(chart_df)
-        start_weight = weights_df.iloc[0]["weight"]
-        current_weight = weights_df.iloc[-1]["weight"]
-        st.write(f"Start weight: {start_weight} lbs")
-        st.write(f"Current weight: {current_weight} lbs")
+        if len(chart_df) < len(weights_df):
+            st.caption(f"Showing {len(chart_df):,} of {len(weights_df):,} points")
+        start_weight = weights_df["weight"].iloc[0]
+        current_weight = weights_df["weight"].iloc[-1]
+        # Weights are float32; :g keeps 180.4 from printing as 180.39999389648438.
+        st.write(f"Start weight: {start_weight:g} lbs")
+        st.write(f"Current weight: {current_weight:g} lbs")
         st.write(f"Difference: {current_weight - start_weight:+.2f} lbs")
+        trend = weight_trend(weights_df["date"], weights_df["weight"], key=(current_database(), range_start))
+        stats = trend.summary()
+        st.write(f"Trend weight: {stats.trend:.1f} lbs (7-day avg {stats.avg7:.1f}, 30-day avg {stats.avg30:.1f})")
+        st.write(f"Weekly change: {stats.weekly_rate:+.2f} lbs/week")
+        if stats.plateau_days:
+            st.info(f"Plateau: your trend has been flat for {stats.plateau_days} days.")
+        goal = st.number_input("Goal weight (lbs)", min_value=0.0, step=0.5, key="goal_weight")
+        if goal:
+            days_left = trend.days_to_goal(goal)
+            if days_left is None:
+                st.write("Not currently trending toward your goal.")
+            else:
+                eta = weights_df["date"].iloc[-1] + timedelta(days=days_left)
+                st.write(f"Projected to reach {goal} lbs around {eta:%B %d, %Y}.")
     else:
-        st.info("No weight entries found. Add some in the Weight tab.")
+        st.info("No weight entries found in this range. Add some in the Weight tab.")
 
+    summary = fetch_summary(range_start, range_end)
     # Activities summary
-    acts_df = fetch_activities()
-    if not acts_df.empty:
-        total_minutes = acts_df["duration"].sum()
+    if summary["activity_count"]:
         st.subheader("Activity Summary")
-        st.write(f"Total activities logged: {len(acts_df)}")
-        st.write(f"Total minutes: {total_minutes}")
+        st.write(f"Total activities logged: {summary['activity_count']}")
+        st.write(f"Total minutes: {summary['activity_minutes']}")
     # Food summary
-    foods_df = fetch_foods()
-    if not foods_df.empty:
+    if summary["food_count"]:
         st.subheader("Food Summary")
-        st.write(f"Total food entries: {len(foods_df)}")
-        total_calories = foods_df["calories"].sum()
-        st.write(f"Total calories: {total_calories}")
+        st.write(f"Total food entries: {summary['food_count']}")
+        st.write(f"Total calories: {summary['food_calories']}")
     # Water summary
-    water_df = fetch_water()
-    if not water_df.empty:
+    if summary["water_count"]:
         st.subheader("Water Summary")
-        st.write(f"Total water entries: {len(water_df)}")
-        st.write(f"Total volume (fl oz): {water_df['volume'].sum()}")
+        st.write(f"Total water entries: {summary['water_count']}")
+        st.write(f"Total volume (fl oz): {summary['water_volume']}")
+
+
+# Each form and the dashboard is a fragment, so an interaction inside one
+# reruns only that fragment. Switching tabs reruns the script, which lets the
+# Progress dashboard render (and query) only while its tab is open.
+tabs = st.tabs(["Weight Entry", "Activity Entry", "Food & Water", "Progress"], on_change="rerun", key="active_tab")
+with tabs[0], timer("tab.Weight Entry"):
+    weight_form()
+with tabs[1], timer("tab.Activity Entry"):
+    activity_form()
+with tabs[2], timer("tab.Food & Water"):
+    food_form()
+    water_form()
+with tabs[3], timer("tab.Progress"):
+    if tabs[3].open:
+        progress_dashboard()
+
+record("script_run", time.perf_counter() - _run_started)
+debug_panel()
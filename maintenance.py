@@ -0,0 +1,286 @@
+"""Routine upkeep of a LiteWeight database.
+
+``run`` applies retention policies to old entries, returns free pages to the
+file system (incremental auto-vacuum), refreshes the query planner's
+statistics (ANALYZE) and checkpoints the WAL, and reports the database's size
+and any query plans that changed. ``python db.py maintain`` runs it from the
+command line; the apps call ``schedule``, which runs a lighter pass in the
+background at most every ``LITEWEIGHT_MAINTENANCE_HOURS`` per database.
+
+Retention is off unless ``LITEWEIGHT_RETENTION`` lists ``table=policy:days``
+pairs, e.g. ``foods=trim:90,weights=daily:365,fastings=delete:1825``.
+Entries older than ``days`` are:
+
+- ``delete``: removed;
+- ``daily``: merged into one entry per day (per activity type) holding the
+  day's mean weight, or its total water, activity or fasting time;
+- ``trim`` (foods): descriptions that are a whole analysis reply are cut
+  down to the meal's short description, at most DESCRIPTION_CHARS long.
+
+Only live rows are changed, a month at a time, with the rollups of those days
+recomputed in the same transaction. Archived history (archive.py) is left
+as it is: it's no longer in SQLite, and the rollups of archived days can't be
+recomputed from live rows.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+import db
+from timing import timer
+
+INTERVAL_HOURS = float(os.getenv("LITEWEIGHT_MAINTENANCE_HOURS", "24"))
+DESCRIPTION_CHARS = 120
+# ANALYZE samples about this many rows per index, so it stays quick on large tables.
+ANALYSIS_LIMIT = 1000
+# bulk.import_file refreshes the statistics after importing at least this many rows.
+ANALYZE_AFTER_ROWS = 10_000
+# Most pages a background run frees, keeping its hold on the write lock short.
+BACKGROUND_VACUUM_PAGES = 10_000
+
+POLICIES = ("delete", "daily", "trim")
+# What "daily" keeps of each day's entries.
+DAILY = {
+    "weights": "AVG(weight)",
+    "activities": "TOTAL(duration)",
+    "water": "TOTAL(volume)",
+    "fastings": "TOTAL(duration)",
+}
+
+Size = namedtuple("Size", "file_bytes wal_bytes pages free_pages")
+# changed: {table: rows deleted or rewritten}; plans: {query: (before, after)}
+# for the query plans that changed.
+Report = namedtuple("Report", "path before after changed freed_pages converted plans seconds")
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_last_run = {}  # database path -> time.monotonic() it was last scheduled
+_queue = queue.Queue()
+_worker = None
+
+
+def parse_retention(spec):
+    """``{table: (policy, days)}`` from ``"table=policy:days,..."``."""
+    policies = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            table, rule = item.split("=")
+            policy, days = rule.split(":")
+            days = int(days)
+        except ValueError:
+            raise ValueError(f"Bad retention policy {item!r}; expected table=policy:days") from None
+        if table not in db.TABLES:
+            raise ValueError(f"Unknown table {table!r} in retention policy {item!r}")
+        if policy not in POLICIES or (policy == "daily" and table not in DAILY) or (policy == "trim" and table != "foods"):
+            raise ValueError(f"Retention policy {policy!r} doesn't apply to {table}")
+        policies[table] = (policy, days)
+    return policies
+
+
+RETENTION = parse_retention(os.getenv("LITEWEIGHT_RETENTION", ""))
+
+
+def short_description(text):
+    """``text`` without the rest of an analysis reply, at most DESCRIPTION_CHARS long."""
+    if text is None:
+        return None
+    if "{" in text:
+        from food_analysis import parse_analysis
+
+        text = parse_analysis(text)[0]
+    return text[:DESCRIPTION_CHARS]
+
+
+def size(conn, path):
+    pages, free = (conn.execute(f"PRAGMA {name}").fetchone()[0] for name in ("page_count", "freelist_count"))
+    wal = f"{path}-wal"
+    return Size(os.path.getsize(path), os.path.getsize(wal) if os.path.exists(wal) else 0, pages, free)
+
+
+def _queries(since):
+    """The apps' main reads, as ``{name: (sql, params)}``."""
+    queries = {f"fetch_{table}": db._select(table, since, None, None) for table in db.TABLES}
+    queries["fetch_summary"] = db._summary_select(["weight_sum"], since, None)
+    queries["fetch_routine_counts"] = db._routines_select(since, None)
+    queries["search_foods"] = (db.SEARCH_SQL, ('"ch"*', db.RECENCY_DAYS, 8))
+    return queries
+
+
+def query_plans(conn):
+    """``{name: [plan steps]}`` of the apps' main reads, over the last 90 days."""
+    since = (date.today() - timedelta(days=90)).isoformat()
+    return {
+        name: [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        for name, (sql, params) in _queries(since).items()
+    }
+
+
+def _next_month(month):
+    year, number = map(int, month.split("-"))
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+
+def _apply(conn, table, policy, lo, hi):
+    """Apply ``policy`` to ``table`` rows dated in [lo, hi); returns the rows changed."""
+    if policy == "delete":
+        return conn.execute(f"DELETE FROM {table} WHERE date >= ? AND date < ?", (lo, hi)).rowcount
+    if policy == "trim":
+        return conn.execute(
+            "UPDATE foods SET description = liteweight_short_description(description) "
+            "WHERE date >= ? AND date < ? AND description != liteweight_short_description(description)",
+            (lo, hi),
+        ).rowcount
+    value = db.ROLLUPS[table][2]
+    keys = ", ".join(column for column in db.COLUMNS[table] if column != value)
+    merged = conn.execute(
+        f"SELECT MIN(id), {DAILY[table]} FROM {table} WHERE date >= ? AND date < ? "
+        f"GROUP BY {keys} HAVING COUNT(*) > 1",
+        (lo, hi),
+    ).fetchall()
+    conn.executemany(f"UPDATE {table} SET {value} = ? WHERE id = ?", [(amount, id_) for id_, amount in merged])
+    return conn.execute(
+        f"DELETE FROM {table} WHERE date >= ? AND date < ? AND id NOT IN "
+        f"(SELECT MIN(id) FROM {table} WHERE date >= ? AND date < ? GROUP BY {keys})",
+        (lo, hi, lo, hi),
+    ).rowcount
+
+
+def apply_retention(conn, path, policies):
+    """Apply ``{table: (policy, days)}`` to live rows; returns ``{table: rows changed}``."""
+    conn.create_function("liteweight_short_description", 1, short_description, deterministic=True)
+    floor = conn.execute("SELECT COALESCE(MAX(through), '') FROM archive_manifest").fetchone()[0]
+    changed = {}
+    for table, (policy, days) in policies.items():
+        cutoff = (date.today() - timedelta(days=days)).isoformat()
+        months = conn.execute(
+            f"SELECT DISTINCT substr(date, 1, 7) FROM {table} WHERE date >= ? AND date < ?", (floor, cutoff)
+        ).fetchall()
+        for (month,) in months:
+            lo, hi = max(floor, f"{month}-01"), min(cutoff, f"{_next_month(month)}-01")
+            # A month per transaction, so the apps' writes never wait long.
+            conn.execute("BEGIN IMMEDIATE")
+            with conn:
+                count = _apply(conn, table, policy, lo, hi)
+                if count and policy != "trim":
+                    db._rebuild_summary(conn, lo, hi)
+            if count:
+                changed[table] = changed.get(table, 0) + count
+                db.invalidate(path, *db._tables_touched(table))
+    if changed.get("foods"):
+        conn.execute("BEGIN IMMEDIATE")
+        with conn:
+            db._rebuild_food_history(conn, archived=db._archived(conn, "foods"))
+    return changed
+
+
+def vacuum(conn, pages=None, convert=False):
+    """Free up to ``pages`` (default all) free pages; returns ``(pages freed, converted)``.
+
+    A database created before incremental auto-vacuum is only converted,
+    with one full VACUUM that rewrites the file, if ``convert`` is set.
+    """
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # INCREMENTAL
+        if not convert:
+            return 0, False
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return free, True
+    # executescript steps the pragma to completion; execute frees one page.
+    conn.executescript(f"PRAGMA incremental_vacuum({pages or 0})")
+    return free - conn.execute("PRAGMA freelist_count").fetchone()[0], False
+
+
+def analyze(conn=None):
+    """Refresh the query planner's statistics for the current database."""
+    if conn is None:
+        with db.connection() as conn:
+            return analyze(conn)
+    conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+    conn.execute("ANALYZE")
+
+
+def run(policies=None, full=True):
+    """Maintain the current database; returns a ``Report``.
+
+    ``policies`` defaults to RETENTION. ``full`` (the command line) also
+    converts the database to incremental auto-vacuum if needed, frees every
+    free page and truncates the WAL; without it at most
+    BACKGROUND_VACUUM_PAGES are freed and the checkpoint never waits on readers.
+    """
+    db.init_db()
+    db.flush_writes()
+    path = db.current_database()
+    start = time.perf_counter()
+    with db.connection(path) as conn, timer("maintenance.run"):
+        before = size(conn, path)
+        plans = query_plans(conn)
+        changed = apply_retention(conn, path, RETENTION if policies is None else policies)
+        freed, converted = vacuum(conn, None if full else BACKGROUND_VACUUM_PAGES, convert=full)
+        analyze(conn)
+        conn.execute(f"PRAGMA wal_checkpoint({'TRUNCATE' if full else 'PASSIVE'})").fetchone()
+        after = size(conn, path)
+        new_plans = query_plans(conn)
+    changed_plans = {name: (plans[name], new_plans[name]) for name in plans if plans[name] != new_plans[name]}
+    return Report(path, before, after, changed, freed, converted, changed_plans, time.perf_counter() - start)
+
+
+def _work():
+    while True:
+        path = _queue.get()
+        db.use_database(path)
+        try:
+            report = run(full=False)
+        except Exception:
+            log.exception("maintenance of %s failed", path)
+            continue
+        log.info(
+            "maintained %s in %.1fs: %.1f MB -> %.1f MB, %d page(s) freed, retention %s",
+            path, report.seconds, report.before.file_bytes / 1e6, report.after.file_bytes / 1e6,
+            report.freed_pages, report.changed or "off",
+        )
+
+
+def schedule():
+    """Maintain the current database in the background if it's due; cheap enough for every rerun.
+
+    Runs one database at a time, at most every INTERVAL_HOURS each; never
+    with LITEWEIGHT_MAINTENANCE_HOURS=0.
+    """
+    global _worker
+    if INTERVAL_HOURS <= 0:
+        return
+    path = db.current_database()
+    now = time.monotonic()
+    with _lock:
+        last = _last_run.get(path)
+        if last is not None and now - last < INTERVAL_HOURS * 3600:
+            return
+        _last_run[path] = now
+        if _worker is None:
+            _worker = threading.Thread(target=_work, name="maintenance", daemon=True)
+            _worker.start()
+    _queue.put(path)
+
+
+def print_report(report):
+    mb = 1024 * 1024
+    before, after = report.before, report.after
+    print(f"Maintained {report.path} in {report.seconds:.1f}s")
+    print(f"  file      {before.file_bytes / mb:8.1f} MB -> {after.file_bytes / mb:8.1f} MB")
+    print(f"  WAL       {before.wal_bytes / mb:8.1f} MB -> {after.wal_bytes / mb:8.1f} MB")
+    print(f"  free      {before.free_pages:8,} pages -> {after.free_pages:,} pages, {report.freed_pages:,} freed"
+          + (" (converted to incremental auto-vacuum)" if report.converted else ""))
+    for table, rows in sorted(report.changed.items()):
+        print(f"  retention {table:<11} {rows:,} row(s) changed")
+    if not report.plans:
+        print("  query plans unchanged")
+    for name, (old, new) in sorted(report.plans.items()):
+        print(f"  plan of {name} changed")
+        print("\n".join(f"    before: {step}" for step in old))
+        print("\n".join(f"    after:  {step}" for step in new))
@@ -0,0 +1,85 @@
+import math
+import os
+import sys
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+HISTORY_DAYS = 400
+# A meal description as stored from a photo analysis reply.
+REPLY = '{"description": "Oatmeal with berries", "calories": 350, "confidence": 0.8}'
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A fresh, migrated database that this thread's db calls use."""
+    path = str(tmp_path / "liteweight.db")
+    db.use_database(path)
+    db.init_db()
+    yield path
+    db.use_database(None)
+    db.close_all()
+
+
+@pytest.fixture
+def history(database):
+    """A few entries a day in every table for the last HISTORY_DAYS days."""
+    days = [(date.today() - timedelta(days=i)).isoformat() for i in range(HISTORY_DAYS)]
+    db.insert_many("weights", [(180.0 - i / 100 + extra, day) for i, day in enumerate(days) for extra in (0.0, 0.6)])
+    db.insert_many("activities", [(kind, minutes, day) for day in days for kind, minutes in
+                                  (("Walk", 20.0), ("Walk", 10.0), ("Run", 15.0))])
+    db.insert_many("foods", [(description, calories, day) for day in days for description, calories in
+                             ((REPLY, 350.0), ("Banana", 100.0), (None, None))])
+    db.insert_many("water", [(volume, day) for day in days for volume in (8.0, 16.0)])
+    db.insert_many("fastings", [(16.0, day) for day in days])
+    db.insert_many("exercises", [(routine, day) for i, day in enumerate(days) for routine in
+                                 (("Cardio", "Upper Body") if i % 2 else ("Cardio",))])
+    return database
+
+
+def _rollups():
+    with db.connection() as conn:
+        summary = {
+            day: dict(zip(db.SUMMARY_COLUMNS, values))
+            for day, *values in conn.execute(f"SELECT date, {', '.join(db.SUMMARY_COLUMNS)} FROM daily_summary")
+        }
+        routines = dict(((day, routine), count) for day, routine, count in conn.execute(
+            "SELECT date, routine, count FROM daily_routines"
+        ))
+    return summary, routines
+
+
+def _expected_rollups():
+    """daily_summary and daily_routines as computed from every entry, archived or live."""
+    summary = defaultdict(lambda: dict.fromkeys(db.SUMMARY_COLUMNS, 0))
+    for table, (count_col, sum_col, source_col) in db.ROLLUPS.items():
+        for rows in db.iter_rows(table):
+            for values in rows:
+                record = dict(zip(db.COLUMNS[table], values))
+                day = summary[record["date"]]
+                day[count_col] += 1
+                if sum_col:
+                    day[sum_col] += record[source_col] or 0
+    routines = Counter((day, routine) for rows in db.iter_rows("exercises") for routine, day in rows)
+    return dict(summary), dict(routines)
+
+
+def _check_rollups():
+    summary, routines = _rollups()
+    expected, expected_routines = _expected_rollups()
+    assert summary.keys() == expected.keys()
+    for day, columns in expected.items():
+        for column, value in columns.items():
+            assert math.isclose(summary[day][column], value, rel_tol=1e-9, abs_tol=1e-6), (day, column)
+    assert routines == expected_routines
+
+
+@pytest.fixture
+def check_rollups():
+    """Assert that the rollups add up to the entries, archived and live."""
+    return _check_rollups
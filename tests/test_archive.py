@@ -0,0 +1,144 @@
+import threading
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import archive
+import db
+
+
+def _ago(days):
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+def _frames(start=None, end=None):
+    return {table: getattr(db, f"fetch_{table}")(start, end) for table in db.TABLES}
+
+
+def _rows(table):
+    # Entries of one day may come back in any order.
+    return sorted((row for rows in db.iter_rows(table) for row in rows), key=str)
+
+
+def _sorted(frame):
+    # Entries of one day may come back in any order, and archived labels
+    # get their own category order; only the values have to match.
+    labels = {column: object for column, dtype in frame.dtypes.items() if dtype == "category"}
+    return frame.astype(labels).sort_values(list(frame.columns), ignore_index=True)
+
+
+def assert_same_frames(got, expected):
+    for table, frame in expected.items():
+        assert got[table].dtypes.to_dict() == frame.dtypes.to_dict(), table
+        assert got[table]["date"].is_monotonic_increasing, table
+        pd.testing.assert_frame_equal(_sorted(got[table]), _sorted(frame), obj=table)
+
+
+def test_compact_moves_old_entries(history):
+    moved = archive.compact(_ago(100))
+    manifest = archive.manifest()
+    with db.connection() as conn:
+        for table in db.TABLES:
+            assert conn.execute(f"SELECT COUNT(*) FROM {table} WHERE date < ?", (_ago(100),)).fetchone()[0] == 0
+            assert moved[table] == manifest[table].rows > 0
+            assert manifest[table].through == _ago(100)
+
+
+@pytest.mark.parametrize("start, end", [(None, None), (_ago(150), _ago(50)), (_ago(120), None), (None, _ago(300))])
+def test_fetches_merge_archived_and_live_rows(history, start, end):
+    expected = _frames(start, end)
+    rows = {table: _rows(table) for table in db.TABLES}
+    archive.compact(_ago(100))
+    assert_same_frames(_frames(start, end), expected)
+    # NULL calories and descriptions come back as None, not NaN or a code.
+    assert {table: _rows(table) for table in db.TABLES} == rows
+
+
+def test_iter_frames_match_fetch(history):
+    archive.compact(_ago(100))
+    chunks = list(db.iter_frames("water", chunk_size=100))
+    assert len(chunks) > 2
+    pd.testing.assert_frame_equal(_sorted(pd.concat(chunks, ignore_index=True)), _sorted(db.fetch_water()))
+
+
+def test_compact_again_keeps_dates_in_order(history):
+    archive.compact(_ago(300))
+    # Logged after the first compaction for a day it already archived.
+    db.insert_weight(170.0, _ago(350))
+    db.insert_exercise("Full Body", _ago(350))
+    expected = _frames()
+    archive.compact(_ago(100))
+    manifest = archive.manifest()
+    assert manifest["weights"].generation == 2
+    assert manifest["weights"].through == _ago(100)
+    got = _frames()
+    assert_same_frames(got, expected)
+    assert "Full Body" in set(got["exercises"]["routine"])
+
+
+def test_latest_weight_from_archive(history):
+    db.insert_weight(150.0, _ago(450))
+    db.insert_weight(175.0, date.today() + timedelta(days=1))
+    archive.compact(_ago(100))
+    assert db.fetch_latest_weight(_ago(420)) == 150.0
+    assert db.fetch_latest_weight(_ago(460)) is None
+    assert db.fetch_latest_weight() == 175.0
+    archive.compact(date.today() + timedelta(days=2))
+    assert db.fetch_latest_weight() == 175.0
+
+
+def test_rollups_after_compaction(history, check_rollups):
+    summary = db.fetch_summary()
+    daily = db.fetch_daily()
+    archive.compact(_ago(100))
+    check_rollups()
+    # Rebuilding recomputes live days and keeps the archived days' rollups.
+    db.rebuild_daily_summary()
+    check_rollups()
+    assert db.fetch_summary() == summary
+    dates, values = db.fetch_daily()
+    assert (dates == daily[0]).all() and (values == daily[1]).all()
+
+
+def test_food_history_counts_archived_meals(history):
+    archive.compact(_ago(100))
+    db.rebuild_daily_summary()
+    banana = [match for match in db.search_foods("bana") if match.description == "Banana"]
+    assert banana and banana[0].uses == 400
+
+
+@pytest.mark.parametrize("iterate", [db.iter_rows, db.iter_frames])
+def test_iterators_read_one_snapshot(history, iterate):
+    archive.compact(_ago(300))
+    expected, frame = _rows("water"), db.fetch_water()
+    chunks = iterate("water", chunk_size=100)
+    first = [next(chunks)]
+    # Compacted again after the first archived chunk, before the live rows are read.
+    moved = {}
+
+    def compact():
+        db.use_database(history)
+        moved.update(archive.compact(_ago(100)))
+
+    thread = threading.Thread(target=compact)
+    thread.start()
+    thread.join()
+    assert moved["water"] > 0
+    chunks = first + list(chunks)
+    if iterate is db.iter_frames:
+        pd.testing.assert_frame_equal(_sorted(pd.concat(chunks, ignore_index=True)), _sorted(frame))
+    else:
+        assert sorted((row for rows in chunks for row in rows), key=str) == expected
+
+
+def test_categories_are_parsed_once_per_generation(history):
+    archive.compact(_ago(300))
+    with db.connection() as conn:
+        first = archive.get_entry(conn, "activities")
+        assert archive.get_entry(conn, "activities").categories is first.categories
+        archive.compact(_ago(100))
+        second = archive.get_entry(conn, "activities")
+    assert second.generation == 2 and second.categories is not first.categories
+    assert second.categories == archive.manifest()["activities"].categories
+    assert sorted(second.categories["type"]) == ["Run", "Walk"]
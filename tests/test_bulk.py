@@ -0,0 +1,48 @@
+import pytest
+
+import bulk
+import db
+
+
+def _rows(table):
+    # Entries of one day may come back in any order.
+    return sorted((row for rows in db.iter_rows(table) for row in rows), key=str)
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return sorted(f)
+
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl", "parquet"])
+def test_export_import_round_trip(history, tmp_path, fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    expected = {table: _rows(table) for table in db.TABLES}
+    for table in db.TABLES:
+        report = bulk.export_file(table, str(tmp_path / f"{table}.{fmt}"), chunk_size=500)
+        assert report.rows == len(expected[table])
+
+    db.use_database(str(tmp_path / "copy.db"))
+    db.init_db()
+    for table in db.TABLES:
+        report = bulk.import_file(table, str(tmp_path / f"{table}.{fmt}"), chunk_size=500)
+        assert (report.rows, report.rejected) == (len(expected[table]), 0)
+        assert _rows(table) == expected[table], table
+        # Exporting the copy gives the same file back.
+        again = str(tmp_path / f"again.{fmt}")
+        bulk.export_file(table, again)
+        if fmt != "parquet":
+            assert _read(again) == _read(str(tmp_path / f"{table}.{fmt}"))
+
+
+def test_import_rejects_invalid_records(database, tmp_path):
+    path = tmp_path / "weights.jsonl"
+    path.write_text(
+        '{"weight": 170, "date": "2024-01-01"}\n[1, 2]\n{"weight": 1\n'
+        '{"weight": NaN, "date": "2024-01-02"}\n{"date": "2024-01-03"}\n{"weight": 172, "date": "2024-01-05"}\n'
+    )
+    report = bulk.import_file("weights", str(path))
+    assert (report.rows, report.rejected) == (2, 4)
+    assert [line for line, _ in report.errors] == [2, 3, 4, 5]
+    assert _rows("weights") == [(170.0, "2024-01-01"), (172.0, "2024-01-05")]
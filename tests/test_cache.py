@@ -0,0 +1,65 @@
+import subprocess
+import sys
+import threading
+
+import db
+
+ROOT = sys.path[0]
+
+
+def _cached(fetch):
+    hits = db.query_cache.hits
+    fetch()
+    return db.query_cache.hits == hits + 1
+
+
+def test_commit_by_another_process_drops_cached_results(database):
+    db.insert_weight(180.0, "2026-01-01")
+    assert len(db.fetch_weights()) == 1 and db.fetch_summary()["weight_count"] == 1
+    subprocess.run([sys.executable, "-c", (
+        f"import sys; sys.path.insert(0, {ROOT!r}); import db; "
+        f"db.use_database({database!r}); db.insert_weight(170.0, '2026-01-02')"
+    )], check=True)
+    assert len(db.fetch_weights()) == 2
+    assert db.fetch_summary()["weight_count"] == 2
+    assert db.fetch_latest_weight() == 170.0
+    assert _cached(db.fetch_weights)
+
+
+def test_own_writes_only_drop_the_tables_they_touch(database):
+    db.fetch_weights()
+    db.insert_water(8.0, "2026-01-02")
+    assert _cached(db.fetch_weights)
+
+
+def test_own_writes_on_another_pooled_connection(database):
+    db.fetch_weights()
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        db.use_database(database)
+        with db.connection():
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    try:
+        # The other thread has the pooled connection, so this insert gets a second one.
+        db.insert_water(8.0, "2026-01-02")
+        assert db.connection_stats()["lent"] == 1
+    finally:
+        release.set()
+        thread.join()
+    assert _cached(db.fetch_weights)
+    assert db.fetch_summary()["water_count"] == 1
+
+
+def test_own_write_behind_commits(database, monkeypatch):
+    monkeypatch.setattr(db, "WRITE_BEHIND", True)
+    db.fetch_weights()
+    db.wait_for_write(db.insert_water(8.0, "2026-01-02"))
+    assert _cached(db.fetch_weights)
+    db.wait_for_write(db.insert_weight(170.0, "2026-01-02"))
+    assert len(db.fetch_weights()) == 1
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import charts
+
+
+@pytest.mark.parametrize("n", [5, 999, 1000, 1001, 1003, 4321, 100_000])
+@pytest.mark.parametrize("max_points", [4, 5, 7, 1000])
+def test_minmax_indices_bound_and_extremes(n, max_points):
+    values = np.random.default_rng(n).normal(size=n)
+    kept = charts.minmax_indices(values, max_points)
+    assert len(kept) <= max_points
+    assert (np.diff(kept) > 0).all()
+    assert {0, n - 1, values.argmin(), values.argmax()} <= set(kept)
+
+
+def test_minmax_indices_needs_room_for_the_ends():
+    with pytest.raises(ValueError):
+        charts.minmax_indices(np.arange(10.0), 3)
+
+
+def test_downsample_keeps_a_spike():
+    series = pd.Series(np.ones(10_000), index=pd.date_range("2000-01-01", periods=10_000))
+    series.iloc[1234] = 50.0
+    small = charts.downsample(series, 100)
+    assert len(small) <= 100 and small.max() == 50.0
+    assert small.index.is_monotonic_increasing
+    assert len(charts.downsample(series.iloc[:50], 100)) == 50
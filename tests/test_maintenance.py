@@ -0,0 +1,105 @@
+from datetime import date, timedelta
+
+import pytest
+
+import archive
+import db
+import maintenance
+from conftest import HISTORY_DAYS, REPLY
+
+KEEP_DAYS = 100
+# Days of history older than the retention cutoff.
+OLD_DAYS = HISTORY_DAYS - KEEP_DAYS - 1
+
+
+def _ago(days):
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+def _retain(path, policies):
+    with db.connection(path) as conn:
+        return maintenance.apply_retention(conn, path, policies)
+
+
+def _count(table, where="", params=()):
+    with db.connection() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table} {where}", params).fetchone()[0]
+
+
+def test_parse_retention():
+    assert maintenance.parse_retention(" foods=trim:90, weights=daily:365,fastings=delete:1825 ") == {
+        "foods": ("trim", 90), "weights": ("daily", 365), "fastings": ("delete", 1825),
+    }
+    assert maintenance.parse_retention("") == {}
+    for spec in ("weights=daily", "weights:daily:1", "steps=delete:1", "weights=trim:1",
+                 "exercises=daily:1", "foods=shred:1"):
+        with pytest.raises(ValueError):
+            maintenance.parse_retention(spec)
+
+
+def test_delete(history, check_rollups):
+    changed = _retain(history, {"fastings": ("delete", KEEP_DAYS), "exercises": ("delete", KEEP_DAYS)})
+    assert changed["fastings"] == OLD_DAYS
+    assert _count("fastings", "WHERE date < ?", (_ago(KEEP_DAYS),)) == 0
+    assert _count("fastings") == KEEP_DAYS + 1
+    assert _count("exercises", "WHERE date < ?", (_ago(KEEP_DAYS),)) == 0
+    check_rollups()
+
+
+def test_daily(history, check_rollups):
+    summary = db.fetch_summary()
+    changed = _retain(history, {table: ("daily", KEEP_DAYS) for table in maintenance.DAILY})
+    # Two weights and two water entries a day become one and two walks and a
+    # run one of each; there is only one fasting a day to begin with.
+    assert changed == {"weights": OLD_DAYS, "activities": OLD_DAYS, "water": OLD_DAYS}
+    old = (_ago(KEEP_DAYS),)
+    with db.connection() as conn:
+        weights = conn.execute("SELECT date, COUNT(*), MIN(weight) FROM weights WHERE date < ? GROUP BY date", old)
+        for day, count, weight in weights:
+            i = (date.today() - date.fromisoformat(day)).days
+            assert count == 1 and weight == pytest.approx(180.3 - i / 100)
+        assert set(conn.execute("SELECT type, duration FROM activities WHERE date < ?", old)) == {
+            ("Walk", 30.0), ("Run", 15.0)
+        }
+        assert set(conn.execute("SELECT volume FROM water WHERE date < ?", old)) == {(24.0,)}
+    assert _count("weights", "WHERE date >= ?", old) == 2 * (KEEP_DAYS + 1)
+    check_rollups()
+    after = db.fetch_summary()
+    for column in ("activity_minutes", "water_volume", "fasting_hours", "food_calories"):
+        assert after[column] == pytest.approx(summary[column])
+    assert after["weight_count"] == summary["weight_count"] - OLD_DAYS
+
+
+def test_trim(history, check_rollups):
+    summary = db.fetch_summary()
+    changed = _retain(history, {"foods": ("trim", KEEP_DAYS)})
+    assert changed == {"foods": OLD_DAYS}
+    with db.connection() as conn:
+        old = set(conn.execute("SELECT description FROM foods WHERE date < ?", (_ago(KEEP_DAYS),)))
+        recent = set(conn.execute("SELECT description FROM foods WHERE date >= ?", (_ago(KEEP_DAYS),)))
+    assert old == {("Oatmeal with berries",), ("Banana",), (None,)}
+    assert recent == {(REPLY,), ("Banana",), (None,)}
+    # Trimming changes no amounts, and the food index is rebuilt.
+    assert db.fetch_summary() == summary
+    check_rollups()
+    assert "Oatmeal with berries" in {match.description for match in db.search_foods("oatm")}
+
+
+def test_archived_rows_are_left_alone(history, check_rollups):
+    archive.compact(_ago(300))
+    archived_days = HISTORY_DAYS - 301
+    changed = _retain(history, {"fastings": ("delete", KEEP_DAYS), "weights": ("daily", KEEP_DAYS)})
+    # Only the live days between the archive horizon and the cutoff.
+    assert changed == {"fastings": 300 - KEEP_DAYS, "weights": 300 - KEEP_DAYS}
+    assert len(db.fetch_fastings()) == archived_days + KEEP_DAYS + 1
+    assert len(db.fetch_weights(None, _ago(301))) == 2 * archived_days
+    check_rollups()
+
+
+def test_run_applies_retention_and_refreshes_cached_reads(history, check_rollups):
+    assert len(db.fetch_fastings()) == HISTORY_DAYS
+    report = maintenance.run({"fastings": ("delete", KEEP_DAYS)})
+    assert report.changed == {"fastings": OLD_DAYS}
+    assert report.freed_pages >= 0 and report.after.free_pages == 0
+    assert len(db.fetch_fastings()) == KEEP_DAYS + 1
+    check_rollups()
@@ -0,0 +1,51 @@
+import pytest
+
+import vision
+
+
+class RateLimited(Exception):
+    pass
+
+
+class FlakyBackend:
+    """Rate limited ``failures`` times, then replies."""
+
+    model = "flaky"
+    client_errors = ()
+    retry_errors = (RateLimited,)
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    def complete(self, prompt, image_bytes, mime):
+        return "".join(self.stream(prompt, image_bytes, mime))
+
+    def stream(self, prompt, image_bytes, mime):
+        if self.failures:
+            self.failures -= 1
+            raise RateLimited("slow down")
+        yield "re"
+        yield "ply"
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """Slots in use during each backoff, which doesn't actually sleep."""
+    monkeypatch.setattr(vision, "limiter", vision.Limiter())
+    monkeypatch.setattr(vision, "breaker", vision.CircuitBreaker())
+    in_flight = []
+    monkeypatch.setattr(vision.time, "sleep", lambda seconds: in_flight.append(vision.limiter.in_flight))
+    return in_flight
+
+
+@pytest.mark.parametrize("call", [vision.complete, lambda *args: "".join(vision.stream(*args))])
+def test_retries_hold_no_slot_while_backing_off(backoffs, call):
+    assert call(FlakyBackend(2), "prompt", b"image", "image/jpeg") == "reply"
+    assert backoffs == [0, 0]
+    assert vision.limiter.in_flight == 0
+
+
+def test_retries_give_up(backoffs):
+    with pytest.raises(RateLimited):
+        vision.complete(FlakyBackend(vision.MAX_RETRIES + 1), "prompt", b"image", "image/jpeg")
+    assert len(backoffs) == vision.MAX_RETRIES
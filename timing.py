@@ -0,0 +1,195 @@
+"""Wall-clock timing of script runs, fragments and other named sections.
+
+Samples are kept in memory per name (the most recent ``MAX_SAMPLES``) and
+shared by all sessions in the process. Every sample also lands in a
+cumulative latency histogram and, if the recording thread is inside a script
+run started with ``begin_run``, in that run's breakdown.
+
+``metrics_text`` renders the histograms, counters and registered gauges in
+the Prometheus text format. ``start_exporter`` publishes it to the file in
+``LITEWEIGHT_METRICS_FILE`` and/or on ``http://127.0.0.1:$LITEWEIGHT_METRICS_PORT/metrics``.
+"""
+import atexit
+import functools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_SAMPLES = 500
+# Upper bounds (seconds) of the latency histogram buckets.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_FILE = os.getenv("LITEWEIGHT_METRICS_FILE")
+METRICS_PORT = int(os.getenv("LITEWEIGHT_METRICS_PORT", "0"))
+METRICS_INTERVAL = 10.0
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+_histograms = defaultdict(lambda: [0] * (len(BUCKETS) + 1))  # name -> per-bucket counts, last is +Inf
+_sums = defaultdict(float)
+_counters = defaultdict(int)
+_gauges = {}  # prefix -> callable returning {name: number}
+_run = threading.local()
+_exporter_started = False
+
+
+def record(name, seconds):
+    bucket = next((i for i, bound in enumerate(BUCKETS) if seconds <= bound), len(BUCKETS))
+    with _lock:
+        _samples[name].append(seconds)
+        _histograms[name][bucket] += 1
+        _sums[name] += seconds
+    breakdown = getattr(_run, "breakdown", None)
+    if breakdown is not None:
+        breakdown.append((name, seconds))
+    log.debug("%s took %.1f ms", name, seconds * 1000)
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorator recording each call of the function under ``name``."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def increment(name, n=1):
+    with _lock:
+        _counters[name] += n
+
+
+def register_gauges(prefix, func):
+    """Export the numbers in ``func()`` (a dict) as ``liteweight_<prefix>_<key>`` gauges."""
+    _gauges[prefix] = func
+
+
+def begin_run():
+    """Start a fresh breakdown for the script run on this thread."""
+    _run.breakdown = []
+
+
+def run_breakdown():
+    """``[(name, seconds), ...]`` recorded on this thread since ``begin_run``, in order."""
+    return list(getattr(_run, "breakdown", None) or ())
+
+
+def samples(name):
+    with _lock:
+        return list(_samples.get(name, ()))
+
+
+def summary():
+    """``{name: {"count", "last_ms", "mean_ms", "p95_ms"}}`` over the kept samples."""
+    with _lock:
+        snapshot = {name: sorted(values) for name, values in _samples.items() if values}
+    return {
+        name: {
+            "count": len(values),
+            "last_ms": _samples[name][-1] * 1000,
+            "mean_ms": sum(values) / len(values) * 1000,
+            "p95_ms": values[min(len(values) - 1, int(0.95 * len(values)))] * 1000,
+        }
+        for name, values in snapshot.items()
+    }
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _histograms.clear()
+        _sums.clear()
+        _counters.clear()
+
+
+def metrics_text():
+    """Everything recorded since startup (or ``reset``) in the Prometheus text format."""
+    with _lock:
+        histograms = {name: list(counts) for name, counts in _histograms.items()}
+        sums = dict(_sums)
+        counters = dict(_counters)
+    lines = ["# TYPE liteweight_duration_seconds histogram"]
+    for name, counts in sorted(histograms.items()):
+        total = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), counts):
+            total += count
+            lines.append(f'liteweight_duration_seconds_bucket{{name="{name}",le="{bound}"}} {total}')
+        lines.append(f'liteweight_duration_seconds_sum{{name="{name}"}} {sums[name]:.6f}')
+        lines.append(f'liteweight_duration_seconds_count{{name="{name}"}} {total}')
+    lines.append("# TYPE liteweight_events_total counter")
+    lines.extend(f'liteweight_events_total{{name="{name}"}} {n}' for name, n in sorted(counters.items()))
+    for prefix, func in sorted(_gauges.items()):
+        try:
+            values = func()
+        except Exception as e:
+            log.warning("metrics gauge %s failed: %s", prefix, e)
+            continue
+        for key, value in sorted(values.items()):
+            lines.append(f"# TYPE liteweight_{prefix}_{key} gauge")
+            lines.append(f"liteweight_{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path):
+    # Write then rename so a scraper never reads a half-written file.
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(metrics_text())
+    os.replace(tmp, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _write_periodically(path):
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        try:
+            write_metrics(path)
+        except OSError as e:
+            log.warning("could not write metrics to %s: %s", path, e)
+
+
+def start_exporter():
+    """Publish ``metrics_text`` as configured by the environment; safe to call on every rerun."""
+    global _exporter_started
+    with _lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+    if METRICS_FILE:
+        threading.Thread(target=_write_periodically, args=(METRICS_FILE,), name="metrics-file", daemon=True).start()
+        atexit.register(write_metrics, METRICS_FILE)
+    if METRICS_PORT:
+        server = ThreadingHTTPServer(("127.0.0.1", METRICS_PORT), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        log.info("serving metrics on http://127.0.0.1:%d/metrics", METRICS_PORT)
@@ -0,0 +1,61 @@
+"""Which database a Streamlit session reads and writes.
+
+With ``LITEWEIGHT_DATA_DIR`` set every user gets their own SQLite file
+under it (``db.user_database``): users never wait on each other's write
+lock, and a dashboard only ever reads its own user's rows. Without it every
+session shares ``db.DB_NAME``, as before.
+
+The user is the first of: the ``LITEWEIGHT_USER_HEADER`` request header
+(for deployments behind an authenticating proxy) and the email of a user
+signed in with ``st.login``. A session with neither is refused rather than
+given a shared database. ``?user=`` in the URL is only honoured with
+``LITEWEIGHT_URL_USER=1``: anyone can type any name there, so it is for
+trusted setups (local use, load tests), not authentication.
+"""
+import os
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+import db
+
+USER_HEADER = os.getenv("LITEWEIGHT_USER_HEADER")
+# Take the user from ?user= when nothing authenticates the session.
+URL_USER = os.getenv("LITEWEIGHT_URL_USER", "0") == "1"
+
+_SESSION_KEY = "_liteweight_db"
+
+
+def session_user():
+    """This session's user, or None if nothing identifies it."""
+    if USER_HEADER:
+        value = st.context.headers.get(USER_HEADER)
+        if value:
+            return value
+    if st.user.get("is_logged_in"):
+        return st.user.get("email") or st.user.get("sub")
+    if URL_USER:
+        return st.query_params.get("user") or None
+    return None
+
+
+def select_database():
+    """Point this session's db calls at its user's database; call at the top of every run."""
+    if db.DATA_DIR:
+        user = session_user()
+        if user is None:
+            st.session_state.pop(_SESSION_KEY, None)
+            st.error("Sign in to use LiteWeight.")
+            st.stop()
+        st.session_state[_SESSION_KEY] = db.user_database(user)
+
+
+def _session_database():
+    # Fragment reruns start on a fresh thread without running the top of the
+    # script, so the database is looked up from the session, not the thread.
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    return st.session_state.get(_SESSION_KEY)
+
+
+db.set_database_resolver(_session_database)
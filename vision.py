@@ -0,0 +1,329 @@
+"""Vision backends for food photo analysis, and the guards around every call.
+
+A backend answers a prompt about a prepared image, either with the whole
+reply (``complete``) or as text deltas (``stream``). ``LITEWEIGHT_VISION_BACKEND``
+picks one of:
+
+- ``openai`` (default): chat completions through the pinned ``openai==0.28``
+  client. ``OPENAI_API_BASE`` points it elsewhere, e.g. at the local stub
+  server in ``benchmarks/stub_server.py``.
+- ``stub``: a deterministic reply made in-process, for tests and load runs
+  that must not touch the network.
+
+Others are added with ``register_backend``.
+
+Requests go through ``complete()``/``stream()`` here, which run each try
+inside ``guarded()``, so one slow dependency can't tie up every Streamlit
+worker thread:
+
+- every request has connect and read timeouts;
+- at most ``MAX_CONCURRENT`` requests are in flight per process, across all
+  sessions; a caller that gets no slot within ``QUEUE_TIMEOUT`` seconds is
+  refused with ``Overloaded``;
+- after ``FAILURE_THRESHOLD`` failures in a row the circuit opens and calls
+  fail at once with ``CircuitOpen``; after ``RESET_SECONDS`` one trial call
+  is let through, and its outcome closes or reopens the circuit;
+- a backend's ``retry_errors`` (rate limits, say) are retried up to
+  ``MAX_RETRIES`` times with exponential backoff, without holding a slot
+  while waiting.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from timing import increment, record, register_gauges
+
+BACKEND = os.getenv("LITEWEIGHT_VISION_BACKEND", "openai")
+MODEL = os.getenv("LITEWEIGHT_VISION_MODEL", "gpt-4o")
+MAX_TOKENS = 400
+
+CONNECT_TIMEOUT = float(os.getenv("LITEWEIGHT_ANALYSIS_CONNECT_TIMEOUT", "5"))
+# Longest wait for the next bytes of a reply (or the next streamed chunk).
+READ_TIMEOUT = float(os.getenv("LITEWEIGHT_ANALYSIS_TIMEOUT", "30"))
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 1.0
+
+MAX_CONCURRENT = int(os.getenv("LITEWEIGHT_ANALYSIS_CONCURRENCY", "4"))
+QUEUE_TIMEOUT = float(os.getenv("LITEWEIGHT_ANALYSIS_QUEUE_TIMEOUT", "3"))
+FAILURE_THRESHOLD = 5
+RESET_SECONDS = 30.0
+
+log = logging.getLogger(__name__)
+
+
+class Unavailable(Exception):
+    """The vision backend is not taking requests right now."""
+
+
+class CircuitOpen(Unavailable):
+    pass
+
+
+class Overloaded(Unavailable):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_seconds=RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.failures = 0  # in a row
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def _refuse_if_open(self):
+        if self.opened_at is None:
+            return
+        remaining = self.opened_at + self.reset_seconds - time.monotonic()
+        if remaining > 0 or self._trial:
+            increment("vision.fast_failures")
+            raise CircuitOpen(
+                f"photo analysis is paused after {self.failures} failed requests; "
+                f"try again in {max(remaining, 1):.0f}s"
+            )
+
+    def check(self):
+        """Raise ``CircuitOpen`` if calls are being refused."""
+        with self._lock:
+            self._refuse_if_open()
+
+    def allow(self):
+        """Like ``check``, but claims the trial call if one is due; True if it did."""
+        with self._lock:
+            self._refuse_if_open()
+            if self.opened_at is None:
+                return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    log.warning("vision circuit opened after %d failures in a row", self.failures)
+                    increment("vision.circuit_opened")
+                self.opened_at = time.monotonic()
+
+    def end_trial(self):
+        with self._lock:
+            self._trial = False
+
+
+class Limiter:
+    def __init__(self, max_concurrent=MAX_CONCURRENT, queue_timeout=QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def acquire(self):
+        start = time.perf_counter()
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        record("vision.queue_wait", time.perf_counter() - start)
+        if not acquired:
+            increment("vision.rejected")
+            raise Overloaded(f"photo analysis is busy ({self.max_concurrent} requests in progress); try again shortly")
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+
+breaker = CircuitBreaker()
+limiter = Limiter()
+
+
+def stats():
+    return {
+        "in_flight": limiter.in_flight,
+        "max_concurrent": limiter.max_concurrent,
+        "circuit_open": int(breaker.is_open),
+        "consecutive_failures": breaker.failures,
+    }
+
+
+register_gauges("vision", stats)
+
+
+@contextmanager
+def guarded(client_errors=()):
+    """Run one backend request under the circuit breaker and concurrency limit.
+
+    Exceptions in ``client_errors`` are the request's own fault (a bad
+    image, say) and don't count against the backend.
+    """
+    breaker.check()  # fail fast without queueing for a slot
+    limiter.acquire()
+    try:
+        # The circuit may have opened while this call waited for a slot.
+        trial = breaker.allow()
+    except CircuitOpen:
+        limiter.release()
+        raise
+    try:
+        yield
+    except client_errors:
+        breaker.success()
+        raise
+    except Exception:
+        breaker.failure()
+        raise
+    else:
+        breaker.success()
+    finally:
+        if trial:
+            breaker.end_trial()
+        limiter.release()
+
+
+def _retry_errors(backend):
+    return getattr(backend, "retry_errors", ())
+
+
+def _backoff(attempt, error):
+    # Exponential backoff with jitter so parallel requests don't retry in lockstep.
+    delay = BACKOFF_SECONDS * 2 ** attempt * (0.5 + random.random())
+    log.warning("analysis rate limited (%s), retrying in %.1fs", error, delay)
+    time.sleep(delay)
+
+
+def complete(backend, prompt, image_bytes, mime):
+    """``backend.complete(...)`` under ``guarded()``, retrying ``backend.retry_errors``.
+
+    Each try takes its own slot; none is held while backing off.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            with guarded(backend.client_errors):
+                return backend.complete(prompt, image_bytes, mime)
+        except _retry_errors(backend) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            _backoff(attempt, e)
+
+
+def stream(backend, prompt, image_bytes, mime):
+    """Like ``complete`` for ``backend.stream(...)``; a try holds its slot until the
+    reply ends, and is only retried if it failed before its first delta."""
+    for attempt in range(MAX_RETRIES + 1):
+        started = False
+        try:
+            with guarded(backend.client_errors):
+                for delta in backend.stream(prompt, image_bytes, mime):
+                    started = True
+                    yield delta
+                return
+        except _retry_errors(backend) as e:
+            if started or attempt == MAX_RETRIES:
+                raise
+            _backoff(attempt, e)
+
+
+class OpenAIBackend:
+    """Chat completions with the image inlined as a data URL."""
+
+    def __init__(self, model=MODEL, max_tokens=MAX_TOKENS, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        import openai
+
+        self._openai = openai
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = (connect_timeout, read_timeout)
+        self.client_errors = (openai.error.InvalidRequestError,)
+        self.retry_errors = (openai.error.RateLimitError, openai.error.ServiceUnavailableError)
+
+    def _create(self, prompt, image_bytes, mime, stream):
+        base64_image = base64.b64encode(image_bytes).decode("ascii")
+        return self._openai.ChatCompletion.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": [ {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{base64_image}"} } ] }
+            ],
+            max_tokens=self.max_tokens,
+            request_timeout=self.timeout,
+            stream=stream,
+        )
+
+    def complete(self, prompt, image_bytes, mime):
+        response = self._create(prompt, image_bytes, mime, stream=False)
+        return response["choices"][0]["message"]["content"]
+
+    def stream(self, prompt, image_bytes, mime):
+        for chunk in self._create(prompt, image_bytes, mime, stream=True):
+            delta = chunk["choices"][0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+
+def stub_reply(data):
+    """The stub's answer for ``data``: a fixed meal whose calories depend on its hash."""
+    digest = hashlib.sha256(data).digest()
+    return json.dumps({"description": "stub meal", "calories": 200 + digest[0] * 4, "confidence": 0.8})
+
+
+class StubBackend:
+    """Deterministic replies without network access, after an optional simulated delay."""
+
+    model = "stub"
+    client_errors = ()
+
+    def __init__(self, latency_ms=0.0, token_ms=0.0):
+        self.latency = latency_ms / 1000
+        self.token_delay = token_ms / 1000
+
+    def complete(self, prompt, image_bytes, mime):
+        return "".join(self.stream(prompt, image_bytes, mime))
+
+    def stream(self, prompt, image_bytes, mime):
+        time.sleep(self.latency)
+        content = stub_reply(image_bytes)
+        for i in range(0, len(content), 4):
+            time.sleep(self.token_delay)
+            yield content[i:i + 4]
+
+
+_factories = {"openai": OpenAIBackend, "stub": StubBackend}
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    """Make ``factory()`` (returning an object with ``model``, ``client_errors``,
+    ``complete`` and ``stream``, and optionally ``retry_errors``) available as backend ``name``."""
+    with _instances_lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+
+
+def backend(name=None):
+    """The shared instance of backend ``name`` (default ``BACKEND``)."""
+    name = name or BACKEND
+    with _instances_lock:
+        instance = _instances.get(name)
+        if instance is None:
+            if name not in _factories:
+                raise ValueError(f"Unknown vision backend {name!r}; choose from {', '.join(sorted(_factories))}")
+            instance = _instances[name] = _factories[name]()
+    return instance